@@ -0,0 +1,138 @@
+# benchmarks for the saddlepoint and CGF hot path, in the style of asv
+# (airspeed velocity). Each class sets up synthetic genes of a range of sizes
+# in setup(), then times each time_* method. Run these with asv, or with
+# benchmarks/run.py, which also compares against stored baselines.
+
+import os
+
+import numpy
+from numpy.random import RandomState
+
+from fitDNM.approximate import approximate
+from fitDNM.cumulant_generating_functions import cgf_0, cgf_2, CGFKernel
+from fitDNM.gene_enrichment import enrichment
+from fitDNM.open_severity import get_cadd_severity
+from fitDNM.saddlepoint import saddlepoint
+from fitDNM.solver import solve_s_u
+
+SIZES = [1000, 10000, 100000]
+
+def synthetic_gene(sites, high=False, seed=0):
+    ''' make per site rates and weights for a synthetic gene
+    
+    Args:
+        sites: number of site-alleles in the gene
+        high: whether to use high weights, which overflow exp(weight * mu)
+            unless the CGF sums are rescaled
+        seed: seed for the random number generator
+    
+    Returns:
+        tuple of (lambdas, weights) arrays
+    '''
+    state = RandomState(seed)
+    # expected mutations per site, for a cohort of 2000 probands
+    lambdas = 10**state.normal(size=sites, loc=-8, scale=0.5) * 4000
+    weights = state.uniform(low=0, high=30, size=sites)
+    if high:
+        weights *= 40
+    return lambdas, weights
+
+class CGF:
+    ''' time the CGF and its second derivative
+    '''
+    params = SIZES
+    param_names = ['sites']
+    
+    def setup(self, sites):
+        self.lambdas, self.weights = synthetic_gene(sites)
+        self.mu = numpy.linspace(0.01, 0.5, 16)
+        self.s = numpy.full(16, -1.0)
+    
+    # cgf_0 and cgf_2 only evaluate a single mu and s value
+    def time_cgf_0(self, sites):
+        cgf_0(self.mu[8], self.s[8], self.lambdas, self.weights)
+    
+    def time_cgf_2(self, sites):
+        cgf_2(self.mu[8], self.s[8], self.lambdas, self.weights)
+    
+    def time_kernel_evaluate(self, sites):
+        CGFKernel(self.lambdas, self.weights).evaluate(self.mu, self.s)
+
+class Solver:
+    ''' time solving for s and mu
+    '''
+    params = SIZES
+    param_names = ['sites']
+    
+    def setup(self, sites):
+        self.lambdas, self.weights = synthetic_gene(sites)
+        self.kernel = CGFKernel(self.lambdas, self.weights)
+        self.high = synthetic_gene(sites, high=True)
+    
+    def time_solve_s_u(self, sites):
+        solve_s_u(2, 50, self.lambdas, self.weights, kernel=self.kernel)
+    
+    def time_solve_s_u_high_weights(self, sites):
+        solve_s_u(2, 2000, *self.high)
+
+class Approximate:
+    ''' time the conditional approximation, including where w_part is near
+    zero. The default solver takes the analytic limit there (mean_limit_p()),
+    while the legacy solver nudges the observed score away from the mean in
+    avoid_zero_w_part(), which loops.
+    '''
+    params = SIZES
+    param_names = ['sites']
+    
+    def setup(self, sites):
+        self.lambdas, self.weights = synthetic_gene(sites)
+        self.kernel = CGFKernel(self.lambdas, self.weights)
+        # w_part is zero when y matches the mean score of x de novos
+        self.mean = (self.lambdas * self.weights).sum() / self.lambdas.sum()
+    
+    def time_approximate(self, sites):
+        approximate(2, 50, self.lambdas, self.weights, kernel=self.kernel)
+    
+    def time_approximate_zero_w_part(self, sites):
+        approximate(2, 2 * self.mean, self.lambdas, self.weights,
+            kernel=self.kernel)
+    
+    def time_approximate_zero_w_part_legacy(self, sites):
+        approximate(2, 2 * self.mean, self.lambdas, self.weights,
+            kernel=self.kernel, method='legacy')
+
+class Saddlepoint:
+    ''' time the full saddlepoint p-value
+    '''
+    params = SIZES
+    param_names = ['sites']
+    
+    def setup(self, sites):
+        self.lambdas, self.weights = synthetic_gene(sites)
+        self.high = synthetic_gene(sites, high=True)
+    
+    def time_saddlepoint(self, sites):
+        saddlepoint(50, self.lambdas, self.weights)
+    
+    def time_saddlepoint_high_weights(self, sites):
+        saddlepoint(2000, *self.high)
+
+class Enrichment:
+    ''' time scoring a gene end to end, from the bundled CADD file
+    '''
+    def setup(self):
+        path = os.path.join(os.path.dirname(__file__), '..', 'tests', 'data',
+            'cadd.txt.gz')
+        self.severity = get_cadd_severity('GENE1', '11', 59210641, 59211589, path)
+        
+        # synthetic rates at every CADD site, as the real rates need Ensembl
+        state = RandomState(0)
+        self.rates = self.severity[['gene', 'chrom', 'pos', 'ref', 'alt']].copy()
+        self.rates['prob'] = 10**state.normal(size=len(self.rates), loc=-8, scale=0.5)
+        self.rates['consequence'] = 'missense'
+        
+        top = self.severity.sort_values('score').tail(3)
+        self.de_novos = top[['gene', 'chrom', 'pos', 'ref', 'alt']].reset_index(drop=True)
+    
+    def time_enrichment(self):
+        enrichment(self.de_novos, 1000, 1000, 'GENE1', self.severity, self.rates)
@@ -0,0 +1,100 @@
+''' run the benchmarks without asv, and compare to stored baseline timings
+
+Usage:
+    python benchmarks/run.py                      # print timings
+    python benchmarks/run.py --save baseline.json # store new baselines
+    python benchmarks/run.py --compare benchmarks/baseline.json
+
+Timings are the fastest of several repeats, in seconds. Comparisons flag
+benchmarks which are slower than the baseline by more than --threshold, and
+exit with an error if any are.
+'''
+
+import argparse
+import inspect
+import json
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks import benchmarks
+
+def get_options():
+    parser = argparse.ArgumentParser(description='Run the fitDNM benchmarks.')
+    parser.add_argument('--filter', default='', help='Only run benchmarks '
+        'whose names match this regular expression.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of '
+        'times to time each benchmark.')
+    parser.add_argument('--save', help='Path to write timings to, as JSON.')
+    parser.add_argument('--compare', help='Path to baseline timings (JSON) to '
+        'compare against.')
+    parser.add_argument('--threshold', type=float, default=1.5, help='Ratio '
+        'to the baseline timing beyond which a benchmark counts as slower.')
+    return parser.parse_args()
+
+def find_benchmarks(pattern):
+    ''' find every time_* method of the benchmark classes, with each param
+    
+    Yields:
+        tuples of (name, class, method name, param), where param is None for
+        unparametrised benchmarks.
+    '''
+    for cls_name, cls in inspect.getmembers(benchmarks, inspect.isclass):
+        if cls.__module__ != benchmarks.__name__:
+            continue
+        params = getattr(cls, 'params', [None])
+        for method in sorted(x for x in dir(cls) if x.startswith('time_')):
+            for param in params:
+                name = f'{cls_name}.{method}'
+                if param is not None:
+                    name += f'({param})'
+                if re.search(pattern, name):
+                    yield name, cls, method, param
+
+def time_benchmark(cls, method, param, repeat):
+    ''' get the fastest time to run a benchmark, in seconds
+    '''
+    args = [] if param is None else [param]
+    bench = cls()
+    if hasattr(bench, 'setup'):
+        bench.setup(*args)
+    func = getattr(bench, method)
+    
+    # run enough times per repeat to get past timer resolution
+    timer = timeit.Timer(lambda: func(*args))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+def main():
+    args = get_options()
+    
+    baseline = {}
+    if args.compare is not None:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+    
+    timings = {}
+    slower = []
+    for name, cls, method, param in find_benchmarks(args.filter):
+        timings[name] = time_benchmark(cls, method, param, args.repeat)
+        line = f'{name:<55} {timings[name]:.3e} s'
+        if name in baseline:
+            ratio = timings[name] / baseline[name]
+            line += f'  x{ratio:.2f} of baseline'
+            if ratio > args.threshold:
+                line += '  SLOWER'
+                slower.append(name)
+        print(line)
+    
+    if args.save is not None:
+        with open(args.save, 'w') as handle:
+            json.dump(timings, handle, indent=2, sort_keys=True)
+    
+    if len(slower) > 0:
+        sys.exit(f'{len(slower)} benchmarks slower than baseline: {", ".join(slower)}')
+
+if __name__ == '__main__':
+    main()
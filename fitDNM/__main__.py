@@ -1,24 +1,146 @@
 
 import os
 import argparse
+import heapq
 import logging
 import sys
 
 import pandas
 
-from denovonear.__main__ import load_gencode
-from fitDNM.gene_enrichment import enrichment
-from fitDNM.mutation_rates import get_gene_rates
-from fitDNM.open_severity import get_cadd_severity
+from fitDNM.cohorts import read_cohorts
+from fitDNM.gene_cache import GeneCache
+from fitDNM.gene_sets import read_gene_sets, score_gene_sets
+from fitDNM.load_de_novos import group_de_novos
+from fitDNM.profiling import write_profiles
+from fitDNM.provenance import store_provenance, reuse_previous, read_previous
+from fitDNM.results import ResultWriter
+from fitDNM.scheduler import score_genes, score_cohorts, build_sites, build_null_curves
+from fitDNM.shards import gene_weights, assign_shards, write_manifest, merge_shards
+from fitDNM.solver import SOLVER_METHODS
 
-def get_options():
+def get_build_options(argv):
+    ''' parse the command line arguments for the build-sites subcommand
+    '''
+    
+    parser = argparse.ArgumentParser(prog='fitdnm build-sites',
+        description='Precompute harmonised per-gene site tables (mutation '
+        'rates and severity scores) into a site store.')
+    parser.add_argument('--genes', help='Path to file listing HGNC symbols, one '
+        'per line. Defaults to the genes in the --de-novos table.')
+    parser.add_argument('--de-novos', help='Path to table (or VCF) of de novos, '
+        'used to pick transcripts. Without this, genes use their canonical '
+        'transcript.')
+    parser.add_argument('--vcf-gene-key', default='GENE', help='INFO field '
+        'holding the HGNC symbol, for de novos in a VCF.')
+    parser.add_argument('--severity', required=True, help='Path to table of per '
+        'base and allele CADD severity scores.')
+    parser.add_argument('--gencode', help='Path to gencode annotations file.')
+    parser.add_argument('--fasta', help='Path to genome fasta file.')
+    parser.add_argument('--rates', help='Path to table of sequence context '
+        'based rates. Defaults to Kaitlin Samocha\'s trinucleotide-based rates.')
+    parser.add_argument('--output', required=True, help='Folder for the site store.')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of genes '
+        'to process in parallel, in separate processes.')
+    parser.add_argument("--genome-build", dest="genome_build", choices=["grch37",
+        "GRCh37", "grch38", "GRCh38"], default="grch37", help="Genome build " \
+        "that the coordinates are based on (GrCh37 or GRCh38")
+    parser.add_argument("--cache-folder", dest="cache_dir",
+        default=os.path.join(os.path.dirname(__file__), "cache"), help="folder " \
+        "to cache gene annotations and Ensembl responses into (defaults to clustering code directory)")
+    parser.add_argument('--offline', action='store_true', help='Only use '
+        'Ensembl responses already in --cache-folder, without any network '
+        'requests. Only used without --gencode.')
+    parser.add_argument('--ensembl-server', help='Base URL of a server to use '
+        'in place of the Ensembl REST servers, e.g. a local mirror.')
+    
+    args = parser.parse_args(argv)
+    if args.genes is None and args.de_novos is None:
+        parser.error('one of --genes or --de-novos is required')
+    
+    return args
+
+def weight_binning(value):
+    ''' parse the --weight-bins option, as 'exact' or a bin width
+    '''
+    if value == 'exact':
+        return value
+    try:
+        width = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'not "exact" or a number: {value}')
+    if width <= 0:
+        raise argparse.ArgumentTypeError(f'bin width must be positive: {value}')
+    return width
+
+def shard_spec(value):
+    ''' parse the --shard option, as K/N for shard K of N
+    '''
+    try:
+        shard, count = (int(x) for x in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'not K/N: {value}')
+    if not 1 <= shard <= count:
+        raise argparse.ArgumentTypeError(f'shard must be from 1 to {count}: {value}')
+    return shard, count
+
+def site_store(value):
+    ''' parse a --sites option, as the folder of an existing site store
+    '''
+    if not os.path.exists(os.path.join(value, 'index.txt')):
+        raise argparse.ArgumentTypeError(f'no site store in {value}, build one '
+            'with "fitdnm build-sites"')
+    return value
+
+def get_merge_options(argv):
+    ''' parse the command line arguments for the merge subcommand
+    '''
+    
+    parser = argparse.ArgumentParser(prog='fitdnm merge',
+        description='Concatenate the outputs from every shard of a run (from '
+        '"fitdnm --shard K/N"), checking no gene is missing or duplicated.')
+    parser.add_argument('inputs', nargs='+', help='Paths to the output of '
+        'each shard.')
+    parser.add_argument('--output', required=True, help='Path to write the '
+        'merged table to.')
+    
+    return parser.parse_args(argv)
+
+def get_null_options(argv):
+    ''' parse the command line arguments for the build-null subcommand
+    '''
+    
+    parser = argparse.ArgumentParser(prog='fitdnm build-null',
+        description='Precompute null p-value curves for the genes in a site '
+        'store, for one cohort size.')
+    parser.add_argument('--sites', required=True, type=site_store,
+        help='Path to a site store folder (from "fitdnm build-sites"). The '
+        'curves are saved into this.')
+    parser.add_argument('--males', type=int, required=True, help='number of males.')
+    parser.add_argument('--females', type=int, required=True, help='number of females.')
+    parser.add_argument('--genes', help='Path to file listing HGNC symbols, one '
+        'per line. Defaults to every gene in the store.')
+    parser.add_argument('--solver', choices=SOLVER_METHODS, default='newton',
+        help='Method to solve the saddlepoint equations.')
+    parser.add_argument('--tolerance', type=float, default=1e-3, help='Relative '
+        'error allowed when interpolating p-values from the curves, checked '
+        'against the saddlepoint at each grid point and interval midpoint. '
+        'Scores in intervals which miss this use the saddlepoint.')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of genes '
+        'to process in parallel, in separate processes.')
+    
+    return parser.parse_args(argv)
+
+def get_options(argv=None):
     ''' parse the command line arguments
     '''
     
     parser = argparse.ArgumentParser()
     parser.add_argument('--males', type=int, help='number of males.')
     parser.add_argument('--females', type=int, help='number of females.')
-    parser.add_argument('--de-novos', help='Path to table of de novos.')
+    parser.add_argument('--de-novos', help='Path to table of de novos, or to '
+        'a VCF of de novos. Either can be gzip or bgzip compressed.')
+    parser.add_argument('--vcf-gene-key', default='GENE', help='INFO field '
+        'holding the HGNC symbol, for de novos in a VCF.')
     parser.add_argument('--severity', help='Path to table of per base and allele CADD severity scores.')
     parser.add_argument('--gencode', help='Path to gencode annotations file.')
     parser.add_argument('--fasta', help='Path to genome fasta file.')
@@ -26,47 +148,308 @@ def get_options():
         'based rates. Defaults to Kaitlin Samocha\'s trinucleotide-based rates.')
     parser.add_argument('--output', help='Path to put output files into.',
         default=sys.stdout)
+    parser.add_argument('--solver', choices=SOLVER_METHODS, default='newton',
+        help='Method to solve the saddlepoint equations. "legacy" uses the '
+        'original fixed-step search, for checking results against.')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of genes '
+        'to score in parallel, in separate processes.')
+    parser.add_argument('--sites', type=site_store, help='Path to a site '
+        'store folder (from "fitdnm build-sites"). Genes are read from this, '
+        'rather than from --severity and --rates, and genes missing from the '
+        'store are skipped.')
+    parser.add_argument('--gene-sets', help='Path to a GMT file of gene sets '
+        '(or a file listing HGNC symbols, as one set). Each set is scored as '
+        'a whole, rather than scoring single genes. Requires --sites.')
+    parser.add_argument('--weight-bins', type=weight_binning, help='Collapse '
+        'sites before the saddlepoint. "exact" merges sites with identical '
+        'weights. A number bins weights to that width, and adds a '
+        'weight_shift column, the largest change to any site\'s weight, and a '
+        'score_shift column, the largest change to the score of any number '
+        'of de novos summed. The unbinned p-value lies between the binned '
+        'p-values at the observed score plus and minus score_shift.')
+    parser.add_argument('--cohorts', help='Path to tab-separated table of '
+        'cohorts to score, with name, males and females columns, and an '
+        'optional de_novos column of paths to each cohort\'s de novos '
+        '(otherwise --de-novos is used). Each gene is prepared once, then '
+        'scored in every cohort. Replaces --males and --females.')
+    parser.add_argument('--null-curves', action='store_true', help='Look up '
+        'p-values from null curves in the --sites store (from "fitdnm '
+        'build-null", with the same cohort size and solver), rather than '
+        'solving the saddlepoint for every gene.')
+    parser.add_argument('--tail', type=float, help='Sum the saddlepoint '
+        'over de novo counts up to where their Poisson tail falls below this '
+        '(e.g. 1e-12), relative to the smallest count that can reach the '
+        'observed score. Adds a tail_bound column, the most the omitted counts '
+        'could add to the p-value. Gene sets always do this, with 1e-12 '
+        'unless this is given.')
+    parser.add_argument('--screen-p', type=float, help='Skip the saddlepoint '
+        'for genes which cannot reach this p-value (e.g. 0.01), going by a '
+        'quick lower bound on the p-value. These genes report the bound as '
+        'their p-value. Adds a screened column, which is True for them.')
+    parser.add_argument('--previous', help='Path to output from an earlier '
+        'run with --sites. Genes whose de novos, sites, cohort size and '
+        'options are unchanged keep their earlier results, and only the other '
+        'genes are scored. Requires --sites.')
+    parser.add_argument('--resume', action='store_true', help='Keep the '
+        'genes already in --output (e.g. from a run that was killed), and '
+        'only score the rest. Rows are written as each gene finishes.')
+    parser.add_argument('--shard', type=shard_spec, help='Only score shard K '
+        'of N (as K/N, e.g. 2/10), for splitting a run over several jobs. '
+        'Genes are split so shards have similar total site counts. Each shard '
+        'writes its --output, plus a manifest, for "fitdnm merge".')
+    parser.add_argument('--profile-out', help='Path to write the wall time of '
+        'each stage, and solver counts, for every gene to. This is a JSON '
+        'list of records, or a tab-separated table if the path ends in .tsv.')
     
     parser.add_argument("--genome-build", dest="genome_build", choices=["grch37",
         "GRCh37", "grch38", "GRCh38"], default="grch37", help="Genome build " \
         "that the de novo coordinates are based on (GrCh37 or GRCh38")
     parser.add_argument("--cache-folder", dest="cache_dir",
-        default=os.path.join(os.path.dirname(__file__), "cache"), help="folder" \
-        "to cache Ensembl data into (defaults to clustering code directory)")
+        default=os.path.join(os.path.dirname(__file__), "cache"), help="folder " \
+        "to cache gene annotations and Ensembl responses into (defaults to clustering code directory)")
+    parser.add_argument('--offline', action='store_true', help='Only use '
+        'Ensembl responses already in --cache-folder, without any network '
+        'requests. Only used without --gencode.')
+    parser.add_argument('--ensembl-server', help='Base URL of a server to use '
+        'in place of the Ensembl REST servers, e.g. a local mirror.')
+    
+    args = parser.parse_args(argv)
+    if args.gene_sets is not None and args.sites is None:
+        parser.error('--gene-sets requires --sites')
+    if args.null_curves and args.sites is None:
+        parser.error('--null-curves requires --sites')
+    if args.cohorts is not None and (args.gene_sets or args.null_curves):
+        parser.error('--cohorts cannot be used with --gene-sets or --null-curves')
+    if args.tail is not None and args.cohorts:
+        parser.error('--tail cannot be used with --cohorts')
+    if args.weight_bins is not None and args.cohorts:
+        # cohort runs always merge sites with identical weights, and never bin
+        parser.error('--weight-bins cannot be used with --cohorts')
+    if args.screen_p is not None and (args.gene_sets or args.cohorts):
+        parser.error('--screen-p cannot be used with --gene-sets or --cohorts')
+    if args.previous is not None and args.sites is None:
+        parser.error('--previous requires --sites')
+    if args.previous is not None and (args.gene_sets or args.cohorts):
+        parser.error('--previous cannot be used with --gene-sets or --cohorts')
+    if args.gene_sets is not None and args.resume:
+        parser.error('--resume cannot be used with --gene-sets')
+    if args.resume and not isinstance(args.output, str):
+        parser.error('--resume requires --output')
+    if args.gene_sets is not None and args.profile_out is not None:
+        parser.error('--profile-out cannot be used with --gene-sets')
+    if args.shard is not None and args.gene_sets is not None:
+        parser.error('--shard cannot be used with --gene-sets')
+    if args.shard is not None and not isinstance(args.output, str):
+        parser.error('--shard requires --output')
     
-    return parser.parse_args()
+    return args
+
+def build(argv):
+    ''' write harmonised per-gene site tables to a site store
+    '''
+    args = get_build_options(argv)
+    logging.basicConfig(stream=sys.stdout, format='%(asctime)-15s %(message)s', level=logging.INFO)
+    
+    de_novos = None
+    if args.de_novos is not None:
+        de_novos = group_de_novos(args.de_novos, args.vcf_gene_key)
+    
+    if args.genes is not None:
+        with open(args.genes) as handle:
+            symbols = {x.strip() for x in handle if x.strip()}
+    else:
+        symbols = set(de_novos)
+    
+    store = build_sites(symbols, args.output, args.severity, de_novos,
+        args.gencode, args.fasta, args.rates, args.jobs,
+        cache_dir=args.cache_dir, build=args.genome_build,
+        offline=args.offline, server=args.ensembl_server)
+    logging.info(f'stored {len(store)} genes in {args.output}')
+
+def build_null(argv):
+    ''' write null p-value curves for a cohort into a site store
+    '''
+    args = get_null_options(argv)
+    logging.basicConfig(stream=sys.stdout, format='%(asctime)-15s %(message)s', level=logging.INFO)
+    
+    symbols = None
+    if args.genes is not None:
+        with open(args.genes) as handle:
+            symbols = {x.strip() for x in handle if x.strip()}
+    
+    curves = build_null_curves(args.sites, args.males, args.females,
+        args.solver, args.jobs, symbols, args.tolerance)
+    logging.info(f'stored null curves for {len(curves)} genes in {curves.path}')
+
+def merge(argv):
+    ''' merge the outputs from the shards of a run
+    '''
+    args = get_merge_options(argv)
+    logging.basicConfig(stream=sys.stdout, format='%(asctime)-15s %(message)s', level=logging.INFO)
+    
+    merged = merge_shards(args.inputs, args.output)
+    logging.info(f'merged {len(merged)} rows from {len(args.inputs)} shards')
+
+def select_shard(args, symbols):
+    ''' get the genes for this job's shard, if the run is split into shards
+    '''
+    if args.shard is None:
+        return symbols
+    
+    genes = None
+    if args.sites is None and args.gencode and args.fasta:
+        genes = GeneCache(args.cache_dir, args.gencode, args.fasta, args.genome_build)
+    
+    shard, count = args.shard
+    weights = gene_weights(symbols, args.sites, genes)
+    assigned = assign_shards(weights, count)[shard - 1]
+    logging.info(f'shard {shard} of {count}: {len(assigned)} of {len(symbols)} '
+        f'genes, {sum(weights[x] for x in assigned)} sites')
+    return set(assigned)
+
+def finish_shard(args, symbols, assigned, scored):
+    ''' record the genes in a finished shard, for merging the shards later
+    '''
+    if args.shard is not None:
+        write_manifest(args.output, *args.shard, symbols, assigned, scored)
+
+def score_many_cohorts(args):
+    ''' score genes in several cohorts, and write the results to the output
+    '''
+    cohorts = read_cohorts(args.cohorts)
+    
+    # cohorts can share a de novo file, which only needs loading once
+    loaded = {}
+    de_novos = {}
+    for cohort in cohorts:
+        path = cohort['de_novos'] or args.de_novos
+        if path not in loaded:
+            loaded[path] = group_de_novos(path, args.vcf_gene_key)
+        de_novos[cohort['name']] = loaded[path]
+    
+    symbols = {x for genes in de_novos.values() for x in genes}
+    assigned = select_shard(args, symbols)
+    
+    columns = ['cohort', 'symbol', 'gene_scores', 'sites', 'de_novos',
+        'de_novos_score', 'p_value', 'p_unweighted']
+    profiles = None if args.profile_out is None else []
+    with ResultWriter(args.output, columns, args.resume, grouped=True) as writer:
+        # each gene's rows for every cohort are written together
+        for symbol, values in score_cohorts(assigned - writer.done, cohorts, de_novos,
+                args.severity, args.gencode, args.fasta, args.rates,
+                args.solver, args.jobs, store=args.sites,
+                cache_dir=args.cache_dir, build=args.genome_build,
+                offline=args.offline, server=args.ensembl_server,
+                profiles=profiles):
+            if not writer.stream:
+                print(symbol)
+            writer.write(values)
+    
+    finish_shard(args, symbols, assigned, writer.done)
+    if profiles is not None:
+        write_profiles(profiles, args.profile_out)
+
+def score_sets(args, de_novos):
+    ''' score gene sets, and write the results to the output
+    '''
+    # sets always sum over a Poisson-chosen range of de novo counts, as large
+    # sets can expect far more de novos than single genes
+    tail = 1e-12 if args.tail is None else args.tail
+    computed = []
+    for name, values in score_gene_sets(read_gene_sets(args.gene_sets),
+            de_novos, args.males, args.females, args.sites, args.solver,
+            args.weight_bins, tail):
+        print(name)
+        computed.append(values)
+    
+    columns = ['gene_set', 'genes', 'sites', 'de_novos', 'de_novos_score',
+        'p_value', 'p_unweighted', 'tail_bound']
+    if args.weight_bins is not None:
+        columns += ['weight_shift', 'score_shift']
+    computed = pandas.DataFrame(computed, columns=columns)
+    computed.to_csv(args.output, sep='\t', index=False, na_rep='NA')
+
+def scoring_options(args):
+    ''' get the options which change gene results, for the provenance hashes
+    '''
+    return {'method': args.solver, 'weight_bins': args.weight_bins,
+        'tail': args.tail, 'screen_p': args.screen_p,
+        'null_curves': args.null_curves}
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'build-sites':
+        return build(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == 'build-null':
+        return build_null(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == 'merge':
+        return merge(sys.argv[2:])
+    
     args = get_options()
     logging.basicConfig(stream=sys.stdout, format='%(asctime)-15s %(message)s', level=logging.INFO)
     
-    de_novos = pandas.read_table(args.de_novos)
-    de_novos['chrom'] = de_novos['chrom'].astype(str)
+    if args.cohorts is not None:
+        return score_many_cohorts(args)
     
-    gencode = None
-    if args.gencode and args.fasta:
-        gencode = load_gencode([], args.gencode, args.fasta)
+    de_novos = group_de_novos(args.de_novos, args.vcf_gene_key)
     
-    computed = []
-    for symbol in sorted(set(de_novos['gene'])):
-        print(symbol)
-        
-        try:
-            mu_rate = get_gene_rates(symbol, de_novos, gencode, mut_path=args.rates)
-        except IndexError:
-            continue
+    if args.gene_sets is not None:
+        return score_sets(args, de_novos)
+    
+    assigned = select_shard(args, set(de_novos))
+    symbols = assigned
+    
+    # hash each gene's inputs, so later runs can tell which genes changed
+    provenance, previous = None, None
+    if args.sites is not None:
+        provenance = store_provenance(symbols, de_novos, args.males,
+            args.females, args.sites, scoring_options(args))
+    if args.previous is not None:
+        previous, symbols = reuse_previous(read_previous(args.previous), provenance)
+        logging.info(f'reusing {len(previous)} genes from {args.previous}, '
+            f'scoring {len(symbols)} genes')
+    
+    columns = ['symbol', 'gene_scores', 'sites', 'de_novos', 'de_novos_score',
+        'p_value', 'p_unweighted']
+    if args.weight_bins is not None:
+        columns += ['weight_shift', 'score_shift']
+    if args.tail is not None:
+        columns.append('tail_bound')
+    if args.screen_p is not None:
+        columns.append('screened')
+    if provenance is not None:
+        columns.append('provenance')
+    
+    profiles = None if args.profile_out is None else []
+    with ResultWriter(args.output, columns, args.resume) as writer:
+        symbols = set(symbols) - writer.done
+        kept = []
+        if previous is not None:
+            kept = previous[~previous['symbol'].isin(writer.done)]
+            kept = kept.sort_values('symbol').to_dict('records')
         
-        chrom, start, end = str(mu_rate['chrom'][0]), min(mu_rate['pos']), max(mu_rate['pos'])
+        def computed():
+            for symbol, values in score_genes(symbols, de_novos, args.males,
+                    args.females, args.severity, args.gencode, args.fasta,
+                    args.rates, args.solver, args.jobs, store=args.sites,
+                    cache_dir=args.cache_dir, build=args.genome_build,
+                    offline=args.offline, server=args.ensembl_server,
+                    null_curves=args.null_curves, binning=args.weight_bins,
+                    tail=args.tail, screen=args.screen_p, profiles=profiles):
+                # the gene names would break up a table written to stdout
+                if not writer.stream:
+                    print(symbol)
+                if provenance is not None:
+                    values['provenance'] = provenance[symbol]
+                yield values
         
-        severity = get_cadd_severity(symbol, chrom, start, end, args.severity)
-        values = enrichment(de_novos, args.males, args.females, symbol,
-                severity, mu_rate)
-        computed.append(values)
+        # genes are scored in symbol order, so rows kept from the previous run
+        # can be slotted in as the new rows are written
+        for values in heapq.merge(kept, computed(), key=lambda x: x['symbol']):
+            writer.write(values)
     
-    # convert the output to a table and save to disk
-    computed = pandas.DataFrame(computed, columns=['symbol', 'gene_scores',
-        'sites', 'de_novos', 'de_novos_score', 'p_value', 'p_unweighted'])
-    computed.to_csv(args.output, sep='\t', index=False, na_rep='NA')
+    finish_shard(args, set(de_novos), assigned, writer.done)
+    if profiles is not None:
+        write_profiles(profiles, args.profile_out)
 
 if __name__ == '__main__':
     main()
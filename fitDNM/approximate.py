@@ -1,11 +1,12 @@
 
-from numpy import log, exp, sqrt, sign
+from numpy import log, exp, sqrt, sign, asarray, errstate, flatnonzero, isfinite
 from scipy.stats import norm
 
-from fitDNM.solver import solve_s_u
-from fitDNM.cumulant_generating_functions import cgf_0, cgf_2
+from fitDNM.solver import solve_s_u, solve_s_u_batch
+from fitDNM.cumulant_generating_functions import CGFKernel
+from fitDNM.profiling import count
 
-def get_w(s, s0, x, y, mu, lambdas, weights):
+def get_w(values, s0, x, y, kernel):
     ''' estimate w for Skovgaard's approximation
     
     This estimates the joint CGF of (Y,Z) as:
@@ -19,24 +20,48 @@ def get_w(s, s0, x, y, mu, lambdas, weights):
         z is the
     
     Args:
-        s: something
+        values: dictionary of 's', 'mu' and 'value' entries, where 'value' is
+            the CGF evaluated at s and mu
         s0: something
         x: tested summed score
         y: observed summed score
-        mu: mutation rate
-        lambdas: vector of per base and allele mutation rates
-        weights: per base and allele weights, indicating the likely severity of
-            each change
+        kernel: CGFKernel for the gene
     
     Returns:
         summed value
     '''
     
-    return 2 * (s * x + mu * y -
-        cgf_0(mu=mu, s=s, lambdas=lambdas, weights=weights) -
-        s0 * x + cgf_0(mu=0, s=s0 , lambdas=lambdas, weights=weights))
+    # K(s0, 0) only depends on the summed rates, so needs no pass over the sites
+    return 2 * (values['s'] * x + values['mu'] * y - values['value'] -
+        s0 * x + kernel.total * (exp(s0) - 1))
+
+def solve_w_part(x, y, s0, kernel, method='newton', refine=5):
+    ''' solve s and mu, then get the CGF values and w_part at the solution
+    
+    The CGF, its gradient and hessian determinant all come from one pass
+    over the kernel, so they are shared by w_part and the p-value.
+    
+    Args:
+        x: tested summed score
+        y: observed summed score
+        s0: initial s value
+        kernel: CGFKernel for the gene
+        method: solver method to pass to solve_s_u
+        refine: number of refinements for the legacy solver
+    
+    Returns:
+        dictionary of 's', 'mu', 'w_part', and CGF values
+    '''
+    values = solve_s_u(x, y, kernel.lambdas, kernel.weights, refine=refine,
+        method=method, kernel=kernel)
+    cgf = kernel.evaluate(values['mu'], values['s'])
+    values.update({k: v[0] for k, v in cgf.items()})
+    values['w_part'] = get_w(values, s0, x, y, kernel)
+    
+    return values
 
-def avoid_zero_w_part(x, y, lambdas, weights, s0, increment=0.01):
+def avoid_zero_w_part(x, y, lambdas, weights, s0, increment=0.01,
+        method='newton', kernel=None, max_iter=100):
     ''' adjust w_part until it is shifted away from zero
     
     Args:
@@ -47,29 +72,74 @@ def avoid_zero_w_part(x, y, lambdas, weights, s0, increment=0.01):
             each change
         s0: initial s value
         increment: value to increment y value per iteration
+        method: solver method to pass to solve_s_u
+        kernel: CGFKernel for the gene, constructed from lambdas and weights
+            if not given
+        max_iter: maximum number of increments to try
     
     Returns:
-        list of s, mu and w_part values
+        dictionary of s, mu and w_part values, or None if w_part is still
+        close to zero after max_iter increments.
     '''
-    while True:
+    if kernel is None:
+        kernel = CGFKernel(lambdas, weights)
+    
+    for _ in range(max_iter):
+        count('avoid_zero_loops')
         y += increment
-        values = solve_s_u(x, y, lambdas, weights)
-        values['w_part'] = get_w(values['s'], s0, x, y, values['mu'], lambdas, weights)
+        values = solve_w_part(x, y, s0, kernel, method=method)
         
         if abs(values['w_part']) > 1e-4:
-            break
+            return values
     
-    return values
+    return None
+
+def mean_limit_p(x, y, kernel):
+    r''' approximate the p-value for y close to the conditional mean score
+    
+    The saddlepoint p-value is 0/0 at w = 0, where y is the mean score of x de
+    novos. Its Lugannani-Rice limit there is
+    
+        \eqn{1/2 - \kappa_3 / (6 \sqrt{2 \pi} \kappa_2^{3/2})}
+    
+    where \kappa_2 and \kappa_3 are cumulants of the score given x de novos.
+    Given x, the de novos fall on sites in proportion to their rates, so the
+    score is a sum of x independent draws of the weights, and its cumulants
+    are x times those of one draw. This uses the matching Edgeworth expansion,
+    which also covers y slightly away from the mean, at the cost of one pass
+    over the sites.
+    
+    Args:
+        x: tested summed score
+        y: observed summed score
+        kernel: CGFKernel for the gene
+    
+    Returns:
+        p-value
+    '''
+    count('mean_limits')
+    if kernel.max_weight == kernel.min_weight:
+        # every site has the same weight, so the score is fixed given x
+        return float(y <= x * kernel.max_weight)
+    
+    probs = kernel.lambdas / kernel.total
+    mean = (probs * kernel.weights).sum()
+    centred = kernel.weights - mean
+    k2 = x * (probs * centred ** 2).sum()
+    k3 = x * (probs * centred ** 3).sum()
+    
+    z = (y - x * mean) / sqrt(k2)
+    return norm.sf(z) + norm.pdf(z) * k3 / (6 * k2 ** 1.5) * (z ** 2 - 1)
 
-def saddlepoint_p(values, s0, lambdas, weights):
+def saddlepoint_p(values, s0, kernel):
     ''' calculate the p-value using the double saddle point
     
     Args:
-        values: list of 's', 'mu' and 'w_part' values
+        values: dictionary of 's', 'mu', 'w_part' and 'hessian' values, where
+            'hessian' is the determinant of the CGF second derivative. These
+            can be scalars, or vectors for several x values at once.
         s0: initial s value
-        lambdas: vector of per base and allele mutation rates
-        weights: per base and allele weights, indicating the likely severity of
-            each change
+        kernel: CGFKernel for the gene
     
     Returns:
         p-value
@@ -78,14 +148,14 @@ def saddlepoint_p(values, s0, lambdas, weights):
     w = sign(values['mu']) * sqrt(values['w_part'])
     
     # compute K_ss(s0, 0) and |K_2_(s, mu)|
-    K_ss = exp(s0) * sum(lambdas)
-    K_2 = abs(cgf_2(values['mu'], values['s'], lambdas, weights))
+    K_ss = exp(s0) * kernel.total
+    K_2 = abs(values['hessian'])
     
     u = values['mu'] * sqrt(K_2 / K_ss)
     
     return norm.sf(w) + norm.pdf(w) * (1 / u - 1 / w)
 
-def approximate(x, y, lambdas, weights):
+def approximate(x, y, lambdas, weights, method='newton', kernel=None):
     ''' conditional approximation
     
     Args:
@@ -94,37 +164,97 @@ def approximate(x, y, lambdas, weights):
         lambdas: vector of per base and allele mutation rates
         weights: per base and allele weights, indicating the likely severity of
             each change
+        method: solver method to pass to solve_s_u
+        kernel: CGFKernel for the gene, constructed from lambdas and weights
+            if not given
     
     Returns:
         approximate value
     '''
+    if kernel is None:
+        kernel = CGFKernel(lambdas, weights)
+    
+    count('approximate_calls')
     
     # solve s0, s, mu and w_part
-    s0 = log(x / sum(lambdas))
-    values = solve_s_u(x, y, lambdas, weights)
-    values['w_part'] = get_w(values['s'], s0, x, y, values['mu'], lambdas, weights)
+    s0 = log(x / kernel.total)
+    values = solve_w_part(x, y, s0, kernel, method=method)
     
-    # ensure w_part >= 0
+    # ensure w_part >= 0. Only the legacy search gains from further refinement,
+    # the newton solver has already converged, so small negative values from
+    # rounding are left for the near-zero correction below.
     i = 0
-    while values['w_part'] < 0:
+    while values['w_part'] < 0 and method == 'legacy':
         # TODO: I haven't covered this section with a unit test yet
+        count('w_part_retries')
         i += 1
-        values = solve_s_u(x, y, lambdas, weights, refine=10 * i)
-        values['w_part'] = get_w(values['s'], s0, x, y, values['mu'], lambdas, weights)
+        values = solve_w_part(x, y, s0, kernel, method=method, refine=10 * i)
         
         if i >= 10:
             return float('nan')
     
+    if values['w_part'] < -1e-4:
+        return float('nan')
+    
     if abs(values['w_part']) <= 1e-4:
         # If w_part is close enough to zero, this can throw off the estimate.
-        # Avoid this by estimating w_part above and below, then use the average
-        # NOTE: Possibly it only fails at exactly zero?
-        lower = avoid_zero_w_part(x, y, lambdas, weights, s0, increment=0.01)
-        lower_p = saddlepoint_p(lower, s0, lambdas, weights)
+        # The legacy method estimates w_part above and below, then uses the
+        # average, so its results can be checked against the original code.
+        # That search is bounded, as it can take many steps on some genes.
+        # Otherwise, use the analytic limit at w = 0, at a fixed cost.
+        if method != 'legacy':
+            return mean_limit_p(x, y, kernel)
         
-        upper = avoid_zero_w_part(x, y, lambdas, weights, s0, increment=-0.01)
-        upper_p = saddlepoint_p(upper, s0, lambdas, weights)
+        lower = avoid_zero_w_part(x, y, lambdas, weights, s0, increment=0.01,
+            method=method, kernel=kernel)
+        upper = avoid_zero_w_part(x, y, lambdas, weights, s0, increment=-0.01,
+            method=method, kernel=kernel)
+        if lower is None or upper is None:
+            return mean_limit_p(x, y, kernel)
         
-        return (lower_p + upper_p) / 2
+        return (saddlepoint_p(lower, s0, kernel) + saddlepoint_p(upper, s0, kernel)) / 2
     else:
-        return saddlepoint_p(values, s0, lambdas, weights)
+        return saddlepoint_p(values, s0, kernel)
+
+def approximate_batch(x, y, lambdas, weights, method='newton', kernel=None):
+    ''' conditional approximation for a vector of tested summed scores
+    
+    This solves s, mu and w_part for every x value in one batched pass. Any x
+    value where w_part is negative or close to zero, or where the p-value is
+    not finite, falls back to approximate(), so the results match calling
+    approximate() for each x value in turn.
+    
+    Args:
+        x: vector of tested summed scores
+        y: observed summed score
+        lambdas: vector of per base and allele mutation rates
+        weights: per base and allele weights, indicating the likely severity of
+            each change
+        method: solver method to pass to solve_s_u_batch
+        kernel: CGFKernel for the gene, constructed from lambdas and weights
+            if not given
+    
+    Returns:
+        vector of approximate values, matched to x
+    '''
+    if kernel is None:
+        kernel = CGFKernel(lambdas, weights)
+    
+    x = asarray(x, dtype=float)
+    
+    s0 = log(x / kernel.total)
+    values = solve_s_u_batch(x, y, lambdas, weights, method=method, kernel=kernel)
+    values.update(kernel.evaluate(values['mu'], values['s']))
+    values['w_part'] = get_w(values, s0, x, y, kernel)
+    
+    with errstate(divide='ignore', invalid='ignore'):
+        p_values = saddlepoint_p(values, s0, kernel)
+    
+    fallbacks = flatnonzero(~(values['w_part'] > 1e-4) | ~isfinite(p_values))
+    count('batch_x_values', len(x))
+    count('batch_fallbacks', len(fallbacks))
+    for i in fallbacks:
+        p_values[i] = approximate(x[i], y, lambdas, weights, method=method,
+            kernel=kernel)
+    
+    return p_values
@@ -0,0 +1,75 @@
+
+import numpy
+import pandas
+from scipy.stats import poisson
+
+from fitDNM.gene_enrichment import cohort_scale
+from fitDNM.saddlepoint import saddlepoint
+from fitDNM.weight_bins import collapse_weights
+
+def read_cohorts(path):
+    ''' load the cohorts to score, from a tab-separated table
+    
+    The table has name, males and females columns, with an optional de_novos
+    column giving a path to each cohort's own de novos.
+    
+    Args:
+        path: path to table of cohorts
+    
+    Returns:
+        list of dictionaries, one per cohort, with name, males, females and
+        de_novos (None where not given) entries.
+    '''
+    cohorts = pandas.read_table(path, dtype={'name': str, 'de_novos': str})
+    if 'de_novos' not in cohorts:
+        cohorts['de_novos'] = None
+    cohorts = cohorts.astype(object).where(cohorts.notnull(), None)
+    
+    return [{'name': x['name'], 'males': int(x['males']),
+        'females': int(x['females']), 'de_novos': x['de_novos']}
+        for x in cohorts.to_dict('records')]
+
+class GeneStats:
+    ''' cohort-independent terms for scoring a gene in many cohorts
+    
+    The expected rates for a cohort are the base mutation probabilities times
+    a scale factor for the cohort size (see cohort_scale()), so the weights and
+    summed base probabilities are computed once, then scaled for each cohort.
+    
+    Args:
+        sites: GeneSites for the gene
+    '''
+    __slots__ = ['sites', 'scores', 'weights', 'base', 'total', 'n_sites']
+    
+    def __init__(self, sites):
+        self.sites = sites
+        self.scores = sites.downweighted()
+        self.weights, self.base = collapse_weights(self.scores, sites.prob)
+        self.total = sum(sites.prob)
+        self.n_sites = len(numpy.unique(sites.pos))
+    
+    def enrichment(self, de_novos, males, females, method='newton'):
+        ''' compute de novo enrichment for the gene in one cohort
+        
+        Args:
+            de_novos: table of the cohort's de novos in the gene, or None
+            males: number of male probands
+            females: number of female probands
+            method: solver method for the saddlepoint, 'newton' or 'legacy'
+        
+        Returns:
+            dictionary of de novo enrichment results, as from enrichment()
+        '''
+        scale = cohort_scale([self.sites.chrom], males, females)
+        
+        observed = [] if de_novos is None else self.sites.matches(de_novos)
+        observed_score = sum(self.scores[observed])
+        
+        p_value = saddlepoint(observed_score, scale * self.base, self.weights,
+            method=method)
+        p_unweighted = poisson.sf(len(observed) - 1, scale * self.total)
+        
+        return {'symbol': self.sites.symbol, 'gene_scores': sum(self.scores),
+            'sites': self.n_sites, 'de_novos': len(observed),
+            'de_novos_score': round(observed_score, 3), 'p_value': p_value,
+            'p_unweighted': p_unweighted}
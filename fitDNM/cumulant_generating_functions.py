@@ -1,10 +1,47 @@
 
-from math import isnan
 from decimal import Decimal as dec
 
-from numpy import exp
+from numpy import (exp, log, errstate, newaxis, asarray, atleast_1d, where,
+    maximum)
 
-def cgf_0(mu, s, lambdas, weights):
+from fitDNM.profiling import count
+
+def exact_sums(mu, s, lambdas, weights):
+    ''' sum the CGF terms in arbitrary precision
+    
+    This is far slower than the float64 CGFs, and only intended for checking
+    them, so it is only used when asked for.
+    
+    Args:
+        mu: mutation rate
+        s: something
+        lambdas: vector of per base and allele mutation rates
+        weights: per base and allele weights, indicating the likely severity of
+            each change
+    
+    Returns:
+        tuple of Decimal sums of the rates, weighted rates and squared weighted
+        rates, each scaled by e^{c_l t + s}.
+    '''
+    count('decimal_sums')
+    mu = dec(float(mu))
+    s = dec(float(s))
+    
+    ss = dec(0)
+    mus = dec(0)
+    mumu = dec(0)
+    for m, w in zip(lambdas, weights):
+        m = dec(float(m))
+        w = dec(float(w))
+        
+        x = m * (w * mu + s).exp()
+        ss += x
+        mus += w * x
+        mumu += w**2 * x
+    
+    return ss, mus, mumu
+
+def cgf_0(mu, s, lambdas, weights, exact=False):
     ''' cumulant generating function, see appendix A of Jiang et al 2015 AJHG 97:272
     
     This estimates the joint CGF of (Y,Z) as:
@@ -17,6 +54,7 @@ def cgf_0(mu, s, lambdas, weights):
         lambdas: vector of per base and allele mutation rates
         weights: per base and allele weights, indicating the likely severity of
             each change
+        exact: whether to sum in arbitrary precision, to check the float64 value
     
     Returns:
         summed value
@@ -24,19 +62,13 @@ def cgf_0(mu, s, lambdas, weights):
     
     assert len(lambdas) == len(weights)
     
-    values = lambdas * (exp(weights * mu + s) - 1)
+    if exact:
+        ss, _, _ = exact_sums(mu, s, lambdas, weights)
+        return float(ss - sum(dec(float(m)) for m in lambdas))
     
-    total = sum(values)
-    if not isnan(total):
-        return total
-    
-    mu = dec(mu)
-    s = dec(s)
-    
-    value = sum(( dec(m) * (exp(dec(w) * mu + s) - dec(1)) for m, w in zip(lambdas, weights) ))
-    return float(value)
+    return CGFKernel(lambdas, weights).evaluate(mu, s)['value'][0]
 
-def cgf_2(mu, s, lambdas, weights):
+def cgf_2(mu, s, lambdas, weights, exact=False):
     ''' cumulant generating function, second derivative
     
     The second derivative is calculated as:
@@ -61,6 +93,7 @@ def cgf_2(mu, s, lambdas, weights):
         lambdas: vector of per base and allele mutation rates
         weights: per base and allele weights, indicating the likely severity of
             each change
+        exact: whether to sum in arbitrary precision, to check the float64 value
     
     Returns:
         determinant of the second derivative
@@ -68,29 +101,129 @@ def cgf_2(mu, s, lambdas, weights):
     
     assert len(lambdas) == len(weights)
     
-    standard = lambdas * exp(weights * mu + s)
-    
-    ss = standard
-    mumu = weights**2 * standard
-    mus = weights * standard
-    
-    if any(( isnan(x) for x in standard )):
-        mu = dec(mu)
-        s = dec(s)
-        
-        ss = dec(0)
-        mumu = dec(0)
-        mus = dec(0)
-        for m, w in zip(lambdas, weights):
-            m = dec(m)
-            w = dec(w)
-            
-            x = m * exp(w - mu + s)
-            ss += x
-            mumu += w**2 * x
-            mus += w * x
-        
-        total = ss * mumu - mus**2
-        return float(total)
-    else:
-        return sum(ss) * sum(mumu) - (sum(mus)**2)
+    if exact:
+        ss, mus, mumu = exact_sums(mu, s, lambdas, weights)
+        return float(ss * mumu - mus**2)
+    
+    return CGFKernel(lambdas, weights).evaluate(mu, s)['hessian'][0]
+
+class CGFKernel:
+    ''' joint CGF of (Y,Z) and its derivatives for a single gene
+    
+    This is built once per gene, and shares one exponential pass over the
+    per site and allele vectors for every quantity needed at a given mu and s.
+    All methods accept scalar or vector mu (and s), and return vectors, with
+    one entry per mu value.
+    
+    The largest exponent for each mu value is factored out of the sums before
+    exponentiating (as in log-sum-exp), so the sums stay in float64 without
+    overflowing, and the factor is only applied to the summed values.
+    
+    Args:
+        lambdas: vector of per base and allele mutation rates
+        weights: per base and allele weights, indicating the likely severity of
+            each change
+    '''
+    def __init__(self, lambdas, weights):
+        self.lambdas = asarray(lambdas, dtype=float)
+        self.weights = asarray(weights, dtype=float)
+        
+        assert len(self.lambdas) == len(self.weights)
+        
+        self.weights_squared = self.weights ** 2
+        self.total = self.lambdas.sum()
+        self.max_weight = self.weights.max() if len(self.weights) > 0 else 0
+        self.min_weight = self.weights.min() if len(self.weights) > 0 else 0
+    
+    def __len__(self):
+        return len(self.lambdas)
+    
+    def _shift(self, mu):
+        ''' get the largest exponent (weights * mu) for each mu value
+        '''
+        return where(mu >= 0, mu * self.max_weight, mu * self.min_weight)
+    
+    def _sums(self, exponent):
+        ''' sum the rates, weighted rates and squared weighted rates
+        '''
+        scaled = self.lambdas * exp(exponent)
+        return (scaled.sum(axis=1), (self.weights * scaled).sum(axis=1),
+            (self.weights_squared * scaled).sum(axis=1))
+    
+    def evaluate(self, mu, s):
+        r''' get the CGF, its gradient and its hessian determinant
+        
+        These are the values from cgf_0 and cgf_2, plus the gradient:
+        
+            \eqn{K^{'}(t,s) = (\sum_{l=1}^{p} \lambda_l c_l e^{c_l t + s},
+                \sum_{l=1}^{p} \lambda_l e^{c_l t + s})}
+        
+        Args:
+            mu: mutation rate, or vector of mutation rates
+            s: s value, or vector of s values matched to mu
+        
+        Returns:
+            dictionary with 'value', 'gradient_mu', 'gradient_s' and 'hessian'
+            entries, plus 'log_gradient_s', the log of 'gradient_s'.
+        '''
+        mu = atleast_1d(asarray(mu, dtype=float))
+        s = atleast_1d(asarray(s, dtype=float))
+        
+        shift = self._shift(mu)
+        ss, mus, mumu = self._sums(self.weights * mu[:, newaxis] - shift[:, newaxis])
+        
+        log_scale = shift + s
+        with errstate(over='ignore', divide='ignore', invalid='ignore'):
+            scale = exp(log_scale)
+            value = scale * ss - self.total
+            hessian = scale ** 2 * (ss * mumu - mus ** 2)
+            log_ss = log_scale + log(ss)
+        
+        return {'value': value, 'gradient_mu': scale * mus,
+            'gradient_s': scale * ss, 'hessian': hessian,
+            'log_gradient_s': log_ss}
+    
+    def ratio(self, mu):
+        ''' get the CGF-like ratio, as used by the legacy stepping solver
+        
+        This is the ratio of the values from the first derivative of the CGF,
+        when s = 0 and mu is variable. This is not rescaled, so mu values which
+        overflow give NaN, which ends the legacy search.
+        
+        Args:
+            mu: mutation rate, or vector of mutation rates
+        
+        Returns:
+            vector of ratios, one per mu value
+        '''
+        mu = atleast_1d(asarray(mu, dtype=float))
+        with errstate(over='ignore', invalid='ignore'):
+            denominator, numerator, _ = self._sums(self.weights * mu[:, newaxis])
+            return where(numerator == 0, 0, numerator / denominator)
+    
+    def tilted(self, mu):
+        ''' get the CGF-like ratio and its derivative for the newton solver
+        
+        The ratio is the mean of the weights under the exponentially tilted
+        rates (lambdas * e^{weights * mu}), so its derivative with respect to
+        mu is the variance of the weights under the same tilt. Both are
+        computed after factoring out the largest exponent, so neither overflows.
+        
+        Args:
+            mu: mutation rate, or vector of mutation rates
+        
+        Returns:
+            dictionary with 'ratio', 'slope' and 'log_total' vectors, where
+            log_total is log(sum(lambdas * e^{weights * mu})).
+        '''
+        mu = atleast_1d(asarray(mu, dtype=float))
+        shift = self._shift(mu)
+        
+        total, first, second = self._sums(self.weights * mu[:, newaxis] - shift[:, newaxis])
+        
+        with errstate(divide='ignore', invalid='ignore'):
+            ratio = where(first == 0, 0, first / total)
+            slope = maximum(second / total - ratio**2, 0)
+            log_total = shift + log(total)
+        
+        return {'ratio': ratio, 'slope': slope, 'log_total': log_total}
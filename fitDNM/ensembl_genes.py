@@ -0,0 +1,236 @@
+
+import asyncio
+import logging
+import os
+import sqlite3
+import zlib
+from urllib.parse import urlsplit, urlunsplit
+
+from denovonear.load_gene import load_gene
+from denovonear.rate_limiter import RateLimiter
+from denovonear.rate_limiter_retries import ensembl_retry
+
+class OfflineError(LookupError):
+    ''' raised for an uncached Ensembl request when running offline
+    '''
+
+class ResponseCache:
+    ''' on-disk cache of Ensembl REST responses, keyed by the request URL
+    
+    Args:
+        folder: path to cache folder. This is created if missing.
+    '''
+    def __init__(self, folder):
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        
+        self.path = os.path.join(folder, 'ensembl_responses.db')
+        self.conn = sqlite3.connect(self.path, timeout=60)
+        with self.conn:
+            self.conn.execute('pragma journal_mode=wal')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS responses '
+                '(url TEXT PRIMARY KEY, data BLOB)')
+    
+    def get(self, url):
+        ''' get the cached response for a URL, or None if not cached
+        '''
+        row = self.conn.execute('SELECT data FROM responses WHERE url=?',
+            (url, )).fetchone()
+        return None if row is None else zlib.decompress(row[0])
+    
+    def put(self, url, data):
+        ''' cache the response for a URL
+        '''
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?)',
+                (url, zlib.compress(data)))
+    
+    def close(self):
+        self.conn.close()
+
+class CachedRateLimiter(RateLimiter):
+    ''' rate limited Ensembl requests, which check an on-disk cache first
+    
+    Args:
+        cache: ResponseCache, or None to use denovonear's default cache
+        per_second: number of queries allowed per second
+        offline: whether to only use cached responses. Uncached requests
+            raise an OfflineError.
+        server: base URL of a server to send requests to instead of the
+            Ensembl servers (e.g. a local mirror). Responses are still cached
+            under the original URLs.
+    '''
+    def __init__(self, cache=None, per_second=15, offline=False, server=None):
+        super().__init__(per_second)
+        self.cache = cache
+        self.offline = offline
+        self.server = server
+        self.client = None
+    
+    async def __aenter__(self):
+        # offline runs never open a connection
+        if not self.offline:
+            await super().__aenter__()
+        return self
+    
+    async def __aexit__(self, *err):
+        if self.client is not None:
+            await super().__aexit__(*err)
+    
+    def _redirect(self, url):
+        ''' point a URL at the stand-in server, if one is used
+        '''
+        if self.server is None:
+            return url
+        scheme, netloc = urlsplit(self.server)[:2]
+        return urlunsplit((scheme, netloc) + urlsplit(url)[2:])
+    
+    async def get(self, url, headers=None):
+        ''' perform a rate limited http get, unless the response is cached
+        
+        Args:
+            url: url to get
+            headers: http headers to pass in with the get query
+        '''
+        if self.cache is not None:
+            data = self.cache.get(url)
+            if data is not None:
+                return data
+        
+        if self.offline:
+            raise OfflineError(f'not in Ensembl cache: {url}')
+        
+        if self.cache is None:
+            return await super().get(self._redirect(url), headers)
+        
+        data = await self._fetch(self._redirect(url), headers)
+        self.cache.put(url, data)
+        return data
+    
+    @ensembl_retry(retries=9)
+    async def _fetch(self, url, headers=None):
+        ''' perform a rate limited http get, retrying on server errors and
+        rate limits, without going through denovonear's own cache
+        
+        Args:
+            url: url to get
+            headers: http headers to pass in with the get query
+        '''
+        if not headers:
+            headers = {'content-type': 'application/json'}
+        await self.wait_for_token()
+        async with self.client.get(url, headers=headers) as resp:
+            logging.info(f'{url}\t{resp.status}')
+            resp.raise_for_status()
+            return await resp.read()
+
+class EnsemblGenes:
+    ''' genes loaded from the Ensembl REST API, for runs without gencode files
+    
+    This acts like a Gencode object for get_gene_rates(), but loads each gene
+    on demand. Genes can also be loaded in bulk, sharing one rate limiter, with
+    a bounded number of genes in flight at once. With a cache folder, every
+    response is stored on disk, so later runs (or worker processes) read genes
+    from the cache rather than the network, and offline runs only use the
+    cache.
+    
+    The object can be pickled, so it can be shared with worker processes.
+    
+    Args:
+        cache_dir: folder for the response cache. If None, this uses
+            denovonear's default cache.
+        build: genome build for the Ensembl server
+        offline: whether to only use cached responses
+        server: base URL of a stand-in for the Ensembl servers
+        concurrency: maximum number of genes to load at once
+        per_second: number of queries allowed per second
+    '''
+    def __init__(self, cache_dir=None, build='grch37', offline=False,
+            server=None, concurrency=10, per_second=15):
+        self.cache_dir = cache_dir
+        self.build = build.lower()
+        self.offline = offline
+        self.server = server
+        self.concurrency = concurrency
+        self.per_second = per_second
+        
+        # the most recently loaded gene, as lookups check then get the gene
+        self._gene = None
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_gene'] = None
+        return state
+    
+    async def _load(self, symbols):
+        ''' load genes concurrently, with a shared rate limiter
+        '''
+        cache = None
+        if self.cache_dir is not None:
+            cache = ResponseCache(self.cache_dir)
+        
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limiter = CachedRateLimiter(cache, self.per_second, self.offline, self.server)
+        async with limiter as ensembl:
+            async def load(symbol):
+                async with semaphore:
+                    try:
+                        return symbol, await load_gene(ensembl, symbol, self.build)
+                    except Exception as error:
+                        logging.error(f'cannot load {symbol} from Ensembl: {error!r}')
+                        return symbol, None
+            
+            genes = await asyncio.gather(*[load(x) for x in symbols])
+        
+        if cache is not None:
+            cache.close()
+        
+        return dict(genes)
+    
+    def load(self, symbols):
+        ''' load many genes at once
+        
+        Args:
+            symbols: list of HGNC symbols
+        
+        Returns:
+            dictionary of Gene objects (or None for genes which failed),
+            indexed by symbol.
+        '''
+        return asyncio.get_event_loop().run_until_complete(self._load(symbols))
+    
+    def prefetch(self, symbols, batch_size=500):
+        ''' fill the response cache for many genes, before they are used
+        
+        The genes are loaded in batches and discarded, so memory stays bounded.
+        This does nothing without a cache folder.
+        
+        Args:
+            symbols: list of HGNC symbols
+            batch_size: number of genes to load at once
+        '''
+        if self.cache_dir is None:
+            return
+        
+        symbols = sorted(symbols)
+        for i in range(0, len(symbols), batch_size):
+            self.load(symbols[i:i + batch_size])
+    
+    def _get(self, symbol):
+        if self._gene is not None and self._gene[0] == symbol:
+            return self._gene[1]
+        
+        # only keep genes which loaded, so failures can be retried
+        gene = self.load([symbol])[symbol]
+        if gene is not None:
+            self._gene = (symbol, gene)
+        return gene
+    
+    def __contains__(self, symbol):
+        return self._get(symbol) is not None
+    
+    def __getitem__(self, symbol):
+        gene = self._get(symbol)
+        if gene is None:
+            raise KeyError(f'cannot load {symbol} from Ensembl')
+        return gene
@@ -0,0 +1,159 @@
+
+import os
+import json
+import zlib
+import sqlite3
+import hashlib
+import logging
+
+from gencodegenes import Transcript
+from denovonear.__main__ import load_gencode
+
+def cache_key(gencode_path, fasta_path, build):
+    ''' get a key for the gene annotations, which changes if the inputs change
+    
+    Args:
+        gencode_path: path to gencode annotations file
+        fasta_path: path to genome fasta file
+        build: genome build of the annotations
+    
+    Returns:
+        hex digest string
+    '''
+    parts = [build.lower()]
+    for path in [gencode_path, fasta_path]:
+        stat = os.stat(path)
+        parts += [os.path.abspath(path), str(stat.st_mtime_ns), str(stat.st_size)]
+    
+    return hashlib.sha1('\t'.join(parts).encode('utf8')).hexdigest()[:16]
+
+def _serialise_transcript(tx):
+    ''' convert a Transcript to a dict of the fields needed to rebuild it
+    '''
+    return {'name': tx.name, 'chrom': tx.chrom, 'start': tx.start,
+        'end': tx.end, 'strand': tx.strand, 'type': tx.type,
+        'exons': [(x['start'], x['end']) for x in tx.exons],
+        'cds': [(x['start'], x['end']) for x in tx.cds],
+        'sequence': tx.genomic_sequence, 'offset': tx.genomic_offset,
+        'attributes': dict(tx.attributes)}
+
+def _serialise_gene(gene):
+    ''' convert a Gene to compressed JSON, with its transcripts and sequence
+    '''
+    try:
+        canonical = gene.canonical.name
+    except ValueError:
+        canonical = None
+    
+    data = {'chrom': gene.chrom, 'start': gene.start, 'end': gene.end,
+        'canonical': canonical,
+        'transcripts': [_serialise_transcript(x) for x in gene.transcripts]}
+    
+    return zlib.compress(json.dumps(data).encode('utf8'))
+
+class CachedGene:
+    ''' gene rebuilt from the cache, with the attributes fitDNM uses from a
+    gencodegenes Gene (symbol, chrom, start, end, transcripts and canonical)
+    '''
+    def __init__(self, symbol, data):
+        self.symbol = symbol
+        self.chrom = data['chrom']
+        self.start = data['start']
+        self.end = data['end']
+        self.transcripts = [Transcript(x['name'], x['chrom'], x['start'],
+            x['end'], x['strand'], x['type'], x['exons'], x['cds'],
+            x['sequence'], x['offset'], x['attributes'])
+            for x in data['transcripts']]
+        
+        self._canonical = data['canonical']
+    
+    def __repr__(self):
+        return f'CachedGene("{self.symbol}", {self.chrom}:{self.start}-{self.end})'
+    
+    @property
+    def canonical(self):
+        ''' get the canonical transcript, as picked when the cache was built
+        '''
+        for tx in self.transcripts:
+            if tx.name == self._canonical:
+                return tx
+        raise ValueError(f'no canonical transcript for {self.symbol}')
+
+class GeneCache:
+    ''' persistent cache of genes loaded from gencode annotations
+    
+    Loading the full gencode annotations and genome fasta takes minutes and
+    several GB of memory, so the first load writes each gene (its transcript
+    coordinates and genomic sequence) into a sqlite database within the cache
+    folder. Later runs only read genes from the database as they are needed.
+    
+    The database is keyed on the annotation and fasta paths, their modification
+    times and sizes, and the genome build, so changing any of those builds a
+    fresh cache.
+    
+    The object can be pickled (e.g. to send to worker processes), as the
+    database connection is reopened on first use in each process.
+    
+    Args:
+        folder: path to cache folder. This is created if missing.
+        gencode_path: path to gencode annotations file
+        fasta_path: path to genome fasta file
+        build: genome build of the annotations
+    '''
+    def __init__(self, folder, gencode_path, fasta_path, build='grch37'):
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        
+        key = cache_key(gencode_path, fasta_path, build)
+        self.path = os.path.join(folder, f'genes.{key}.db')
+        self._conn = None
+        
+        if not os.path.exists(self.path):
+            self._build(gencode_path, fasta_path)
+    
+    def __getstate__(self):
+        return {'path': self.path, '_conn': None}
+    
+    def _build(self, gencode_path, fasta_path):
+        ''' load the gencode annotations, and write every gene to the database
+        
+        The database is written to a temporary file then moved into place, so
+        an interrupted build never leaves a partial cache.
+        '''
+        logging.info(f'building gene cache: {self.path}')
+        gencode = load_gencode([], gencode_path, fasta_path)
+        
+        temp = f'{self.path}.{os.getpid()}.tmp'
+        with sqlite3.connect(temp) as conn:
+            conn.execute('CREATE TABLE genes (symbol TEXT PRIMARY KEY, data BLOB)')
+            conn.executemany('INSERT INTO genes VALUES (?, ?)',
+                ((x, _serialise_gene(gencode[x])) for x in gencode))
+        conn.close()
+        os.replace(temp, self.path)
+    
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+        return self._conn
+    
+    def __contains__(self, symbol):
+        cursor = self.conn.execute('SELECT 1 FROM genes WHERE symbol=?', (symbol, ))
+        return cursor.fetchone() is not None
+    
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM genes').fetchone()[0]
+    
+    def __iter__(self):
+        for symbol, in self.conn.execute('SELECT symbol FROM genes ORDER BY symbol'):
+            yield symbol
+    
+    def __getitem__(self, symbol):
+        ''' load a gene from the cache
+        '''
+        cursor = self.conn.execute('SELECT data FROM genes WHERE symbol=?', (symbol, ))
+        row = cursor.fetchone()
+        if row is None:
+            raise KeyError(f'{symbol} not in gene cache: {self.path}')
+        
+        return CachedGene(symbol, json.loads(zlib.decompress(row[0])))
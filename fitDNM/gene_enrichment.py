@@ -1,58 +1,75 @@
 
-import math
-
-from numpy import array
+from numpy import isnan, unique
+import pandas
 from scipy.stats import poisson
 
-from fitDNM.saddlepoint import saddlepoint
+from fitDNM.gene_sites import GeneSites, downweight_scores
+from fitDNM.profiling import stage, count
+from fitDNM.saddlepoint import saddlepoint, saddlepoint_with_bound
+from fitDNM.screen import lower_bound_p
+from fitDNM.weight_bins import compress_sites, score_shift
 
 def downweight_severity(data):
     ''' downweight severities by the rate across the alleles at each site
     
     severity = severity - (severity * mu_rate).apply(sum, axis=0)
-    '''
     
-    data = data.copy()
-    data['value'] = data['prob'] * data['score']
-    recode = dict([ (pos, sum(x['value'])) for pos, x in data.groupby('pos') ])
-    data['score'] = data['score'] - data['pos'].map(recode)
-    del data['value']
+    Args:
+        data: pandas DataFrame with pos, prob and score columns
     
-    return data['score']
+    Returns:
+        pandas Series of downweighted scores, with the same index as data. See
+        downweight_scores() for the same on raw arrays.
+    '''
+    
+    scores = downweight_scores(data['pos'].to_numpy(), data['prob'].to_numpy(),
+        data['score'].to_numpy())
+    return pandas.Series(scores, index=data.index, name='score')
 
 def harmonise_data(rates, severity, symbol):
     ''' merge mutation rates and severity score datasets
     
     Args:
         rates: pandas DataFrame that includes a 'prob' column
-        severity: pandas DataFrame that includes a 'score' column
+        severity: pandas DataFrame that includes a 'score' column, or
+            dictionary of CADD arrays for the gene (from CaddReader.extract)
         symbol: HGNC symbol for gene
     
     Returns:
-        tuple of (mutation probabilities, severity score, position, )
+        GeneSites object, with one entry per position and alt allele, sorted
+        by position and alt allele.
     '''
     
-    if len(rates) == 0 or len(severity) == 0:
-        raise ValueError('empty rates or empty severity dataset!')
-    
-    data = rates.merge(severity, on=['gene', 'chrom', 'pos', 'ref', 'alt'])
+    return GeneSites.from_tables(rates, severity, symbol)
+
+def cohort_scale(chroms, male, female):
+    ''' get the factor which scales per site mutation probabilities to the
+    expected number of mutations in a cohort
     
-    if len(data) == 0:
-        raise ValueError('no shared sites between rates and severity datasets!')
+    Args:
+        chroms: chromosomes of the sites
+        male: number of male probands
+        female: number of female probands
     
-    data = data[data['gene'] == symbol]
+    Returns:
+        number of chromosome copies in the cohort, which multiplies the
+        mutation probabilities.
+    '''
     
-    assert len(set(data['chrom'])) == 1
+    # count the samples in the cohort, so we can calculate expected mutations
+    # TODO: add in a better chromX adjustment
+    n_cohort = male + female
+    if set(chroms) == set(['X']):
+        n_cohort = male / 2 + female
     
-    data = data[~data[['pos', 'alt']].duplicated()]
-    return data.sort_values(['pos', 'alt'])
+    return n_cohort * 2
 
 def get_expected_rates(data, male, female):
     ''' calculate expected number of mutations per site.
     
     Args:
-        data: pandas DataFrame, which includes columns for 'chrom' (for
-            chromosome) and 'prob' (for mutation probability)
+        data: pandas DataFrame or GeneSites, which includes columns for 'chrom'
+            (for chromosome) and 'prob' (for mutation probability)
         male: number of male probands
         female: number of female probands
     
@@ -62,51 +79,97 @@ def get_expected_rates(data, male, female):
         the cohort.
     '''
     
-    # count the samples in the cohort, so we can calculate expected mutations
-    # TODO: add in a better chromX adjustment
-    count = male + female
-    if set(data['chrom']) == set(['X']):
-        count = male / 2 + female
-    
     # get the expected mutation rates per base per site for the gene
-    return count * 2 * data['prob']
+    return cohort_scale(data['chrom'], male, female) * data['prob']
 
-def enrichment(de_novos, n_male, n_female, symbol, severity, rates):
+def enrichment(de_novos, n_male, n_female, symbol, severity=None, rates=None,
+        method='newton', sites=None, null_curve=None, binning=None, tail=None,
+        screen=None):
     ''' compute de novo enrichment for a gene
     
     Args:
-        de_novos: table of de novos
+        de_novos: table of de novos. This only needs the de novos in the gene,
+            but can include other genes.
         n_male: number of males
         n_female: number of females
         symbol: HGNC symbol for a gene
         severity: table of per base and per allele severity scores, for every gene
         rates: table of mutation rates
+        method: solver method for the saddlepoint, 'newton' or 'legacy'
+        sites: GeneSites for the gene (e.g. from a SiteStore), to use instead
+            of merging the severity and rates tables.
+        null_curve: function to look up the p-value for the observed score
+            (e.g. from NullCurves), returning None when the score is outside
+            the curve, where the saddlepoint is solved as usual.
+        binning: how to collapse sites before the saddlepoint. None keeps every
+            site, 'exact' merges sites with identical weights, and a number
+            bins weights to that resolution (see weight_bins.bin_weights()).
+        tail: if given, sum the saddlepoint over a range of de novo counts
+            chosen from their Poisson tail (see saddlepoint_with_bound()).
+        screen: if given, skip the saddlepoint for genes whose p-value is
+            certain to be above this, using a cheap lower bound on the
+            p-value (see screen.lower_bound_p()).
     
     Returns:
-        dictionary of de novo enrichment results for a gene
+        dictionary of de novo enrichment results for a gene. With binning,
+        this includes 'weight_shift', the largest change in any site's weight,
+        and 'score_shift', the largest change in the score of any de novo
+        count summed. The unbinned p-value lies between the binned p-values at
+        the observed score plus and minus score_shift (see score_shift()).
+        With tail, this includes 'tail_bound', the most the omitted de novo
+        counts could add to the p-value (NaN for p-values from a null curve).
+        With screen, this includes 'screened', which is True if the p-value
+        is the lower bound, rather than from the saddlepoint.
     '''
     
-    data = harmonise_data(rates, severity, symbol)
+    if sites is None:
+        sites = harmonise_data(rates, severity, symbol)
+    elif isinstance(sites, pandas.DataFrame):
+        sites = GeneSites.from_frame(sites)
     
-    data['score'] = downweight_severity(data)
-    data['prob'] = get_expected_rates(data, n_male, n_female)
+    scores = sites.downweighted()
+    probs = get_expected_rates(sites, n_male, n_female)
     
-    if any(data['score'].isnull()):
+    if isnan(scores).any():
         print("{} has NA in severity".format(symbol))
     
     # intersect the de novos with rate and severity data. This restricts
     # de novos to be within the coding sequence of the gene.
-    data_prefixed = data.chrom.loc[0].startswith('chr')
-    dnm_prefixed = de_novos.chrom.loc[0].startswith('chr')
-    if data_prefixed and not dnm_prefixed:
-        de_novos['chrom'] = 'chr' + de_novos['chrom']
-    de_novos = de_novos.merge(data, on=['gene', 'chrom', 'pos', 'ref', 'alt'])
-    observed_score = sum(de_novos['score'])
-    
-    p_value = saddlepoint(observed_score, data['prob'], data['score'])
-    p_unweighted = poisson.sf(len(de_novos) - 1, sum(data['prob']))
-    
-    return {'symbol': symbol, 'gene_scores': sum(data['score']),
-        'sites': len(set(data['pos'])), 'de_novos': len(de_novos),
+    observed = sites.matches(de_novos)
+    observed_score = sum(scores[observed])
+    
+    p_value, shift, moved, bound, screened = None, 0.0, 0.0, float('nan'), False
+    if screen is not None:
+        with stage('screen'):
+            lower = lower_bound_p(observed_score, probs, scores)
+        if lower > screen:
+            count('screened')
+            p_value, screened = lower, True
+    if null_curve is not None and p_value is None:
+        with stage('null_lookup'):
+            p_value = null_curve(observed_score)
+    if p_value is None:
+        with stage('saddlepoint'):
+            lambdas, weights, shift = compress_sites(probs, scores, binning)
+            if tail is None:
+                p_value = saddlepoint(observed_score, lambdas, weights, method=method)
+            else:
+                p_value, bound = saddlepoint_with_bound(observed_score, lambdas,
+                    weights, method=method, tail=tail)
+            moved = score_shift(observed_score, lambdas, weights, shift,
+                1e-12 if tail is None else tail)
+    p_unweighted = poisson.sf(len(observed) - 1, sum(probs))
+    
+    results = {'symbol': symbol, 'gene_scores': sum(scores),
+        'sites': len(unique(sites.pos)), 'de_novos': len(observed),
         'de_novos_score': round(observed_score, 3), 'p_value': p_value,
         'p_unweighted': p_unweighted}
+    if binning is not None:
+        results['weight_shift'] = shift
+        results['score_shift'] = moved
+    if tail is not None:
+        results['tail_bound'] = bound
+    if screen is not None:
+        results['screened'] = screened
+    
+    return results
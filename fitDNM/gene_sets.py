@@ -0,0 +1,141 @@
+
+import os
+import logging
+
+import numpy
+from scipy.stats import poisson
+
+from fitDNM.gene_enrichment import get_expected_rates
+from fitDNM.saddlepoint import saddlepoint_with_bound
+from fitDNM.site_store import SiteStore
+from fitDNM.weight_bins import compress_sites, score_shift
+
+def read_gene_sets(path):
+    ''' load gene sets from a GMT file, or a list of genes as a single set
+    
+    GMT lines are tab-separated, with the set name, a description, then the
+    HGNC symbols in the set. A file without tabs is read as one gene per line,
+    for a single set named after the file.
+    
+    Args:
+        path: path to GMT file, or list of HGNC symbols
+    
+    Returns:
+        dictionary of lists of HGNC symbols, indexed by set name.
+    '''
+    with open(path) as handle:
+        lines = [x.rstrip('\r\n') for x in handle if x.strip()]
+    
+    if not any('\t' in x for x in lines):
+        name = os.path.splitext(os.path.basename(path))[0]
+        return {name: [x.strip() for x in lines]}
+    
+    sets = {}
+    for line in lines:
+        name, _, *symbols = line.split('\t')
+        sets[name] = [x for x in symbols if x != '']
+    return sets
+
+class GeneTerms:
+    ''' per gene terms for the saddlepoint, computed once and reused by sets
+    
+    Args:
+        sites: GeneSites for the gene
+        de_novos: table of de novos in the gene, or None if there are none
+        male: number of male probands
+        female: number of female probands
+    '''
+    __slots__ = ['probs', 'scores', 'total_prob', 'observed_score',
+        'observed', 'sites']
+    
+    def __init__(self, sites, de_novos, male, female):
+        self.scores = sites.downweighted()
+        self.probs = numpy.asarray(get_expected_rates(sites, male, female))
+        self.total_prob = sum(self.probs)
+        self.sites = len(numpy.unique(sites.pos))
+        
+        observed = [] if de_novos is None else sites.matches(de_novos)
+        self.observed = len(observed)
+        self.observed_score = sum(self.scores[observed])
+
+def set_enrichment(name, terms, method='newton', binning=None, tail=1e-12):
+    ''' compute de novo enrichment for a set of genes
+    
+    The rates and weights of every site in the set are pooled into one
+    saddlepoint, against the summed score of the de novos in the set. Large
+    sets expect far more than 100 de novos, so the saddlepoint is summed over
+    de novo counts chosen from their Poisson tail (see saddlepoint_with_bound()).
+    
+    Args:
+        name: name of the gene set
+        terms: list of GeneTerms for the genes in the set
+        method: solver method for the saddlepoint, 'newton' or 'legacy'
+        binning: how to collapse the pooled sites before the saddlepoint (see
+            enrichment()). Pooled sets gain the most from binning.
+        tail: largest Poisson probability of the omitted de novo counts,
+            relative to the smallest count that can reach the observed score.
+    
+    Returns:
+        dictionary of de novo enrichment results for the gene set, including
+        'tail_bound', the most the omitted counts could add to the p-value.
+        With binning, this includes 'weight_shift' and 'score_shift' (see
+        enrichment()).
+    '''
+    probs = numpy.concatenate([x.probs for x in terms])
+    scores = numpy.concatenate([x.scores for x in terms])
+    observed_score = sum(x.observed_score for x in terms)
+    observed = sum(x.observed for x in terms)
+    
+    lambdas, weights, shift = compress_sites(probs, scores, binning)
+    p_value, bound = saddlepoint_with_bound(observed_score, lambdas, weights,
+        method=method, tail=tail)
+    p_unweighted = poisson.sf(observed - 1, sum(x.total_prob for x in terms))
+    
+    results = {'gene_set': name, 'genes': len(terms),
+        'sites': sum(x.sites for x in terms), 'de_novos': observed,
+        'de_novos_score': round(observed_score, 3), 'p_value': p_value,
+        'p_unweighted': p_unweighted, 'tail_bound': bound}
+    if binning is not None:
+        results['weight_shift'] = shift
+        results['score_shift'] = score_shift(observed_score, lambdas, weights,
+            shift, tail)
+    
+    return results
+
+def score_gene_sets(gene_sets, de_novos, males, females, store, method='newton',
+        binning=None, tail=1e-12):
+    ''' score gene sets from the sites in a site store
+    
+    Each gene's sites are loaded and turned into saddlepoint terms once, no
+    matter how many sets include the gene. Genes missing from the store are
+    left out of their sets.
+    
+    Args:
+        gene_sets: dictionary of lists of HGNC symbols, indexed by set name
+        de_novos: dictionary of per gene tables of de novos
+        males: number of male probands
+        females: number of female probands
+        store: path to a SiteStore folder
+        method: solver method for the saddlepoint, 'newton' or 'legacy'
+        binning: how to collapse the pooled sites before the saddlepoint
+        tail: largest Poisson probability of the omitted de novo counts (see
+            set_enrichment())
+    
+    Yields:
+        tuple of (set name, dictionary of enrichment results)
+    '''
+    store = SiteStore(store)
+    symbols = {x for genes in gene_sets.values() for x in genes}
+    missing = sorted(x for x in symbols if x not in store)
+    if len(missing) > 0:
+        logging.info(f'{len(missing)} genes in gene sets are not in the site store')
+    
+    terms = {x: GeneTerms(store[x], de_novos.get(x), males, females)
+        for x in sorted(symbols) if x in store}
+    
+    for name, genes in gene_sets.items():
+        genes = [terms[x] for x in dict.fromkeys(genes) if x in terms]
+        if len(genes) == 0:
+            logging.info(f'skipping {name}, as none of its genes are in the site store')
+            continue
+        yield name, set_enrichment(name, genes, method, binning, tail)
@@ -0,0 +1,240 @@
+
+import numpy
+import pandas
+
+from fitDNM.open_severity import encode_alleles, decode_alleles
+
+# consequence types, with their position in this list used as the code
+CONSEQUENCES = ['nonsense', 'missense', 'synonymous', 'splice_lof',
+    'splice_region']
+
+def _encode_consequences(values):
+    codes = pandas.Categorical(values, categories=CONSEQUENCES).codes
+    if (codes < 0).any():
+        raise ValueError('unknown consequence type')
+    return codes.astype(numpy.uint8)
+
+def site_keys(pos, ref, alt):
+    ''' combine positions and allele codes into sortable int64 keys
+    
+    Keys sort by position, then ref allele, then alt allele.
+    '''
+    return (numpy.asarray(pos, dtype=numpy.int64) << 4) | \
+        (numpy.asarray(ref, dtype=numpy.int64) << 2) | \
+        numpy.asarray(alt, dtype=numpy.int64)
+
+def _lookup(keys, query):
+    ''' find the first matching entry in keys for each query key
+    
+    Returns:
+        tuple of (boolean array of whether each query key matched, array of
+        the indices of the matches in keys)
+    '''
+    order = numpy.argsort(keys, kind='stable')
+    ordered = keys[order]
+    idx = numpy.searchsorted(ordered, query)
+    if len(ordered) == 0:
+        return numpy.zeros(len(query), dtype=bool), idx
+    
+    idx = numpy.minimum(idx, len(ordered) - 1)
+    return ordered[idx] == query, order[idx]
+
+def downweight_scores(pos, prob, score):
+    ''' downweight severities by the rate-weighted severity at each site
+    
+    score = score - sum(score * prob) across the alleles at each position
+    
+    Alleles are grouped by position with integer group codes, then summed with
+    numpy.bincount. bincount adds values one at a time in row order, so the
+    sums (and scores) are identical to summing each group in a python loop.
+    Sorted positions (as within a gene) skip the sort needed to find groups.
+    
+    Args:
+        pos: array of positions, or any integer key for each site (e.g. to
+            keep sites on different chromosomes apart in exome-wide tables)
+        prob: array of mutation probabilities
+        score: array of severity scores
+    
+    Returns:
+        array of downweighted severity scores
+    '''
+    pos = numpy.asarray(pos)
+    score = numpy.asarray(score, dtype=numpy.float64)
+    values = numpy.asarray(prob, dtype=numpy.float64) * score
+    if len(pos) == 0:
+        return score.copy()
+    
+    changed = pos[1:] != pos[:-1]
+    if (pos[1:] >= pos[:-1]).all():
+        groups = numpy.concatenate([[0], numpy.cumsum(changed)])
+    else:
+        _, groups = numpy.unique(pos, return_inverse=True)
+    
+    return score - numpy.bincount(groups, weights=values)[groups]
+
+class GeneSites:
+    ''' harmonised sites for a gene, as parallel numpy arrays
+    
+    Each site and alt allele has a position, ref and alt allele codes (see
+    open_severity.ALLELES), mutation probability, severity score and
+    consequence code (see CONSEQUENCES). Sites are sorted by position then alt
+    allele, with one entry per position and alt allele.
+    
+    Columns can be accessed by name (e.g. sites['prob']), as for a table.
+    'chrom' gives a one item list, since every site is on the same chromosome.
+    
+    Args:
+        symbol: HGNC symbol for the gene
+        chrom: chromosome of the gene
+        pos: array of positions
+        ref: array of ref allele codes
+        alt: array of alt allele codes
+        prob: array of mutation probabilities
+        score: array of severity scores
+        consequence: array of consequence codes
+    '''
+    __slots__ = ['symbol', 'chrom', 'pos', 'ref', 'alt', 'prob', 'score',
+        'consequence']
+    COLUMNS = ['pos', 'ref', 'alt', 'prob', 'score', 'consequence']
+    DTYPES = {'pos': numpy.int32, 'ref': numpy.uint8, 'alt': numpy.uint8,
+        'prob': numpy.float64, 'score': numpy.float64,
+        'consequence': numpy.uint8}
+    
+    def __init__(self, symbol, chrom, pos, ref, alt, prob, score, consequence):
+        self.symbol = symbol
+        self.chrom = str(chrom)
+        self.pos = numpy.asarray(pos, dtype=numpy.int32)
+        self.ref = numpy.asarray(ref, dtype=numpy.uint8)
+        self.alt = numpy.asarray(alt, dtype=numpy.uint8)
+        self.prob = numpy.asarray(prob, dtype=numpy.float64)
+        self.score = numpy.asarray(score, dtype=numpy.float64)
+        self.consequence = numpy.asarray(consequence, dtype=numpy.uint8)
+    
+    def __repr__(self):
+        return f'GeneSites("{self.symbol}", {self.chrom}, n={len(self)})'
+    
+    def __len__(self):
+        return len(self.pos)
+    
+    def __getitem__(self, column):
+        if column == 'chrom':
+            return [self.chrom]
+        if column not in self.COLUMNS:
+            raise KeyError(column)
+        return getattr(self, column)
+    
+    @classmethod
+    def from_tables(cls, rates, severity, symbol):
+        ''' join tables of mutation rates and severity scores for a gene
+        
+        Sites are matched on chromosome, position, ref and alt allele. Where a
+        position and alt allele occurs more than once in the rates (e.g. from
+        overlapping transcripts), the first entry is kept.
+        
+        Args:
+            rates: pandas DataFrame of mutation rates, with gene, chrom, pos,
+                ref, alt, prob and consequence columns
+            severity: pandas DataFrame of severity scores, with chrom, pos,
+                ref, alt and score columns, or dictionary of CADD arrays (as
+                from CaddReader.extract)
+            symbol: HGNC symbol for the gene
+        
+        Returns:
+            GeneSites object
+        '''
+        if len(rates) == 0 or len(severity['pos']) == 0:
+            raise ValueError('empty rates or empty severity dataset!')
+        
+        rates = rates[rates['gene'] == symbol]
+        chroms = set(rates['chrom'])
+        assert len(chroms) == 1
+        chrom = chroms.pop()
+        
+        if isinstance(severity, pandas.DataFrame):
+            severity = severity[severity['chrom'] == chrom]
+            severity = {'pos': severity['pos'].to_numpy(),
+                'ref': encode_alleles(severity['ref']),
+                'alt': encode_alleles(severity['alt']),
+                'score': severity['score'].to_numpy()}
+        
+        pos = rates['pos'].to_numpy()
+        ref = encode_alleles(rates['ref'])
+        alt = encode_alleles(rates['alt'])
+        
+        found, idx = _lookup(site_keys(severity['pos'], severity['ref'],
+            severity['alt']), site_keys(pos, ref, alt))
+        
+        if not found.any():
+            raise ValueError('no shared sites between rates and severity datasets!')
+        
+        # keep the first rate for each position and alt allele, sorted by both
+        rows = numpy.flatnonzero(found)
+        _, first = numpy.unique(site_keys(pos[rows], 0, alt[rows]), return_index=True)
+        rows, idx = rows[first], idx[rows[first]]
+        
+        # CADD PHRED scores have three decimals, which rounding float32 recovers
+        score = numpy.asarray(severity['score'])[idx]
+        if score.dtype == numpy.float32:
+            score = numpy.round(score.astype(numpy.float64), 3)
+        
+        return cls(symbol, chrom, pos[rows], ref[rows], alt[rows],
+            rates['prob'].to_numpy()[rows], score,
+            _encode_consequences(rates['consequence'].to_numpy()[rows]))
+    
+    @classmethod
+    def from_frame(cls, data):
+        ''' convert a table of harmonised sites (as from to_frame) to GeneSites
+        '''
+        return cls(data['gene'].iloc[0], data['chrom'].iloc[0], data['pos'],
+            encode_alleles(data['ref']), encode_alleles(data['alt']),
+            data['prob'], data['score'],
+            _encode_consequences(data['consequence']))
+    
+    def to_frame(self):
+        ''' convert to a table of harmonised sites
+        
+        Returns:
+            pandas DataFrame with gene, chrom, pos, ref, alt, prob, score and
+            consequence columns.
+        '''
+        return pandas.DataFrame({'gene': self.symbol, 'chrom': self.chrom,
+            'pos': self.pos.astype(numpy.int64), 'ref': decode_alleles(self.ref),
+            'alt': decode_alleles(self.alt), 'prob': self.prob,
+            'score': self.score,
+            'consequence': numpy.array(CONSEQUENCES, dtype=object)[self.consequence]})
+    
+    def downweighted(self):
+        ''' downweight severities by the rate-weighted severity at each site
+        
+        severity = severity - sum(severity * mu_rate) across alleles at a site
+        
+        Returns:
+            array of downweighted severity scores
+        '''
+        return downweight_scores(self.pos, self.prob, self.score)
+    
+    def matches(self, de_novos):
+        ''' find the sites for each de novo in the gene
+        
+        Args:
+            de_novos: pandas DataFrame of de novos, with gene, chrom, pos, ref
+                and alt columns
+        
+        Returns:
+            array of indices of the sites matching de novos, in de novo order.
+            De novos outside the sites, or which are not SNVs, are dropped.
+        '''
+        chrom = de_novos['chrom'].astype(str)
+        if self.chrom.startswith('chr'):
+            chrom = chrom.where(chrom.str.startswith('chr'), 'chr' + chrom)
+        
+        snv = de_novos['ref'].isin(['A', 'C', 'G', 'T']) & \
+            de_novos['alt'].isin(['A', 'C', 'G', 'T'])
+        de_novos = de_novos[snv & (de_novos['gene'] == self.symbol) &
+            (chrom == self.chrom)]
+        
+        found, idx = _lookup(site_keys(self.pos, self.ref, self.alt),
+            site_keys(de_novos['pos'], encode_alleles(de_novos['ref']),
+                encode_alleles(de_novos['alt'])))
+        
+        return idx[found]
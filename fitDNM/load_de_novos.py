@@ -0,0 +1,129 @@
+
+import gzip
+import logging
+import re
+
+import pandas
+
+COLUMNS = ['gene', 'chrom', 'pos', 'ref', 'alt']
+DTYPES = {'gene': str, 'chrom': str, 'ref': str, 'alt': str}
+
+def is_gzipped(path):
+    ''' check if a file is gzip (or bgzip) compressed, from its magic number
+    '''
+    with open(path, 'rb') as handle:
+        return handle.read(2) == b'\x1f\x8b'
+
+def _open(path):
+    return gzip.open(path, 'rt') if is_gzipped(path) else open(path)
+
+def vcf_header_lines(path):
+    ''' count the '##' metadata lines at the start of a VCF
+    
+    Returns:
+        number of metadata lines, or None if the file is not a VCF.
+    '''
+    count, line = 0, ''
+    with _open(path) as handle:
+        for line in handle:
+            if not line.startswith('##'):
+                break
+            count += 1
+        if count == 0 or not line.startswith('#CHROM'):
+            return None
+    
+    return count
+
+def _read_table(path, chunksize):
+    ''' read a table of de novos in chunks, with gene, chrom, pos, ref and alt
+    columns (in any order, and other columns are ignored)
+    '''
+    compression = 'gzip' if is_gzipped(path) else None
+    chunks = pandas.read_table(path, usecols=COLUMNS, dtype=DTYPES,
+        compression=compression, chunksize=chunksize)
+    try:
+        for chunk in chunks:
+            yield chunk[COLUMNS]
+    finally:
+        chunks.close()
+
+def _read_vcf(path, gene_key, chunksize, skiprows):
+    ''' read de novos from a VCF in chunks, taking the gene from an INFO field
+    
+    Multi-allelic sites are split into one row per alt allele. Sites without
+    the INFO field are skipped.
+    '''
+    compression = 'gzip' if is_gzipped(path) else None
+    chunks = pandas.read_table(path, skiprows=skiprows,
+        usecols=['#CHROM', 'POS', 'REF', 'ALT', 'INFO'],
+        dtype={'#CHROM': str, 'REF': str, 'ALT': str, 'INFO': str},
+        compression=compression, chunksize=chunksize)
+    
+    pattern = f'(?:^|;){re.escape(gene_key)}=([^;]+)'
+    try:
+        for chunk in chunks:
+            chunk = chunk.rename(columns={'#CHROM': 'chrom', 'POS': 'pos',
+                'REF': 'ref', 'ALT': 'alt'})
+            chunk['gene'] = chunk['INFO'].str.extract(pattern, expand=False)
+            if chunk['gene'].isnull().any():
+                logging.info(f'skipping {chunk["gene"].isnull().sum()} VCF '
+                    f'sites without {gene_key} in INFO')
+            chunk = chunk[~chunk['gene'].isnull()]
+            chunk = chunk.assign(alt=chunk['alt'].str.split(',')).explode('alt')
+            yield chunk[COLUMNS]
+    finally:
+        chunks.close()
+
+def read_de_novos(path, gene_key='GENE', chunksize=1000000):
+    ''' read de novos in chunks, from a table or VCF, optionally gzipped
+    
+    Args:
+        path: path to table of de novos, with gene, chrom, pos, ref and alt
+            columns, or to a VCF of de novos. Either can be gzip or bgzip
+            compressed.
+        gene_key: INFO field which holds the HGNC symbol, for VCF inputs
+        chunksize: number of lines to read at once
+    
+    Yields:
+        pandas DataFrames with gene, chrom, pos, ref and alt columns
+    '''
+    skiprows = vcf_header_lines(path)
+    if skiprows is not None:
+        yield from _read_vcf(path, gene_key, chunksize, skiprows)
+    else:
+        yield from _read_table(path, chunksize)
+
+def split_by_gene(de_novos):
+    ''' split a table of de novos into a small table for each gene
+    
+    Args:
+        de_novos: pandas DataFrame of de novos, with a gene column
+    
+    Returns:
+        dictionary of per gene tables (each with a fresh index), indexed by
+        symbol.
+    '''
+    return {symbol: x.reset_index(drop=True)
+        for symbol, x in de_novos.groupby('gene', sort=False)}
+
+def group_de_novos(path, gene_key='GENE', chunksize=1000000):
+    ''' read de novos in one pass, grouped by gene
+    
+    The file does not need to be sorted. Only one chunk of the file is held
+    as a full table at once, and each gene ends up with its own small table,
+    so scoring a gene never touches the de novos in other genes.
+    
+    Args:
+        path: path to table or VCF of de novos (see read_de_novos)
+        gene_key: INFO field which holds the HGNC symbol, for VCF inputs
+        chunksize: number of lines to read at once
+    
+    Returns:
+        dictionary of per gene tables of de novos, indexed by symbol.
+    '''
+    parts = {}
+    for chunk in read_de_novos(path, gene_key, chunksize):
+        for symbol, de_novos in split_by_gene(chunk).items():
+            parts.setdefault(symbol, []).append(de_novos)
+    
+    return {symbol: pandas.concat(x, ignore_index=True) for symbol, x in parts.items()}
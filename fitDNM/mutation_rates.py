@@ -1,83 +1,101 @@
 
-import asyncio
 import logging
+import os
+from functools import lru_cache
 
 import pandas
 
-from denovonear.load_gene import load_gene, \
-    construct_gene_object, minimise_transcripts
+from denovonear.load_gene import minimise_transcripts
 from denovonear.load_mutation_rates import load_mutation_rates
 from denovonear.site_specific_rates import SiteRates
-from denovonear.rate_limiter import RateLimiter
 
-def get_gene_rates(symbol, de_novos, gencode=None, constraint=None, mut_path=None):
-    ''' get per nucleotide mutation rates for all SNV alt alleles in a gene
+from fitDNM.ensembl_genes import EnsemblGenes
+from fitDNM.profiling import stage
 
+def get_mutation_rates(mut_path=None):
+    ''' load a table of sequence context based mutation rates, once per process
+    
+    The rates table is the same for every gene, so it is parsed on first use,
+    then reused for later genes. Worker processes each keep their own copy.
+    The returned list is shared, so should not be modified.
+    
     Args:
-        symbol: HGNC symbol for gene
-        de_novos: pandas DataFrame containing de novo candidates.
-        mut_path: path to table of sequence context based mutation rates.
-
+        mut_path: path to table of sequence context based mutation rates. If
+            None, this uses the trinucleotide rates included with denovonear.
+    
     Returns:
-        pandas DataFrame of mutation rates at each possible SNV change within
-        the coding sequence of a gene.
+        list of [initial, changed, rate] lists e.g. [[b'AGA', b'ATA', b'5e-8']]
     '''
-    loop = asyncio.get_event_loop()
-    result = loop.run_until_complete(_async_get_gene_rates(
-        symbol, de_novos, gencode, constraint, mut_path))
-    return result
+    if mut_path is not None:
+        mut_path = os.path.abspath(mut_path)
+    return _load_mutation_rates(mut_path)
 
-async def _async_get_gene_rates(symbol, de_novos, gencode=None, constraint=None, mut_path=None):
+@lru_cache(maxsize=None)
+def _load_mutation_rates(mut_path):
+    return load_mutation_rates(mut_path)
+
+def get_gene_rates(symbol, de_novos, gencode=None, constraint=None, mut_path=None):
     ''' get per nucleotide mutation rates for all SNV alt alleles in a gene
-    
+
     Args:
         symbol: HGNC symbol for gene
-        de_novos: pandas DataFrame containing de novo candidates.
+        de_novos: pandas DataFrame containing de novo candidates, used to pick
+            transcripts containing the de novos. If None, this uses the
+            canonical transcript.
+        gencode: Gencode object, or other mapping of symbols to genes. If
+            None, genes are loaded from Ensembl.
         mut_path: path to table of sequence context based mutation rates.
-    
+
     Returns:
         pandas DataFrame of mutation rates at each possible SNV change within
         the coding sequence of a gene.
     '''
+    mut_dict = get_mutation_rates(mut_path)
+    
+    positions = []
+    if de_novos is not None:
+        positions = de_novos['pos'][de_novos['gene'] == symbol]
     
-    mut_dict = load_mutation_rates(mut_path)
+    if gencode is None:
+        gencode = EnsemblGenes()
     
-    positions = de_novos['pos'][de_novos['gene'] == symbol]
-    if gencode:
-        if symbol not in gencode:
-            logging.info(f'cannot find {symbol} in gencode genes')
-            raise IndexError
+    if symbol not in gencode:
+        logging.info(f'cannot find {symbol} in gencode genes')
+        raise IndexError
+    with stage('gene_load'):
         gene = gencode[symbol]
-    else:
-        async with RateLimiter(per_second=15) as ensembl:
-            gene = await load_gene(ensembl, symbol)
     
     if len(gene.transcripts) == 0:
         logging.info(f'cannot find transcripts for {symbol}')
         raise IndexError
     
-    minimized = minimise_transcripts(gene.transcripts, positions)
-    transcripts = [x for x in gene.transcripts if x.get_name() in minimized]
+    if len(positions) > 0:
+        minimized = minimise_transcripts(gene.transcripts, positions)
+        transcripts = [x for x in gene.transcripts if x.get_name() in minimized]
+    else:
+        # without any de novos to place, fall back to the canonical transcript
+        transcripts = [gene.canonical]
     
     if len(transcripts) == 0:
         logging.error(f'DNMs for {symbol} not in any suitable transcript')
         raise IndexError
     
-    merged = None
-    mu_rate = []
-    for transcript in transcripts:
-        rates = SiteRates(transcript, mut_dict, merged)
-        for cq in ['nonsense', 'missense', 'synonymous', 'splice_lof', 'splice_region']:
-            for choice in rates[cq]:
-                choice['pos'] = transcript.get_position_on_chrom(choice['pos'], choice['offset'])
-                choice['consequence'] = cq
-                choice['gene'] = symbol
-                choice['chrom'] = gene.chrom
-                
-                mu_rate.append(choice)
-        if merged is None:
-            merged = transcript
-        merged += transcript
+    with stage('site_rates'):
+        merged = None
+        mu_rate = []
+        for transcript in transcripts:
+            rates = SiteRates(transcript, mut_dict, merged)
+            for cq in ['nonsense', 'missense', 'synonymous', 'splice_lof', 'splice_region']:
+                for choice in rates[cq]:
+                    choice['pos'] = transcript.get_position_on_chrom(choice['pos'], choice['offset'])
+                    choice['consequence'] = cq
+                    choice['gene'] = symbol
+                    choice['chrom'] = gene.chrom
+                    
+                    mu_rate.append(choice)
+            if merged is None:
+                merged = transcript
+            merged += transcript
     
     data = pandas.DataFrame(mu_rate)
     data = data.sort_values(['chrom', 'pos', 'alt'])
@@ -0,0 +1,203 @@
+
+import os
+from functools import lru_cache
+
+import numpy
+from scipy.stats import poisson
+
+from fitDNM.saddlepoint import saddlepoint
+
+# smallest p-value kept in the curves, to keep log p-values finite
+MIN_P = 1e-300
+
+# relative error allowed in the curves, for files which don't record it
+RTOL = 1e-3
+
+# fractions of each interval where the interpolated p-values are checked
+QUARTERS = numpy.array([0.25, 0.5, 0.75])
+
+def _relative_error(estimate, exact):
+    ''' get the relative error of p-values, with both floored at MIN_P
+    '''
+    exact = numpy.maximum(exact, MIN_P)
+    return abs(numpy.maximum(estimate, MIN_P) - exact) / exact
+
+def null_curve(lambdas, weights, method='newton', points=33, rtol=RTOL,
+        max_points=1025, min_p=1e-12):
+    ''' tabulate saddlepoint p-values over a grid of observed scores
+    
+    For fixed rates and weights, the p-value only depends on the observed
+    score y. This evaluates p-values on an even grid of y, from 0 up to the
+    score where the p-value must be below min_p. The raw saddlepoint p-values
+    can rise slightly with y, so the curve holds the running minimum of the
+    p-values, which never increases, and log p-values are interpolated
+    linearly between grid points.
+    
+    Each interval is checked against the raw saddlepoint at its quarter points
+    and at both ends, where the running minimum can sit below the raw p-value.
+    Intervals that miss inside by more than rtol are split, until every
+    interval passes, or the grid has max_points. Intervals that miss at an
+    end, or that are narrower than the range over max_points (e.g. around a
+    jump in the p-values), can't be fixed by splitting, so they keep their
+    error, and lookups in them fall back to the saddlepoint.
+    
+    Args:
+        lambdas: vector of per base and allele mutation rates within a gene
+        weights: vector of per base and allele weights
+        method: solver method for the saddlepoint, 'newton' or 'legacy'
+        points: number of points in the initial grid
+        rtol: relative error allowed at the interval checks
+        max_points: maximum number of points in the grid
+        min_p: p-value below which the curve stops. The largest y is where
+            the Poisson chance of enough de novos to reach y is below this.
+    
+    Returns:
+        tuple of (array of y values, array of log p-values, array of the
+        largest relative error found in each interval), or None if the
+        p-values can't be computed (e.g. when no weight is positive).
+    '''
+    lambdas = numpy.asarray(lambdas, dtype=float)
+    weights = numpy.asarray(weights, dtype=float)
+    top = weights.max() if len(weights) > 0 else 0
+    if top <= 0:
+        return None
+    
+    def p_values(y):
+        p = [saddlepoint(x, lambdas, weights, method=method) for x in y]
+        return numpy.array([numpy.nan if x is None else x for x in p], dtype=float)
+    
+    # reaching y needs at least y / max(weight) de novos. The p-value jumps
+    # from 1 at y=0, so the grid starts just above zero.
+    count = max(poisson.isf(min_p, lambdas.sum()), 1)
+    y = numpy.linspace(0, top * count, points)
+    y[0] = y[1] * 1e-6
+    p = p_values(y)
+    if numpy.isnan(p).any():
+        return None
+    
+    # raw p-values at the quarter points of each interval, kept so every
+    # interval can be checked again when new grid points lower the running
+    # minimum. Splitting an interval makes its quarter points the midpoints
+    # of the two new intervals.
+    checks = numpy.full((len(y) - 1, len(QUARTERS)), numpy.nan)
+    min_width = (y[-1] - y[0]) / max_points
+    while True:
+        rows, cols = numpy.nonzero(numpy.isnan(checks))
+        checks[rows, cols] = p_values(y[rows] + QUARTERS[cols] * (y[rows + 1] - y[rows]))
+        if numpy.isnan(checks).any():
+            return None
+        
+        log_p = numpy.log(numpy.maximum(numpy.minimum.accumulate(p), MIN_P))
+        drift = _relative_error(numpy.exp(log_p), p)
+        drift = numpy.maximum(drift[:-1], drift[1:])
+        estimate = numpy.exp(log_p[:-1, None] + QUARTERS * numpy.diff(log_p)[:, None])
+        error = numpy.maximum(_relative_error(estimate, checks).max(axis=1), drift)
+        
+        # jumps in the saddlepoint can't be fixed by splitting either, so
+        # intervals stop splitting once they are narrow
+        split = numpy.flatnonzero((error > rtol) & (drift <= rtol)
+            & (numpy.diff(y) > min_width))
+        if len(split) == 0 or len(y) + len(split) > max_points:
+            break
+        
+        left, mid, right = checks[split].T
+        y = numpy.insert(y, split + 1, (y[split] + y[split + 1]) / 2)
+        p = numpy.insert(p, split + 1, mid)
+        checks[split] = numpy.nan
+        checks[split, 1] = left
+        new = numpy.full((len(split), len(QUARTERS)), numpy.nan)
+        new[:, 1] = right
+        checks = numpy.insert(checks, split + 1, new, axis=0)
+    
+    return y, log_p, error
+
+class NullCurves:
+    ''' p-value curves for every gene in a site store, for one cohort
+    
+    The curves are stored in one file in the site store folder, named after the
+    cohort size and solver method, as the curves depend on both. The file also
+    holds the relative error the curves were built to. Scores in intervals
+    whose checked error is above this are never looked up.
+    
+    Args:
+        folder: path to the SiteStore folder
+        males: number of male probands
+        females: number of female probands
+        method: solver method the curves were computed with
+        rtol: relative error allowed in the curves. Defaults to the value in
+            the file, if there is one.
+    '''
+    def __init__(self, folder, males, females, method='newton', rtol=None):
+        self.path = os.path.join(folder, f'null.{males}_{females}.{method}.npz')
+        self.curves = {}
+        self.rtol = RTOL
+        if os.path.exists(self.path):
+            with numpy.load(self.path) as data:
+                data = {k: data[k] for k in data.files}
+            if 'rtol' in data:
+                self.rtol = float(data['rtol'])
+            offsets = data['offsets']
+            for i, symbol in enumerate(data['symbols']):
+                start, end = offsets[i], offsets[i + 1]
+                # each curve has one fewer interval than grid points
+                self.curves[str(symbol)] = (data['y'][start:end],
+                    data['log_p'][start:end], data['error'][start - i:end - i - 1])
+        if rtol is not None:
+            self.rtol = rtol
+    
+    def __contains__(self, symbol):
+        return symbol in self.curves
+    
+    def __len__(self):
+        return len(self.curves)
+    
+    def add(self, symbol, curve):
+        ''' add the curve for a gene (as from null_curve)
+        '''
+        self.curves[symbol] = curve
+    
+    def write(self):
+        ''' write every curve to disk, once all genes have been added
+        '''
+        symbols = sorted(self.curves)
+        curves = [self.curves[x] for x in symbols]
+        sizes = [len(y) for y, _, _ in curves]
+        numpy.savez_compressed(self.path, symbols=numpy.array(symbols, dtype=str),
+            offsets=numpy.concatenate([[0], numpy.cumsum(sizes)]).astype(numpy.int64),
+            y=numpy.concatenate([y for y, _, _ in curves] + [[]]),
+            log_p=numpy.concatenate([x for _, x, _ in curves] + [[]]),
+            error=numpy.concatenate([x for _, _, x in curves] + [[]]),
+            rtol=self.rtol)
+    
+    def error(self, symbol):
+        ''' get the largest relative error found when checking a gene's curve
+        '''
+        return float(self.curves[symbol][2].max())
+    
+    def p_value(self, symbol, y):
+        ''' look up the p-value for an observed score in a gene
+        
+        Returns:
+            p-value, or None if the gene has no curve, the score is outside
+            the curve, or the score's interval is less accurate than rtol.
+            Use the saddlepoint directly for those.
+        '''
+        if symbol not in self.curves:
+            return None
+        
+        grid, log_p, error = self.curves[symbol]
+        if y <= 0:
+            return 1.0
+        if y < grid[0] or y > grid[-1]:
+            return None
+        i = min(numpy.searchsorted(grid, y, side='right') - 1, len(error) - 1)
+        if error[i] > self.rtol:
+            return None
+        return float(numpy.exp(numpy.interp(y, grid, log_p)))
+
+@lru_cache(maxsize=4)
+def load_null_curves(folder, males, females, method='newton'):
+    ''' load the null curves for a cohort once per process, as every gene
+    scored from the store looks up its curve
+    '''
+    return NullCurves(folder, males, females, method)
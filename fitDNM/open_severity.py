@@ -1,7 +1,180 @@
 
+import io
+from collections import defaultdict
+
+import numpy
 import pandas
 import pysam
 
+# SNV alleles, with their position in this list used as the allele code
+ALLELES = ['A', 'C', 'G', 'T']
+
+def encode_alleles(alleles):
+    ''' convert a vector of alleles to uint8 codes (A=0, C=1, G=2, T=3)
+    '''
+    codes = pandas.Categorical(alleles, categories=ALLELES).codes
+    if (codes < 0).any():
+        raise ValueError('non-SNV allele in CADD file')
+    return codes.astype(numpy.uint8)
+
+def decode_alleles(codes):
+    ''' convert a vector of uint8 allele codes back to allele strings
+    '''
+    return numpy.array(ALLELES, dtype=object)[codes]
+
+def merge_regions(regions):
+    ''' merge overlapping gene regions, so each part of the genome is read once
+    
+    Args:
+        regions: list of (chrom, start, end) tuples, with 0-based half-open
+            coordinates, as used by tabix.
+    
+    Returns:
+        dictionary of merged regions (as lists of [start, end]) for each
+        chromosome, sorted by start position.
+    '''
+    merged = defaultdict(list)
+    for chrom, start, end in sorted(regions, key=lambda x: (x[0], x[1])):
+        if merged[chrom] and start <= merged[chrom][-1][1]:
+            merged[chrom][-1][1] = max(merged[chrom][-1][1], end)
+        else:
+            merged[chrom].append([start, end])
+    
+    return merged
+
+class CaddReader:
+    ''' extract CADD scores for many genes from a single tabix handle
+    
+    Gene regions are sorted by chromosome and merged before reading, so the
+    bgzip file is read once, in order, rather than reopened and seeked for
+    every gene. Lines are parsed in bulk into typed numpy arrays, rather than
+    one python object per line, then sliced for each gene.
+    
+    See downloadable CADD files here: http://cadd.gs.washington.edu/download
+    
+    Args:
+        cadd_path: path to CADD file (bgzip compressed and tabix-indexed)
+    '''
+    def __init__(self, cadd_path):
+        self.tabix = pysam.TabixFile(cadd_path)
+        self.prefixed = self.tabix.contigs[0].startswith('chr')
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+    
+    def close(self):
+        self.tabix.close()
+    
+    def _contig(self, chrom):
+        ''' match the chromosome prefix style to the CADD file
+        '''
+        if chrom.startswith('chr') and not self.prefixed:
+            return chrom[3:]
+        elif self.prefixed and not chrom.startswith('chr'):
+            return f'chr{chrom}'
+        return chrom
+    
+    def _read(self, contig, start, end):
+        ''' parse the CADD lines within a region into typed arrays
+        
+        Returns:
+            dictionary of 'pos' (int32), 'ref' and 'alt' (uint8 allele codes)
+            and 'score' (float32) arrays, sorted by position and alt allele.
+        '''
+        text = '\n'.join(self.tabix.fetch(contig, start, end))
+        if text == '':
+            return {'pos': numpy.zeros(0, dtype=numpy.int32),
+                'ref': numpy.zeros(0, dtype=numpy.uint8),
+                'alt': numpy.zeros(0, dtype=numpy.uint8),
+                'score': numpy.zeros(0, dtype=numpy.float32)}
+        
+        table = pandas.read_csv(io.StringIO(text), sep='\t', header=None,
+            usecols=[1, 2, 3, 5], names=['pos', 'ref', 'alt', 'score'],
+            dtype={'pos': numpy.int32, 'ref': str, 'alt': str,
+                'score': numpy.float32}, engine='c')
+        
+        arrays = {'pos': table['pos'].to_numpy(),
+            'ref': encode_alleles(table['ref']),
+            'alt': encode_alleles(table['alt']),
+            'score': table['score'].to_numpy()}
+        
+        order = numpy.lexsort((arrays['alt'], arrays['pos']))
+        return {k: v[order] for k, v in arrays.items()}
+    
+    def extract(self, regions):
+        ''' get CADD scores for many genes in one pass over the CADD file
+        
+        Args:
+            regions: list of (symbol, chrom, start, end) tuples for each gene,
+                where start and end are as for pysam.TabixFile.fetch.
+        
+        Returns:
+            dictionary of per gene arrays (as from _read), indexed by symbol.
+            The arrays are views on the arrays for the merged regions.
+        '''
+        merged = merge_regions((self._contig(chrom), start, end)
+            for _, chrom, start, end in regions)
+        
+        # read every merged region, and join them per chromosome
+        contigs = {}
+        for contig in sorted(merged):
+            parts = [self._read(contig, start, end) for start, end in merged[contig]]
+            contigs[contig] = {k: numpy.concatenate([x[k] for x in parts])
+                for k in ['pos', 'ref', 'alt', 'score']}
+        
+        genes = {}
+        for symbol, chrom, start, end in regions:
+            arrays = contigs[self._contig(chrom)]
+            # tabix regions include sites after start, up to and including end
+            lo, hi = numpy.searchsorted(arrays['pos'], [start, end], side='right')
+            genes[symbol] = {k: v[lo:hi] for k, v in arrays.items()}
+        
+        return genes
+
+def severity_table(symbol, chrom, arrays):
+    ''' convert the CADD arrays for a gene to a table of severity scores
+    
+    CADD PHRED scores are given to three decimal places, so rounding the
+    float32 scores recovers the original values.
+    
+    Args:
+        symbol: HGNC symbol for gene
+        chrom: chromosome, with the prefix style to use in the table
+        arrays: dictionary of CADD arrays for the gene, from CaddReader.extract
+    
+    Returns:
+        pandas DataFrame of severity scores at each possible SNV change within
+        the gene region.
+    '''
+    cadd = pandas.DataFrame({'chrom': str(chrom),
+        'pos': arrays['pos'].astype(numpy.int64),
+        'ref': decode_alleles(arrays['ref']),
+        'alt': decode_alleles(arrays['alt']),
+        'score': numpy.round(arrays['score'].astype(numpy.float64), 3)})
+    cadd['gene'] = symbol
+    
+    return cadd
+
+def get_cadd_severities(regions, cadd_path):
+    ''' get severity tables for many genes, with a single pass over the CADD file
+    
+    Args:
+        regions: list of (symbol, chrom, start, end) tuples for each gene
+        cadd_path: path to CADD file (bgzip compressed and tabix-indexed)
+    
+    Returns:
+        dictionary of severity tables (as from get_cadd_severity), indexed by
+        symbol.
+    '''
+    with CaddReader(cadd_path) as reader:
+        genes = reader.extract(regions)
+    
+    return {symbol: severity_table(symbol, chrom, genes[symbol])
+        for symbol, chrom, _, _ in regions}
+
 def get_cadd_severity(symbol, chrom, start, end,
         cadd_path='/lustre/scratch113/projects/ddd/users/ps14/CADD/whole_genome_SNVs.tsv.gz'):
     ''' get per nucleotide mutation rates for all SNV alt alleles in a gene
@@ -21,26 +194,4 @@ def get_cadd_severity(symbol, chrom, start, end,
         a genome region.
     '''
     
-    tabix = pysam.TabixFile(cadd_path)
-    
-    prefixed = chrom.startswith('chr')
-    tabix_prefixed = tabix.contigs[0].startswith('chr')
-    if prefixed and not tabix_prefixed:
-        chrom = chrom[3:]
-    
-    def parse(line):
-        chrom, pos, ref, alt, raw, scaled = line.split('\t')
-        if prefixed:
-            chrom = f'chr{chrom}'
-        return {'chrom': chrom, 'pos': int(pos), 'ref': ref, 'alt': alt,
-            'raw': float(raw), 'score': float(scaled)}
-    
-    cadd = pandas.DataFrame([ parse(x) for x in tabix.fetch(chrom, start, end) ])
-    
-    cadd = cadd.sort_values(['chrom', 'pos', 'alt'])
-    cadd = cadd.reset_index(drop=True)
-    cadd['gene'] = symbol
-    cadd['chrom'] = cadd['chrom'].astype(str)
-    del cadd['raw']
-    
-    return cadd
+    return get_cadd_severities([(symbol, chrom, start, end)], cadd_path)[symbol]
@@ -0,0 +1,125 @@
+
+import json
+import os
+import socket
+import time
+from contextlib import contextmanager
+
+import pandas
+
+# profile for the gene currently being scored, or None when not profiling
+_ACTIVE = None
+
+class GeneProfile:
+    ''' wall times per stage, and event counts, for scoring one gene
+    
+    Args:
+        symbol: HGNC symbol for the gene
+    '''
+    __slots__ = ['symbol', 'times', 'counts']
+    
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.times = {}
+        self.counts = {}
+    
+    def add_time(self, name, seconds):
+        self.times[name] = self.times.get(name, 0.0) + seconds
+    
+    def add_count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+    
+    def to_dict(self):
+        ''' convert to a flat dictionary, for one row of the profile table
+        '''
+        record = {'symbol': self.symbol, 'host': socket.gethostname(),
+            'pid': os.getpid()}
+        record.update({f'time_{k}': v for k, v in self.times.items()})
+        record.update(self.counts)
+        return record
+
+@contextmanager
+def profile_gene(symbol):
+    ''' collect the stage times and counts recorded while scoring a gene
+    
+    Yields:
+        GeneProfile, which is filled in as the gene is scored
+    '''
+    global _ACTIVE
+    previous = _ACTIVE
+    _ACTIVE = GeneProfile(symbol)
+    start = time.perf_counter()
+    try:
+        yield _ACTIVE
+    finally:
+        _ACTIVE.add_time('total', time.perf_counter() - start)
+        _ACTIVE = previous
+
+@contextmanager
+def stage(name):
+    ''' time a stage of scoring the current gene. This does nothing unless a
+    gene is being profiled.
+    '''
+    profile = _ACTIVE
+    if profile is None:
+        yield
+        return
+    
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_time(name, time.perf_counter() - start)
+
+def count(name, n=1):
+    ''' count an event (e.g. a solver iteration) for the current gene. This
+    does nothing unless a gene is being profiled.
+    '''
+    if _ACTIVE is not None:
+        _ACTIVE.add_count(name, n)
+
+def profile_table(records):
+    ''' convert profile records to a table, with one row per gene
+    
+    Times are in seconds, in 'time_' columns. Stages and events which never
+    occurred for a gene are zero.
+    
+    Args:
+        records: list of dictionaries, as from GeneProfile.to_dict()
+    
+    Returns:
+        pandas DataFrame
+    '''
+    table = pandas.DataFrame(records)
+    fixed = [x for x in ['symbol', 'host', 'pid'] if x in table]
+    other = sorted(x for x in table.columns if x not in fixed)
+    table[other] = table[other].fillna(0)
+    return table[fixed + other]
+
+def write_profiles(records, path):
+    ''' write profile records to disk, as a JSON list, or as a tab-separated
+    table if the path ends in .tsv or .txt
+    '''
+    if path.endswith(('.tsv', '.txt')):
+        profile_table(records).to_csv(path, sep='\t', index=False)
+    else:
+        with open(path, 'w') as handle:
+            json.dump(records, handle, indent=1)
+
+def read_profiles(paths):
+    ''' combine profile files (e.g. from many cluster jobs) into one table
+    
+    Args:
+        paths: list of paths to profile files from write_profiles()
+    
+    Returns:
+        pandas DataFrame, as from profile_table()
+    '''
+    records = []
+    for path in paths:
+        if path.endswith(('.tsv', '.txt')):
+            records += pandas.read_table(path).to_dict('records')
+        else:
+            with open(path) as handle:
+                records += json.load(handle)
+    return profile_table(records)
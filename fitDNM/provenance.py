@@ -0,0 +1,100 @@
+
+import hashlib
+import json
+
+import pandas
+
+from fitDNM.site_store import SiteStore
+
+# number of hex digits kept from each hash
+HASH_LENGTH = 16
+
+def de_novo_keys(de_novos):
+    ''' get sorted chrom:pos:ref:alt keys for a table of de novos
+    
+    Args:
+        de_novos: table of de novos, or None
+    
+    Returns:
+        sorted list of strings, one per de novo
+    '''
+    if de_novos is None:
+        return []
+    keys = zip(de_novos['chrom'].astype(str), de_novos['pos'].astype(int),
+        de_novos['ref'], de_novos['alt'])
+    return sorted(f'{chrom}:{pos}:{ref}:{alt}' for chrom, pos, ref, alt in keys)
+
+def gene_provenance(de_novos, males, females, sites, options):
+    ''' hash everything that determines a gene's result
+    
+    A gene only needs scoring again if its de novos, the cohort size, its
+    sites, or the scoring options change, and these change the hash.
+    
+    Args:
+        de_novos: table of de novos in the gene
+        males: number of male probands
+        females: number of female probands
+        sites: hash of the gene's sites (see SiteStore.digest())
+        options: dictionary of the other options that change results, e.g.
+            solver method. Values must be JSON serialisable.
+    
+    Returns:
+        hex string
+    '''
+    inputs = {'de_novos': de_novo_keys(de_novos), 'males': int(males),
+        'females': int(females), 'sites': sites, 'options': options}
+    text = json.dumps(inputs, sort_keys=True)
+    return hashlib.sha1(text.encode('utf8')).hexdigest()[:HASH_LENGTH]
+
+def store_provenance(symbols, de_novos, males, females, store, options):
+    ''' hash the inputs for many genes, with their sites from a site store
+    
+    Args:
+        symbols: list of HGNC symbols
+        de_novos: dictionary of per gene tables of de novos
+        males: number of male probands
+        females: number of female probands
+        store: path to a SiteStore folder
+        options: dictionary of the other options that change results
+    
+    Returns:
+        dictionary of hashes, indexed by symbol. Genes missing from the store
+        hash without any sites, so they are always tried again.
+    '''
+    store = SiteStore(store)
+    provenance = {}
+    for symbol in symbols:
+        sites = store.digest(symbol) if symbol in store else None
+        provenance[symbol] = gene_provenance(de_novos.get(symbol), males,
+            females, sites, options)
+    return provenance
+
+def reuse_previous(previous, provenance):
+    ''' find the results from a previous run that are still current
+    
+    Args:
+        previous: previous output table, with symbol and provenance columns
+        provenance: dictionary of current hashes, indexed by symbol, for every
+            gene to report
+    
+    Returns:
+        tuple of (table of previous rows to keep, sorted list of symbols which
+        need scoring). Genes missing from the current hashes (e.g. they have
+        lost all their de novos) are dropped.
+    '''
+    if 'provenance' not in previous:
+        raise ValueError('previous results lack a provenance column')
+    
+    current = previous['symbol'].map(provenance)
+    kept = previous[(current == previous['provenance'])]
+    kept = kept.drop_duplicates('symbol').reset_index(drop=True)
+    
+    rescore = sorted(set(provenance) - set(kept['symbol']))
+    return kept, rescore
+
+def read_previous(path):
+    ''' load a previous output table, keeping the provenance hashes as text,
+    and reading floats back exactly as they were written
+    '''
+    return pandas.read_table(path, dtype={'symbol': str, 'provenance': str},
+        float_precision='round_trip')
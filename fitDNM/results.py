@@ -0,0 +1,131 @@
+
+import math
+import os
+import time
+
+import pandas
+
+class ResultWriter:
+    ''' write result rows to a tab-separated table as they are computed
+    
+    Each row is flushed once written, and the file is synced to disk every
+    few seconds, so a run that is killed keeps nearly all its finished rows.
+    With resume, rows already in the file are kept, and their keys (e.g. gene
+    symbols) are listed in done, so the run can skip them. A partly written
+    last line (from a run killed mid-write) is removed first. The keys of rows
+    written later are added to done too.
+    
+    An open stream (e.g. sys.stdout) can be given in place of a path. Rows are
+    still flushed as they are written, but the stream cannot be resumed or
+    synced, and is left open.
+    
+    Args:
+        path: path to the output table, or an open stream
+        columns: list of column names
+        resume: whether to append to an existing table, rather than replace it
+        key: column identifying each unit of work, for resuming
+        interval: seconds between syncs to disk
+        grouped: whether each key has several rows, written together (e.g. a
+            gene's rows for every cohort). A run killed partway through
+            writing them can leave only some, so on resume the rows of the
+            last key in the table are dropped too, and that key is redone.
+    '''
+    def __init__(self, path, columns, resume=False, key='symbol', interval=30,
+            grouped=False):
+        self.path = path
+        self.columns = list(columns)
+        self.key = key
+        self.interval = interval
+        self.done = set()
+        
+        self.stream = not isinstance(path, (str, os.PathLike))
+        if self.stream and resume:
+            raise ValueError('cannot resume writing to a stream')
+        
+        exists = False
+        if self.stream:
+            self.handle = path
+        else:
+            if resume and os.path.exists(path):
+                self._drop_unfinished(key if grouped else None)
+            exists = resume and os.path.exists(path) and os.path.getsize(path) > 0
+            if exists:
+                self.done = self._completed(key)
+            self.handle = open(path, 'a' if exists else 'w')
+        
+        if not exists:
+            self.handle.write('\t'.join(self.columns) + '\n')
+        self._sync()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+    
+    def _drop_unfinished(self, key=None):
+        ''' remove any partly written last line from the table, and with a
+        key, the other rows written with it
+        
+        Args:
+            key: if given, also remove every row sharing the last row's value
+                in this column
+        '''
+        with open(self.path, 'rb+') as handle:
+            data = handle.read()
+            end = data.rfind(b'\n') + 1
+            lines = data[:end].splitlines(keepends=True)
+            header = lines[0].decode('utf8').rstrip('\r\n').split('\t') if lines else []
+            if key in header and len(lines) > 1:
+                idx = header.index(key)
+                field = lambda line: line.rstrip(b'\r\n').split(b'\t')[idx]
+                last = field(lines[-1])
+                while len(lines) > 1 and field(lines[-1]) == last:
+                    end -= len(lines.pop())
+            handle.truncate(end)
+    
+    def _completed(self, key):
+        ''' get the keys of the rows already in the table
+        '''
+        existing = pandas.read_table(self.path, dtype=str, keep_default_na=False)
+        if list(existing.columns) != self.columns:
+            raise ValueError(f'cannot resume {self.path}, as its columns '
+                f'differ: {list(existing.columns)} vs {self.columns}')
+        return set(existing[key])
+    
+    def _sync(self):
+        self.handle.flush()
+        if not self.stream:
+            os.fsync(self.handle.fileno())
+        self.synced = time.monotonic()
+    
+    def write(self, rows):
+        ''' write result rows to the table
+        
+        Args:
+            rows: dictionary of values for a row, or a list of dictionaries
+                (e.g. all the rows for one gene, written together). Columns
+                missing from a row, or None or NaN values, are written as NA.
+        '''
+        if isinstance(rows, dict):
+            rows = [rows]
+        lines = ['\t'.join(format_value(row.get(x)) for x in self.columns)
+            for row in rows]
+        self.handle.write(''.join(x + '\n' for x in lines))
+        self.done.update(row[self.key] for row in rows)
+        self.handle.flush()
+        if time.monotonic() - self.synced >= self.interval:
+            self._sync()
+    
+    def close(self):
+        if not self.handle.closed:
+            self._sync()
+            if not self.stream:
+                self.handle.close()
+
+def format_value(value):
+    ''' format a value for the output table, with missing values as NA
+    '''
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return 'NA'
+    return str(value)
@@ -1,11 +1,17 @@
 
 from math import ceil
 
+from numpy import arange, asarray, exp, log, log1p, flatnonzero
 from scipy.stats import poisson
 
-from fitDNM.approximate import approximate
+from fitDNM.approximate import approximate_batch
+from fitDNM.cumulant_generating_functions import CGFKernel
 
-def saddlepoint(y, lambdas, weights):
+# log of the Poisson tail probability past the last x value summed, small
+# enough that the omitted terms cannot change a p-value held as a float
+LOG_MIN_TAIL = log(1e-300)
+
+def saddlepoint(y, lambdas, weights, block_size=8, method='newton'):
     ''' estimate gene-wise de novo enrichment by saddlepoint approximation
     
     Args:
@@ -13,14 +19,20 @@ def saddlepoint(y, lambdas, weights):
         lambdas: vector of per base and allele mutation rates within a gene
         weights: vector of per base and allele weights, indicating the likely
             severity of each change.
+        block_size: number of x values to evaluate together in each batched
+            pass of the conditional approximation.
+        method: solver method for mu and s, either 'newton' or 'legacy'.
     
     Returns:
         p-value for gene
     '''
     
+    lambdas = asarray(lambdas, dtype=float)
+    weights = asarray(weights, dtype=float)
+    kernel = CGFKernel(lambdas, weights)
+    
     current = 0
-    updated = 0
-    total_mu = sum(lambdas)
+    total_mu = kernel.total
     
     try:
         start = ceil(y / float(max(weights)))
@@ -31,14 +43,119 @@ def saddlepoint(y, lambdas, weights):
         return 1.0
     
     # increment the expected score until the delta to the previous iteration is
-    # less than one part in 10,000.
-    for i in range(int(start), 101):
-        updated = approximate(i, y, lambdas, weights) * poisson.pmf(i, total_mu)
-        
-        if updated is None:
-            return None
+    # less than one part in 100,000. The x values are evaluated in blocks, but
+    # the stopping rule is still applied one x value at a time. Highly mutable
+    # genes only reach their largest terms past x = 100, so the range runs on
+    # until the Poisson tail is negligible.
+    end = max(100, poisson_tail_end(int(start), total_mu, LOG_MIN_TAIL)[0])
+    for block_start in range(int(start), end + 1, block_size):
+        x = arange(block_start, min(block_start + block_size, end + 1))
+        terms = approximate_batch(x, y, lambdas, weights, method=method,
+            kernel=kernel) * poisson.pmf(x, total_mu)
         
-        if current != 0 and abs(updated / current) < 1e-5:
-            return current + updated
-        
-        current += updated
+        for updated in terms:
+            if current != 0 and abs(updated / current) < 1e-5:
+                return current + updated
+            
+            current += updated
+    
+    # the terms had not converged, but the omitted x values have a Poisson
+    # probability below 1e-300, so they cannot add to the p-value
+    return current
+
+def saddlepoint_with_bound(y, lambdas, weights, block_size=8, method='newton',
+        tail=1e-12):
+    ''' estimate gene-wise enrichment, with a bound on the truncation error
+    
+    Rather than stopping once terms are small relative to the running total,
+    this picks the range of x values up front, from the Poisson distribution
+    of the number of de novos. x values below ceil(y / max(weights)) cannot
+    reach the observed score, so the p-value is at most the Poisson tail from
+    there. The range ends where the remaining Poisson tail drops below the
+    tail argument times the Poisson probability of the first x value (see
+    poisson_tail_end()). Each omitted term is a
+    Poisson probability times a conditional p-value (at most 1), so the
+    omitted terms sum to at most the remaining Poisson tail. Genes with low
+    rates stop after a few x values, and highly mutable genes avoid
+    evaluating x values far into the tail.
+    
+    Args:
+        y: this is the summed score for the observed de novos
+        lambdas: vector of per base and allele mutation rates within a gene
+        weights: vector of per base and allele weights, indicating the likely
+            severity of each change.
+        block_size: number of x values to evaluate together in each batched
+            pass of the conditional approximation.
+        method: solver method for mu and s, either 'newton' or 'legacy'.
+        tail: largest Poisson probability of the omitted x values, relative
+            to the Poisson probability of the smallest x value that can reach y.
+    
+    Returns:
+        tuple of (p-value, bound), where the bound is the largest amount the
+        omitted x values could add to the p-value.
+    '''
+    lambdas = asarray(lambdas, dtype=float)
+    weights = asarray(weights, dtype=float)
+    kernel = CGFKernel(lambdas, weights)
+    total_mu = kernel.total
+    
+    if len(weights) == 0 or max(weights) <= 0:
+        return float('nan'), 0.0
+    
+    start = ceil(y / float(max(weights)))
+    if start <= 0:
+        return 1.0, 0.0
+    
+    end, bound = count_range(start, total_mu, tail)
+    
+    p_value = 0.0
+    for block_start in range(start, end + 1, block_size):
+        x = arange(block_start, min(block_start + block_size, end + 1))
+        p_value += (approximate_batch(x, y, lambdas, weights, method=method,
+            kernel=kernel) * poisson.pmf(x, total_mu)).sum()
+    
+    return p_value, bound
+
+def count_range(start, mu, tail=1e-12):
+    ''' find the last de novo count to sum the saddlepoint over
+    
+    Args:
+        start: smallest de novo count that can reach the observed score
+        mu: expected number of de novos
+        tail: largest Poisson probability of the omitted counts, relative to
+            the Poisson probability of the start
+    
+    Returns:
+        tuple of (last count, upper bound on the Poisson probability of the
+        counts above it)
+    '''
+    return poisson_tail_end(start, mu, log(tail) + poisson.logpmf(start, mu))
+
+def poisson_tail_end(start, mu, log_target, chunk=64):
+    ''' find where the upper tail of a Poisson distribution drops below a target
+    
+    Above the mean, each Poisson probability is at most mu / (k + 1) times the
+    one before, so the tail above x is bounded by a geometric series:
+    
+        P(X > x) <= P(X = x + 1) / (1 - mu / (x + 2))
+    
+    This works in logs, so it stays accurate for tails far below the smallest
+    probabilities that poisson.sf() and poisson.isf() resolve.
+    
+    Args:
+        start: smallest x value to end at
+        mu: Poisson mean
+        log_target: log of the largest tail probability allowed above the end
+        chunk: number of x values to check at once
+    
+    Returns:
+        tuple of (end, upper bound on the Poisson probability above end)
+    '''
+    first = max(start, int(ceil(mu)))
+    while True:
+        x = arange(first, first + chunk)
+        log_bound = poisson.logpmf(x + 1, mu) - log1p(-mu / (x + 2))
+        idx = flatnonzero(log_bound <= log_target)
+        if len(idx) > 0:
+            return int(x[idx[0]]), float(exp(log_bound[idx[0]]))
+        first += chunk
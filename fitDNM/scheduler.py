@@ -0,0 +1,552 @@
+
+import logging
+import time
+import traceback
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import pandas
+from denovonear.__main__ import load_gencode
+
+from fitDNM.cohorts import GeneStats
+from fitDNM.ensembl_genes import EnsemblGenes
+from fitDNM.gene_cache import GeneCache
+from fitDNM.gene_enrichment import enrichment, harmonise_data, get_expected_rates
+from fitDNM.load_de_novos import split_by_gene
+from fitDNM.mutation_rates import get_gene_rates
+from fitDNM.null_curves import null_curve, NullCurves, load_null_curves, RTOL
+from fitDNM.open_severity import get_cadd_severity, CaddReader
+from fitDNM.profiling import profile_gene, stage
+from fitDNM.site_store import SiteStore, load_site_store
+
+# inputs shared by every gene, set once per worker process
+_SHARED = {}
+
+# whether each worker profiles its genes, and stage times from setting up the
+# worker, which are added to the profile of the first gene it scores
+_PROFILE = {'enabled': False, 'setup': {}}
+
+def get_gene_sites(symbol, de_novos, severity_path, gencode=None,
+        rates_path=None):
+    ''' get the harmonised mutation rates and severity scores for a gene
+    
+    Args:
+        symbol: HGNC symbol for a gene
+        de_novos: table of de novos, used to pick transcripts. If None, this
+            uses the canonical transcript.
+        severity_path: path to tabix-indexed CADD file
+        gencode: Gencode object (or None, to load genes from Ensembl)
+        rates_path: path to table of sequence context based mutation rates
+    
+    Returns:
+        GeneSites of harmonised sites, or None if the gene lacks suitable
+        transcripts.
+    '''
+    mu_rate = get_rates_or_none(symbol, de_novos, gencode, rates_path)
+    if mu_rate is None:
+        return None
+    
+    with stage('tabix'):
+        severity = get_cadd_severity(*gene_region(symbol, mu_rate), severity_path)
+    with stage('harmonise'):
+        return harmonise_data(mu_rate, severity, symbol)
+
+def get_rates_or_none(symbol, de_novos, gencode=None, rates_path=None):
+    ''' get the mutation rates for a gene, or None if it lacks suitable transcripts
+    '''
+    try:
+        return get_gene_rates(symbol, de_novos, gencode, mut_path=rates_path)
+    except IndexError:
+        return None
+
+def gene_region(symbol, mu_rate):
+    ''' get the (symbol, chrom, start, end) region spanned by a gene's rates
+    '''
+    return symbol, str(mu_rate['chrom'][0]), min(mu_rate['pos']), max(mu_rate['pos'])
+
+def load_sites(symbol, de_novos, severity_path=None, gencode=None,
+        rates_path=None, store=None):
+    ''' get the harmonised sites for a gene, from a site store if given
+    
+    Args:
+        symbol: HGNC symbol for a gene
+        de_novos: table of de novos in the gene, used to pick transcripts
+        severity_path: path to tabix-indexed CADD file
+        gencode: Gencode object (or None, to load genes from Ensembl)
+        rates_path: path to table of sequence context based mutation rates
+        store: path to a SiteStore folder
+    
+    Returns:
+        GeneSites for the gene, or None if the gene is missing from the store,
+        or lacks suitable transcripts.
+    '''
+    if store is None:
+        return get_gene_sites(symbol, de_novos, severity_path, gencode, rates_path)
+    
+    store = load_site_store(store)
+    if symbol not in store:
+        logging.info(f'cannot find {symbol} in site store')
+        return None
+    with stage('store_read'):
+        return store[symbol]
+
+def score_gene(symbol, de_novos, males, females, severity_path=None,
+        gencode=None, rates_path=None, method='newton', store=None,
+        null_curves=False, binning=None, tail=None, screen=None):
+    ''' compute de novo enrichment for a single gene
+    
+    Args:
+        symbol: HGNC symbol for a gene
+        de_novos: table of de novos in the gene
+        males: number of male probands
+        females: number of female probands
+        severity_path: path to tabix-indexed CADD file
+        gencode: Gencode object (or None, to load genes from Ensembl)
+        rates_path: path to table of sequence context based mutation rates
+        method: solver method for the saddlepoint, 'newton' or 'legacy'
+        store: path to a SiteStore folder. If given, the gene's sites are read
+            from the store, rather than from the rates and severity data.
+        null_curves: whether to look up p-values from the store's null curves
+            for the cohort (see build_null_curves()), where they exist.
+        binning: how to collapse sites with equal or similar weights before
+            the saddlepoint (see enrichment()).
+        tail: relative Poisson tail of de novo counts to omit from the
+            saddlepoint, reporting a bound on the error (see enrichment()).
+        screen: p-value threshold, above which genes skip the saddlepoint
+            (see enrichment()).
+    
+    Returns:
+        dictionary of de novo enrichment results for the gene, or None if the
+        gene lacks suitable transcripts.
+    '''
+    null_curve = None
+    if store is not None and null_curves:
+        curves = load_null_curves(store, males, females, method)
+        if symbol in curves:
+            null_curve = partial(curves.p_value, symbol)
+    
+    sites = load_sites(symbol, de_novos, severity_path, gencode, rates_path,
+        store)
+    if sites is None:
+        return None
+    
+    return enrichment(de_novos, males, females, symbol, method=method,
+        sites=sites, null_curve=null_curve, binning=binning, tail=tail,
+        screen=screen)
+
+def gene_null_curve(symbol, store, males, females, method='newton',
+        rtol=1e-3, gencode=None):
+    ''' tabulate the null p-value curve for a gene in a site store
+    
+    Args:
+        symbol: HGNC symbol for a gene
+        store: path to a SiteStore folder
+        males: number of male probands
+        females: number of female probands
+        method: solver method for the saddlepoint, 'newton' or 'legacy'
+        rtol: relative error allowed when interpolating the curve
+        gencode: unused, as genes come from the store
+    
+    Returns:
+        curve for the gene (as from null_curve()), or None if the gene has no
+        curve.
+    '''
+    sites = load_site_store(store)[symbol]
+    probs = get_expected_rates(sites, males, females)
+    return null_curve(probs, sites.downweighted(), method, rtol=rtol)
+
+def score_gene_cohorts(symbol, de_novos, cohorts, severity_path=None,
+        gencode=None, rates_path=None, method='newton', store=None):
+    ''' compute de novo enrichment for a single gene, in many cohorts
+    
+    The gene's sites and weights are prepared once, then scaled to each
+    cohort's size (see GeneStats).
+    
+    Args:
+        symbol: HGNC symbol for a gene
+        de_novos: dictionary of tables of de novos in the gene, indexed by
+            cohort name
+        cohorts: list of cohorts (as from read_cohorts())
+        severity_path: path to tabix-indexed CADD file
+        gencode: Gencode object (or None, to load genes from Ensembl)
+        rates_path: path to table of sequence context based mutation rates
+        method: solver method for the saddlepoint, 'newton' or 'legacy'
+        store: path to a SiteStore folder, to read the gene's sites from
+    
+    Returns:
+        list of dictionaries of de novo enrichment results, one per cohort,
+        or None if the gene lacks suitable transcripts.
+    '''
+    # pick transcripts to cover the de novos from every cohort
+    tables = [x for x in de_novos.values() if x is not None]
+    pooled = pandas.concat(tables, ignore_index=True) if tables else None
+    
+    sites = load_sites(symbol, pooled, severity_path, gencode, rates_path, store)
+    if sites is None:
+        return None
+    
+    stats = GeneStats(sites)
+    results = []
+    for cohort in cohorts:
+        values = stats.enrichment(de_novos.get(cohort['name']),
+            cohort['males'], cohort['females'], method)
+        results.append({'cohort': cohort['name'], **values})
+    
+    return results
+
+def _init_worker(shared, gencode_path=None, fasta_path=None, genes=None,
+        profile=False):
+    ''' store the inputs shared by every gene, once per worker process
+    
+    Gencode objects cannot be pickled, so without a GeneCache each worker
+    loads its own copy from the annotation paths.
+    '''
+    _SHARED.clear()
+    _SHARED.update(shared)
+    _SHARED['gencode'] = genes
+    _PROFILE['enabled'] = profile
+    _PROFILE['setup'] = {}
+    if genes is None and gencode_path and fasta_path:
+        start = time.perf_counter()
+        _SHARED['gencode'] = load_gencode([], gencode_path, fasta_path)
+        _PROFILE['setup']['gencode_load'] = time.perf_counter() - start
+
+def _run_shared(task):
+    ''' run a function on a gene with the worker's shared inputs, capturing
+    any failure
+    
+    Args:
+        task: tuple of (function, symbol, dictionary of per gene inputs)
+    
+    Returns:
+        tuple of (symbol, result, error, profile), where error is None, or the
+        formatted traceback if the gene failed, and profile is None, or a
+        dictionary of stage times and counts if the worker profiles genes.
+    '''
+    func, symbol, inputs = task
+    if not _PROFILE['enabled']:
+        return (*_run_gene(func, symbol, inputs), None)
+    
+    with profile_gene(symbol) as profile:
+        for name, seconds in _PROFILE['setup'].items():
+            profile.add_time(name, seconds)
+        _PROFILE['setup'] = {}
+        result = _run_gene(func, symbol, inputs)
+    return (*result, profile.to_dict())
+
+def _run_gene(func, symbol, inputs):
+    ''' run a function on a gene, capturing any failure
+    '''
+    try:
+        return symbol, func(symbol, **_SHARED, **inputs), None
+    except Exception:
+        return symbol, None, traceback.format_exc()
+
+def open_genes(symbols, gencode_path=None, fasta_path=None, cache_dir=None,
+        build='grch37', offline=False, server=None):
+    ''' get the source of genes to share with every worker
+    
+    With gencode annotations and a cache folder, this builds the GeneCache (if
+    needed). Without gencode annotations, genes come from Ensembl, and the
+    Ensembl responses for every gene are fetched together into the cache
+    folder, so workers read them from disk. Both are done before any workers
+    start.
+    
+    Args:
+        symbols: list of HGNC symbols
+        gencode_path: path to gencode annotations file
+        fasta_path: path to genome fasta file
+        cache_dir: cache folder for genes
+        build: genome build of the genes
+        offline: whether to only use cached Ensembl responses
+        server: base URL of a stand-in for the Ensembl servers
+    
+    Returns:
+        GeneCache or EnsemblGenes object, or None if each worker should load
+        the gencode annotations in full.
+    '''
+    if gencode_path and fasta_path:
+        if cache_dir is None:
+            return None
+        return GeneCache(cache_dir, gencode_path, fasta_path, build)
+    
+    genes = EnsemblGenes(cache_dir, build, offline, server)
+    genes.prefetch(symbols)
+    return genes
+
+def run_genes(func, symbols, shared, jobs=1, genes=None, gencode_path=None,
+        fasta_path=None, per_gene=None, profiles=None):
+    ''' run a function on many genes, optionally in parallel
+    
+    Genes are independent, so with jobs > 1 they are spread over a pool of
+    worker processes. The shared inputs are sent to each worker once, rather
+    than with every gene. A gene which raises an error is logged and skipped,
+    rather than stopping the run. Workers are spawned rather than forked, as
+    forked workers inherit the parent's asyncio and sqlite state, which can
+    deadlock Ensembl requests.
+    
+    Args:
+        func: function to run for each gene. This takes the gene symbol, plus
+            the shared inputs (and gencode) as keyword arguments.
+        symbols: list of HGNC symbols
+        shared: dictionary of keyword arguments shared by every gene
+        jobs: number of worker processes
+        genes: source of genes shared by every worker (see open_genes())
+        gencode_path: path to gencode annotations file, for workers to load
+            in full if genes is None
+        fasta_path: path to genome fasta file
+        per_gene: dictionary of keyword arguments for each gene, indexed by
+            symbol. These are only sent to the worker scoring that gene.
+        profiles: list to append a profile of stage times and counts to for
+            each gene (see fitDNM.profiling), or None to skip profiling.
+    
+    Yields:
+        tuples of (symbol, result), in sorted symbol order, for each gene that
+        gave a result.
+    '''
+    if per_gene is None:
+        per_gene = {}
+    profile = profiles is not None
+    tasks = [(func, x, per_gene.get(x, {})) for x in sorted(symbols)]
+    if jobs > 1:
+        executor = ProcessPoolExecutor(max_workers=jobs,
+            mp_context=get_context('spawn'), initializer=_init_worker,
+            initargs=(shared, gencode_path, fasta_path, genes, profile))
+        with executor:
+            results = executor.map(_run_shared, tasks)
+            yield from _drop_failures(_keep_profiles(results, profiles))
+    else:
+        _init_worker(shared, gencode_path, fasta_path, genes, profile)
+        results = map(_run_shared, tasks)
+        yield from _drop_failures(_keep_profiles(results, profiles))
+
+def score_genes(symbols, de_novos, males, females, severity_path,
+        gencode_path=None, fasta_path=None, rates_path=None, method='newton',
+        jobs=1, store=None, cache_dir=None, build='grch37', offline=False,
+        server=None, null_curves=False, binning=None, tail=None, screen=None,
+        profiles=None):
+    ''' compute de novo enrichment for many genes, optionally in parallel
+    
+    See run_genes() for how genes are run in parallel.
+    
+    Args:
+        symbols: list of HGNC symbols
+        de_novos: dictionary of per gene tables of de novos (as from
+            group_de_novos), or a table of de novos for all genes
+        males: number of male probands
+        females: number of female probands
+        severity_path: path to tabix-indexed CADD file
+        gencode_path: path to gencode annotations file
+        fasta_path: path to genome fasta file
+        rates_path: path to table of sequence context based mutation rates
+        method: solver method for the saddlepoint, 'newton' or 'legacy'
+        jobs: number of worker processes
+        store: path to a SiteStore folder, to read each gene's sites from
+        cache_dir: cache folder for genes
+        build: genome build of the genes
+        offline: whether to only use cached Ensembl responses
+        server: base URL of a stand-in for the Ensembl servers
+        null_curves: whether to look up p-values from the store's null curves
+        binning: how to collapse sites before the saddlepoint (see enrichment())
+        tail: relative Poisson tail of de novo counts to omit (see enrichment())
+        screen: p-value threshold, above which genes skip the saddlepoint
+        profiles: list to append per gene profiles to (see run_genes())
+    
+    Yields:
+        tuples of (symbol, result), in sorted symbol order, for each gene that
+        could be scored.
+    '''
+    if isinstance(de_novos, pandas.DataFrame):
+        de_novos = split_by_gene(de_novos)
+    per_gene = {x: {'de_novos': de_novos.get(x)} for x in symbols}
+    
+    shared = {'males': males, 'females': females,
+        'severity_path': severity_path, 'rates_path': rates_path,
+        'method': method, 'store': store, 'null_curves': null_curves,
+        'binning': binning, 'tail': tail, 'screen': screen}
+    
+    # genes from the site store need no gene annotations
+    genes = None
+    if store is None:
+        genes = open_genes(symbols, gencode_path, fasta_path, cache_dir, build,
+            offline, server)
+    else:
+        gencode_path, fasta_path = None, None
+    
+    yield from run_genes(score_gene, symbols, shared, jobs, genes,
+        gencode_path, fasta_path, per_gene, profiles)
+
+def score_cohorts(symbols, cohorts, de_novos, severity_path,
+        gencode_path=None, fasta_path=None, rates_path=None, method='newton',
+        jobs=1, store=None, cache_dir=None, build='grch37', offline=False,
+        server=None, profiles=None):
+    ''' compute de novo enrichment for many genes, in many cohorts
+    
+    Each gene is loaded and prepared once, for all the cohorts. See
+    score_genes() for the other arguments.
+    
+    Args:
+        symbols: list of HGNC symbols
+        cohorts: list of cohorts (as from read_cohorts())
+        de_novos: dictionary of per gene tables of de novos for each cohort,
+            indexed by cohort name.
+    
+    Yields:
+        tuples of (symbol, list of results for each cohort), in sorted symbol
+        order, for each gene that could be scored.
+    '''
+    per_gene = {x: {'de_novos': {name: genes.get(x)
+        for name, genes in de_novos.items()}} for x in symbols}
+    
+    shared = {'cohorts': cohorts, 'severity_path': severity_path,
+        'rates_path': rates_path, 'method': method, 'store': store}
+    
+    genes = None
+    if store is None:
+        genes = open_genes(symbols, gencode_path, fasta_path, cache_dir, build,
+            offline, server)
+    else:
+        gencode_path, fasta_path = None, None
+    
+    yield from run_genes(score_gene_cohorts, symbols, shared, jobs, genes,
+        gencode_path, fasta_path, per_gene, profiles)
+
+def build_sites(symbols, store, severity_path, de_novos=None, gencode_path=None,
+        fasta_path=None, rates_path=None, jobs=1, batch_size=1000,
+        cache_dir=None, build='grch37', offline=False, server=None):
+    ''' write harmonised sites for many genes into a SiteStore
+    
+    Mutation rates are found in parallel, while CADD scores are read in
+    batches of genes from a single CaddReader, so the CADD file is read in
+    order, rather than seeked separately for every gene.
+    
+    Args:
+        symbols: list of HGNC symbols
+        store: path to the SiteStore folder
+        severity_path: path to tabix-indexed CADD file
+        de_novos: dictionary of per gene tables of de novos (or a table for
+            all genes), used to pick transcripts. If None, each gene uses its
+            canonical transcript.
+        gencode_path: path to gencode annotations file
+        fasta_path: path to genome fasta file
+        rates_path: path to table of sequence context based mutation rates
+        jobs: number of worker processes
+        batch_size: number of genes to read CADD scores for at once
+        cache_dir: cache folder for genes
+        build: genome build of the genes
+        offline: whether to only use cached Ensembl responses
+        server: base URL of a stand-in for the Ensembl servers
+    
+    Returns:
+        SiteStore with the genes added
+    '''
+    if isinstance(de_novos, pandas.DataFrame):
+        de_novos = split_by_gene(de_novos)
+    per_gene = {x: {'de_novos': None if de_novos is None else de_novos.get(x)}
+        for x in symbols}
+    
+    shared = {'rates_path': rates_path}
+    
+    genes = open_genes(symbols, gencode_path, fasta_path, cache_dir, build,
+        offline, server)
+    
+    store = SiteStore(store, create=True)
+    with CaddReader(severity_path) as reader:
+        batch = {}
+        for symbol, mu_rate in run_genes(get_rates_or_none, symbols, shared,
+                jobs, genes, gencode_path, fasta_path, per_gene):
+            batch[symbol] = mu_rate
+            if len(batch) >= batch_size:
+                _store_batch(store, reader, batch)
+                batch = {}
+        _store_batch(store, reader, batch)
+    store.write_index()
+    
+    return store
+
+def build_null_curves(store, males, females, method='newton', jobs=1,
+        symbols=None, rtol=RTOL):
+    ''' precompute null p-value curves for genes in a site store, for a cohort
+    
+    Args:
+        store: path to a SiteStore folder
+        males: number of male probands
+        females: number of female probands
+        method: solver method for the saddlepoint, 'newton' or 'legacy'
+        jobs: number of worker processes
+        symbols: list of HGNC symbols, or None for every gene in the store
+        rtol: relative error allowed when interpolating the curves. Scores in
+            intervals that miss this use the saddlepoint, and genes where every
+            interval misses are left out.
+    
+    Returns:
+        NullCurves with the genes added
+    '''
+    if symbols is None:
+        symbols = list(SiteStore(store))
+    
+    shared = {'store': store, 'males': males, 'females': females,
+        'method': method, 'rtol': rtol}
+    
+    curves = NullCurves(store, males, females, method, rtol)
+    for symbol, curve in run_genes(gene_null_curve, symbols, shared, jobs):
+        if curve is None:
+            logging.info(f'cannot tabulate null curve for {symbol}')
+            continue
+        failed = (curve[2] > rtol).mean()
+        if failed == 1:
+            # genes without a curve fall back to the saddlepoint when scoring
+            logging.info(f'leaving out {symbol} null curve, as its relative '
+                f'error is {curve[2].min():.2g} or more')
+            continue
+        if failed > 0:
+            logging.info(f'{symbol} null curve misses the tolerance in '
+                f'{failed:.1%} of intervals, which use the saddlepoint')
+        curves.add(symbol, curve)
+    curves.write()
+    
+    return curves
+
+def _store_batch(store, reader, batch):
+    ''' add CADD scores for a batch of genes, and write their sites to a store
+    
+    Args:
+        store: SiteStore to add genes to
+        reader: CaddReader for the CADD file
+        batch: dictionary of mutation rate tables, indexed by symbol
+    '''
+    regions = [gene_region(symbol, mu_rate) for symbol, mu_rate in batch.items()]
+    cadd = reader.extract(regions)
+    for symbol, _, _, _ in regions:
+        try:
+            sites = harmonise_data(batch[symbol], cadd[symbol], symbol)
+        except ValueError as error:
+            logging.error(f'failed to store {symbol}: {error}')
+            continue
+        logging.info(f'storing sites for {symbol}')
+        store.add(symbol, sites)
+
+def _keep_profiles(results, profiles):
+    ''' move gene profiles out of the worker results, into a list
+    
+    Args:
+        results: iterable of (symbol, result, error, profile) tuples
+        profiles: list to append profiles to, or None
+    
+    Yields:
+        tuples of (symbol, result, error)
+    '''
+    for symbol, values, error, profile in results:
+        if profile is not None and profiles is not None:
+            profiles.append(profile)
+        yield symbol, values, error
+
+def _drop_failures(results):
+    ''' log failed or unscorable genes, and pass on the others
+    '''
+    for symbol, values, error in results:
+        if error is not None:
+            logging.error(f'failed to score {symbol}:\n{error}')
+        elif values is not None:
+            yield symbol, values
@@ -0,0 +1,45 @@
+
+from numpy import asarray, argsort, cumsum, searchsorted, arange, exp, concatenate
+from scipy.stats import poisson
+
+def lower_bound_p(y, lambdas, weights, max_count=100):
+    ''' get a lower bound on the p-value of an observed score, at little cost
+    
+    The p-value is P(Y >= y), where Y sums the weights of Poisson counts of
+    de novos at every site. Any k de novos at sites with weights of at least
+    y / k reach y, provided no de novo falls on a site with a negative weight.
+    The counts at separate sites are independent, so for every k:
+    
+        P(Y >= y) >= P(N_k >= k) P(N_neg = 0)
+    
+    where N_k counts de novos at sites with weights >= y / k, and N_neg counts
+    those at sites with negative weights. This takes the largest bound over k.
+    With the low rates of most genes, one de novo at a site scoring above y
+    makes up most of the p-value, so the bound is close to the p-value.
+    
+    Args:
+        y: observed summed score
+        lambdas: vector of per base and allele mutation rates
+        weights: vector of per base and allele weights
+        max_count: largest number of de novos k to check
+    
+    Returns:
+        lower bound on the p-value
+    '''
+    lambdas = asarray(lambdas, dtype=float)
+    weights = asarray(weights, dtype=float)
+    
+    # chance of no de novos at sites which would lower the score
+    negative = exp(-lambdas[weights < 0].sum())
+    if y <= 0:
+        return float(negative)
+    
+    # summed rates of the sites at or above each weight, from the highest
+    order = argsort(-weights, kind='stable')
+    ranked = -weights[order]
+    summed = concatenate([[0], cumsum(lambdas[order])])
+    
+    counts = arange(1, max_count + 1)
+    rates = summed[searchsorted(ranked, -y / counts, side='right')]
+    
+    return float(poisson.sf(counts - 1, rates).max() * negative)
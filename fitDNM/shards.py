@@ -0,0 +1,181 @@
+
+import hashlib
+import heapq
+import json
+import logging
+import os
+
+import pandas
+
+from fitDNM.site_store import SiteStore
+
+# suffix for the file written beside each finished shard's output
+MANIFEST_SUFFIX = '.shard.json'
+
+def coding_sites(gene):
+    ''' count the possible coding sites in a gene, from its coding length
+    
+    Each coding base has three possible alternate alleles. This uses the
+    canonical transcript, or the longest transcript if there is none.
+    
+    Args:
+        gene: Gene (or CachedGene) object
+    
+    Returns:
+        number of sites
+    '''
+    try:
+        transcripts = [gene.canonical]
+    except ValueError:
+        transcripts = gene.transcripts
+    
+    length = max([sum(x['end'] - x['start'] + 1 for x in tx.cds)
+        for tx in transcripts] + [0])
+    return 3 * length
+
+def gene_weights(symbols, store=None, genes=None):
+    ''' get the work expected for each gene, to balance genes over shards
+    
+    Scoring time grows with the number of sites in a gene, so genes are
+    weighted by their site count from a site store if given, otherwise by
+    their coding length in the gene annotations. Genes in neither weigh 1.
+    
+    Args:
+        symbols: list of HGNC symbols
+        store: path to a SiteStore folder
+        genes: GeneCache (or dictionary of genes), used without a store
+    
+    Returns:
+        dictionary of weights, indexed by symbol
+    '''
+    if store is not None:
+        index = SiteStore(store).index
+        sites = {x: index[x]['sites'] for x in symbols if x in index}
+    elif genes is not None:
+        sites = {x: coding_sites(genes[x]) for x in symbols if x in genes}
+    else:
+        logging.info('no site store or gene annotations, so shards are '
+            'balanced by gene count')
+        sites = {}
+    
+    return {x: max(int(sites.get(x, 1)), 1) for x in symbols}
+
+def assign_shards(weights, count):
+    ''' split genes into shards with similar total weights
+    
+    This uses longest processing time first: the heaviest remaining gene goes
+    to the lightest shard. Ties are broken by symbol and shard number, so
+    every job running with the same genes gets the same shards.
+    
+    Args:
+        weights: dictionary of weights, indexed by symbol
+        count: number of shards
+    
+    Returns:
+        list of sorted symbol lists, one per shard
+    '''
+    shards = [[] for _ in range(count)]
+    loads = [(0, i) for i in range(count)]
+    for symbol in sorted(weights, key=lambda x: (-weights[x], x)):
+        load, i = heapq.heappop(loads)
+        shards[i].append(symbol)
+        heapq.heappush(loads, (load + weights[symbol], i))
+    
+    return [sorted(x) for x in shards]
+
+def partition_key(symbols):
+    ''' hash the full gene list that was split, so shards from runs with
+    different genes are not merged together
+    '''
+    text = '\n'.join(sorted(symbols))
+    return hashlib.sha1(text.encode('utf8')).hexdigest()[:16]
+
+def write_manifest(output, shard, count, symbols, assigned, scored):
+    ''' record which genes a finished shard was given, and which it scored
+    
+    Args:
+        output: path to the shard's output table. The manifest is written
+            beside this.
+        shard: shard number, from 1
+        count: number of shards
+        symbols: every gene split over the shards
+        assigned: genes given to this shard
+        scored: genes with rows in the shard's output
+    '''
+    manifest = {'shard': shard, 'shards': count, 'total': len(symbols),
+        'partition': partition_key(symbols), 'assigned': sorted(assigned),
+        'scored': sorted(scored)}
+    with open(output + MANIFEST_SUFFIX, 'w') as handle:
+        json.dump(manifest, handle, indent=1)
+
+def _read_shard(path):
+    ''' load a shard's output table (as text, so values are written back
+    unchanged) and its manifest
+    '''
+    manifest_path = path + MANIFEST_SUFFIX
+    if not os.path.exists(manifest_path):
+        raise ValueError(f'no shard manifest for {path}, so the shard may '
+            'not have finished')
+    with open(manifest_path) as handle:
+        manifest = json.load(handle)
+    
+    table = pandas.read_table(path, dtype=str, keep_default_na=False)
+    return table, manifest
+
+def merge_shards(paths, output):
+    ''' concatenate the outputs from every shard of a run, checking that no
+    gene is missing or duplicated
+    
+    Args:
+        paths: list of paths to shard output tables, each with its manifest
+        output: path to write the merged table to
+    
+    Returns:
+        merged table
+    '''
+    tables, manifests = zip(*[_read_shard(x) for x in paths])
+    
+    first = manifests[0]
+    for path, manifest in zip(paths, manifests):
+        if (manifest['shards'], manifest['partition']) != (first['shards'], first['partition']):
+            raise ValueError(f'{path} is from a different split of genes '
+                f'than {paths[0]}')
+    
+    numbers = sorted(x['shard'] for x in manifests)
+    if numbers != list(range(1, first['shards'] + 1)):
+        missing = sorted(set(range(1, first['shards'] + 1)) - set(numbers))
+        repeated = sorted({x for x in numbers if numbers.count(x) > 1})
+        raise ValueError(f'shards missing: {missing}, shards repeated: {repeated}')
+    
+    columns = list(tables[0].columns)
+    for path, table, manifest in zip(paths, tables, manifests):
+        if list(table.columns) != columns:
+            raise ValueError(f'{path} has different columns to {paths[0]}')
+        symbols = set(table['symbol'])
+        if symbols != set(manifest['scored']):
+            raise ValueError(f'{path} does not match its manifest, missing: '
+                f'{sorted(set(manifest["scored"]) - symbols)}, extra: '
+                f'{sorted(symbols - set(manifest["scored"]))}')
+        if not symbols <= set(manifest['assigned']):
+            raise ValueError(f'{path} has genes from other shards: '
+                f'{sorted(symbols - set(manifest["assigned"]))}')
+    
+    assigned = [x for manifest in manifests for x in manifest['assigned']]
+    if len(set(assigned)) != len(assigned) or len(assigned) != first['total']:
+        raise ValueError('shards do not cover every gene exactly once')
+    
+    # cohort runs have a row per gene and cohort
+    keys = [x for x in ['cohort', 'symbol'] if x in columns]
+    merged = pandas.concat(tables, ignore_index=True)
+    duplicated = merged[merged.duplicated(keys, keep=False)]
+    if len(duplicated) > 0:
+        raise ValueError(f'genes duplicated: {sorted(set(duplicated["symbol"]))}')
+    
+    unscored = sorted(set(assigned) - set(merged['symbol']))
+    if len(unscored) > 0:
+        logging.info(f'{len(unscored)} genes could not be scored: '
+            f'{", ".join(unscored)}')
+    
+    merged = merged.sort_values('symbol', kind='stable')
+    merged.to_csv(output, sep='\t', index=False)
+    return merged
@@ -0,0 +1,118 @@
+
+import hashlib
+import os
+from functools import lru_cache
+
+import numpy
+import pandas
+
+from fitDNM.gene_sites import GeneSites
+
+# columns kept for each harmonised site, with the dtypes used to store them
+COLUMNS = GeneSites.DTYPES
+
+INDEX_COLUMNS = ['gene', 'chrom', 'start', 'end', 'sites', 'path', 'digest']
+
+class SiteStore:
+    ''' folder of harmonised per-gene site tables, with a gene index
+    
+    Each gene's sites (position, ref, alt, mutation probability, severity
+    score and consequence) are stored as numpy arrays in a separate .npz file,
+    so genes can be loaded independently. The index (index.txt) lists every
+    gene with its chromosome, coordinates, site count, file and a hash of its
+    sites.
+    
+    None of this depends on the cohort, so the store can be built once, then
+    reused for many analyses.
+    
+    Args:
+        folder: path to folder for the store.
+        create: whether to start a new store if there is none in the folder
+            (creating the folder if needed), for adding genes to. Otherwise a
+            missing folder or index raises FileNotFoundError.
+    '''
+    def __init__(self, folder, create=False):
+        self.folder = folder
+        self.index_path = os.path.join(folder, 'index.txt')
+        self.index = {}
+        if os.path.exists(self.index_path):
+            index = pandas.read_table(self.index_path,
+                dtype={'chrom': str, 'digest': str})
+            self.index = {row['gene']: row for row in index.to_dict('records')}
+        elif create:
+            os.makedirs(folder, exist_ok=True)
+        else:
+            raise FileNotFoundError(f'no site store index at {self.index_path}, '
+                'build the store with "fitdnm build-sites"')
+    
+    def __contains__(self, symbol):
+        return symbol in self.index
+    
+    def __len__(self):
+        return len(self.index)
+    
+    def __iter__(self):
+        return iter(sorted(self.index))
+    
+    def __getitem__(self, symbol):
+        ''' load the harmonised sites for a gene
+        
+        Returns:
+            GeneSites, sorted by position and alt allele.
+        '''
+        if symbol not in self.index:
+            raise KeyError(f'{symbol} not in site store: {self.folder}')
+        
+        entry = self.index[symbol]
+        with numpy.load(os.path.join(self.folder, entry['path'])) as arrays:
+            arrays = {k: arrays[k] for k in COLUMNS}
+        
+        return GeneSites(symbol, entry['chrom'], **arrays)
+    
+    def digest(self, symbol):
+        ''' get the hash of the harmonised sites for a gene, to spot genes
+        whose sites changed when the store was rebuilt. The hash is made when
+        the gene is added, so this doesn't load the sites.
+        
+        Returns:
+            hex string
+        '''
+        return self.index[symbol]['digest']
+    
+    def add(self, symbol, data):
+        ''' write the harmonised sites for a gene into the store
+        
+        Args:
+            symbol: HGNC symbol for the gene
+            data: GeneSites for the gene, as from harmonise_data()
+        '''
+        path = symbol.replace(os.sep, '_') + '.npz'
+        arrays = {k: getattr(data, k).astype(v) for k, v in COLUMNS.items()}
+        numpy.savez_compressed(os.path.join(self.folder, path), **arrays)
+        
+        digest = hashlib.sha1(data.chrom.encode('utf8'))
+        for column in COLUMNS:
+            digest.update(arrays[column].tobytes())
+        
+        self.index[symbol] = {'gene': symbol, 'chrom': data.chrom,
+            'start': int(data.pos.min()), 'end': int(data.pos.max()),
+            'sites': len(data), 'path': path, 'digest': digest.hexdigest()}
+    
+    def write_index(self):
+        ''' write the gene index to disk, once all genes have been added
+        '''
+        index = pandas.DataFrame([self.index[x] for x in sorted(self.index)],
+            columns=INDEX_COLUMNS)
+        index.to_csv(self.index_path, sep='\t', index=False)
+
+def load_site_store(folder):
+    ''' open a site store once per process, as every gene scored from the
+    store would otherwise read the whole index again. The store is opened
+    again if its index has been rewritten since.
+    '''
+    stat = os.stat(os.path.join(folder, 'index.txt'))
+    return _open_site_store(folder, (stat.st_mtime_ns, stat.st_size))
+
+@lru_cache(maxsize=4)
+def _open_site_store(folder, version):
+    return SiteStore(folder)
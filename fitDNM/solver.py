@@ -1,44 +1,89 @@
 
 from __future__ import division
 
-from math import isnan, isinf
-from decimal import Decimal as dec
+from math import isnan
 
-from numpy import sign, exp, log
+from numpy import (sign, log, asarray, full, zeros, isnan as isnan_,
+    flatnonzero, where, maximum, minimum, abs as abs_, array, errstate)
 
-def cgf_ratio(lambdas, weights, mu):
-    ''' get CGF-like ratio
+from fitDNM.cumulant_generating_functions import CGFKernel
+from fitDNM.profiling import count
+
+# largest exponent that does not overflow a float64. The legacy stepping search
+# stops once weights * mu passes this, so the newton solver is bounded by it too.
+LOG_MAX = 709.78
+
+SOLVER_METHODS = ['newton', 'legacy']
+
+def newton_solver(ratio, kernel, start=0, tol=1e-10, max_iter=100):
+    ''' solve cgf_ratio(mu) == ratio by safeguarded newton iterations
     
-    This appears to be the ratio of the values from the first derivative of the
-    CGF, when s = 0 and mu is variable.
+    The CGF ratio increases monotonically with mu, so each root is bracketed
+    between the start point and the largest mu the legacy search could reach
+    before overflowing. Newton steps which leave the bracket, or which stall
+    on a flat slope, are replaced by bisection of the bracket. If there is no
+    root before the overflow bound, the bound is returned, as the legacy
+    search would also stop there.
     
     Args:
-        lambdas: vector of per base and allele mutation rates
-        weights: per base and allele weights, indicating the likely severity of
-            each change
-        mu: overall estimated mutation rate
+        ratio: vector of ratios of observed and estimated summed scores
+        kernel: CGFKernel for the gene
+        start: initial mu estimate
+        tol: convergence tolerance for the change in mu, relative to mu when
+            abs(mu) > 1
+        max_iter: maximum number of newton iterations
     
     Returns:
-        float value for
+        vector of mu estimates, matched to ratio
     '''
-    numerator = sum(lambdas * weights * exp(weights * mu))
-    denominator = sum(lambdas * exp(weights * mu))
+    ratio = asarray(ratio, dtype=float)
+    
+    bound = LOG_MAX / max(abs_(kernel.weights).max(), 1e-300)
+    lower = full(len(ratio), -bound)
+    upper = full(len(ratio), bound)
+    mu = full(len(ratio), float(start))
+    
+    # ratios beyond the ratio at the overflow bounds have no root
+    limits = kernel.tilted(array([-bound, bound]))['ratio']
+    mu[ratio <= limits[0]] = -bound
+    mu[ratio >= limits[1]] = bound
     
-    if numerator == 0:
-        return 0
+    active = (ratio > limits[0]) & (ratio < limits[1])
+    for _ in range(max_iter):
+        idx = flatnonzero(active)
+        if len(idx) == 0:
+            break
+        count('solver_iterations')
+        
+        moments = kernel.tilted(mu[idx])
+        value = moments['ratio'] - ratio[idx]
+        
+        # shrink the bracket around the root
+        upper[idx] = where(value > 0, minimum(upper[idx], mu[idx]), upper[idx])
+        lower[idx] = where(value < 0, maximum(lower[idx], mu[idx]), lower[idx])
+        
+        with errstate(divide='ignore', invalid='ignore'):
+            stepped = mu[idx] - value / moments['slope']
+        
+        outside = ~((stepped > lower[idx]) & (stepped < upper[idx]))
+        stepped = where(outside, (lower[idx] + upper[idx]) / 2, stepped)
+        
+        change = abs_(stepped - mu[idx])
+        mu[idx] = stepped
+        
+        converged = (value == 0) | (change <= tol * maximum(abs_(stepped), 1))
+        active[idx[converged]] = False
     
-    return numerator / denominator
+    return mu
 
-def solver(current, initial_sign, ratio, lambdas, weights, delta):
+def solver(current, initial_sign, ratio, kernel, delta):
     ''' solve for initial and updated
     
     Args:
         current: currently estimated mutation rate
         initial_sign: sign of initial estimate
         ratio: ratio of estimated and observed summed scores
-        lambdas: vector of per base and allele mutation rates
-        weights: per base and allele weights, indicating the likely severity of
-            each change
+        kernel: CGFKernel for the gene
         delta: amount to update by during iterations
     
     Returns:
@@ -46,8 +91,9 @@ def solver(current, initial_sign, ratio, lambdas, weights, delta):
     '''
     refine = False
     while True:
+        count('solver_iterations')
         updated = current + initial_sign * delta
-        value = ratio - cgf_ratio(lambdas, weights, updated)
+        value = ratio - kernel.ratio(updated)[0]
         
         if isnan(sign(value)):
             # TODO: check that this clause is correct. Perhaps it should check
@@ -61,7 +107,8 @@ def solver(current, initial_sign, ratio, lambdas, weights, delta):
     
     return {'current': current, 'updated': updated, 'refine': refine}
 
-def solve_s_u(x, y, lambdas, weights, delta=10, refine=5, start=0):
+def solve_s_u(x, y, lambdas, weights, delta=10, refine=5, start=0,
+        method='newton', tol=1e-10, kernel=None):
     ''' solve for S and mu
     
     Args:
@@ -70,30 +117,122 @@ def solve_s_u(x, y, lambdas, weights, delta=10, refine=5, start=0):
         lambdas: vector of per base and allele mutation rates
         weights: per base and allele weights, indicating the likely severity of
             each change
-        delta: amount to update by during iterations
-        refine: number of iteratative refinements to perform
+        delta: amount to update by during iterations (legacy method only)
+        refine: number of iteratative refinements to perform (legacy method only)
         start: initial mu estimate
+        method: 'newton' for the safeguarded newton solver, or 'legacy' for the
+            original fixed-step search.
+        tol: convergence tolerance for mu (newton method only)
+        kernel: CGFKernel for the gene, constructed from lambdas and weights
+            if not given
     
     Returns:
         dictionary with 'mu' and 's' entries
     '''
+    if method not in SOLVER_METHODS:
+        raise ValueError(f'unknown solver method: {method}')
+    
+    if kernel is None:
+        kernel = CGFKernel(lambdas, weights)
+    
+    if method == 'newton':
+        values = solve_s_u_batch([x], y, lambdas, weights, start=start,
+            method=method, tol=tol, kernel=kernel)
+        return {'s': values['s'][0], 'mu': values['mu'][0]}
+    
     # solve mu first
     ratio = y / x
-    initial_sign = sign(ratio - cgf_ratio(lambdas, weights, start))
+    initial_sign = sign(ratio - kernel.ratio(start)[0])
     
-    val = solver(start, initial_sign, ratio, lambdas, weights, delta)
+    # a ratio exactly at the start point needs no search, and would otherwise
+    # never change sign, so the search would not end
+    if initial_sign == 0:
+        val = {'current': start, 'updated': start, 'refine': False}
+    else:
+        val = solver(start, initial_sign, ratio, kernel, delta)
     
     if val['refine']:
         for i in range(refine):
             delta = delta / 10
-            val = solver(val['current'], initial_sign, ratio, lambdas, weights, delta)
+            val = solver(val['current'], initial_sign, ratio, kernel, delta)
     
     mu = (val['current'] + val['updated']) / 2
-    s = log(x) - log(sum(lambdas * exp(weights * mu)))
+    s = log(x) - kernel.tilted(mu)['log_total'][0]
+    
+    return {'s': s, 'mu': mu}
+
+def solve_s_u_batch(x, y, lambdas, weights, delta=10, refine=5, start=0,
+        method='newton', tol=1e-10, kernel=None):
+    ''' solve for S and mu for a vector of estimated summed scores at once
+    
+    The newton method solves every x value together, with one 2-D (x, site)
+    pass per iteration. The legacy method steps every x value in lockstep
+    with the same search as solver(), keeping a separate step size and
+    refinement stage for each x value. Either way, this gives the same
+    estimates as calling solve_s_u() for each x value in turn.
+    
+    Args:
+        x: vector of estimated summed scores
+        y: observed summed score
+        lambdas: vector of per base and allele mutation rates
+        weights: per base and allele weights, indicating the likely severity of
+            each change
+        delta: amount to update by during iterations (legacy method only)
+        refine: number of iteratative refinements to perform (legacy method only)
+        start: initial mu estimate
+        method: 'newton' for the safeguarded newton solver, or 'legacy' for the
+            original fixed-step search.
+        tol: convergence tolerance for mu (newton method only)
+        kernel: CGFKernel for the gene, constructed from lambdas and weights
+            if not given
+    
+    Returns:
+        dictionary with 'mu' and 's' entries, each a vector matched to x
+    '''
+    if method not in SOLVER_METHODS:
+        raise ValueError(f'unknown solver method: {method}')
+    
+    if kernel is None:
+        kernel = CGFKernel(lambdas, weights)
+    
+    x = asarray(x, dtype=float)
+    
+    ratio = y / x
+    if method == 'newton':
+        mu = newton_solver(ratio, kernel, start=start, tol=tol)
+        s = log(x) - kernel.tilted(mu)['log_total']
+        return {'s': s, 'mu': mu}
+    
+    initial_sign = sign(ratio - kernel.ratio(start)[0])
+    
+    current = full(len(x), start, dtype=float)
+    updated = current.copy()
+    deltas = full(len(x), delta, dtype=float)
+    stage = zeros(len(x), dtype=int)
+    
+    # x values with the ratio exactly at the start point need no search
+    active = initial_sign != 0
+    
+    while active.any():
+        count('solver_iterations')
+        idx = flatnonzero(active)
+        stepped = current[idx] + initial_sign[idx] * deltas[idx]
+        signs = sign(ratio[idx] - kernel.ratio(stepped))
+        
+        failed = isnan_(signs)
+        stop = failed | (signs != initial_sign[idx])
+        current[idx[~stop]] = stepped[~stop]
+        
+        # a stopped search either finishes, or starts the next refinement
+        # from the last position before the sign change, with a finer step
+        ended = idx[stop]
+        updated[ended] = stepped[stop]
+        finished = (stage[ended] >= refine) | ((stage[ended] == 0) & failed[stop])
+        stage[ended] += 1
+        deltas[ended] /= 10
+        active[ended[finished]] = False
     
-    if isinf(s):
-        mu = dec(mu)
-        total = sum(( dec(a) * (dec(b) * mu).exp() for a, b in zip(lambdas, weights) ))
-        s, mu = log(x) - float(total.ln()), float(mu)
+    mu = (current + updated) / 2
+    s = log(x) - kernel.tilted(mu)['log_total']
     
     return {'s': s, 'mu': mu}
@@ -0,0 +1,117 @@
+
+from math import ceil
+
+import numpy
+
+from fitDNM.saddlepoint import count_range
+
+def collapse_weights(weights, probs):
+    ''' sum the mutation probabilities of sites sharing the same weight
+    
+    The cumulant generating function only depends on the total rate at each
+    distinct weight, so sites with equal weights can be merged.
+    
+    Args:
+        weights: array of per site weights
+        probs: array of per site mutation probabilities
+    
+    Returns:
+        tuple of (sorted array of unique weights, array of summed
+        probabilities for each weight)
+    '''
+    weights, groups = numpy.unique(weights, return_inverse=True)
+    return weights, numpy.bincount(groups, weights=probs, minlength=len(weights))
+
+def bin_weights(weights, probs, resolution):
+    ''' merge sites with similar weights into bins of a fixed width
+    
+    Weights are grouped by rounding to the nearest multiple of the resolution.
+    Each bin gets the summed probability of its sites, at the
+    probability-weighted mean of their weights, so the expected score is
+    unchanged.
+    
+    No weight moves by more than the returned shift (at most the resolution,
+    as each bin spans one resolution). So every term of the CGF sums,
+    lambda * e^{c t + s}, changes by a factor within e^{+/- |t| shift}, which
+    bounds the relative error of the CGF sums at each t. The score of x de
+    novos moves by at most x * shift (see score_shift()).
+    
+    Args:
+        weights: array of per site weights
+        probs: array of per site mutation probabilities
+        resolution: width of the weight bins
+    
+    Returns:
+        tuple of (sorted array of binned weights, array of summed
+        probabilities for each bin, largest shift of any site's weight)
+    '''
+    weights = numpy.asarray(weights, dtype=float)
+    probs = numpy.asarray(probs, dtype=float)
+    if len(weights) == 0:
+        return weights, probs, 0.0
+    
+    keys, groups = numpy.unique(numpy.round(weights / resolution), return_inverse=True)
+    summed = numpy.bincount(groups, weights=probs, minlength=len(keys))
+    weighted = numpy.bincount(groups, weights=probs * weights, minlength=len(keys))
+    
+    # bins without any rate get the plain mean of their weights
+    counts = numpy.bincount(groups, minlength=len(keys))
+    plain = numpy.bincount(groups, weights=weights, minlength=len(keys)) / counts
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        binned = numpy.where(summed > 0, weighted / summed, plain)
+    
+    shift = float(abs(weights - binned[groups]).max())
+    return binned, summed, shift
+
+def score_shift(y, lambdas, weights, shift, tail=1e-12):
+    ''' bound how far binning moves the score of the de novo counts summed
+    
+    Binning moves any score from x de novos by at most x * shift, so over the
+    counts summed by the saddlepoint, up to x_max (the last count, as picked
+    by saddlepoint_with_bound()), scores move by at most x_max * shift. The
+    p-value from the unbinned sites then lies between the binned p-values at
+    y + x_max * shift and y - x_max * shift, give or take the Poisson chance
+    of more than x_max de novos (at most tail times the chance of the fewest
+    de novos that can reach y).
+    
+    Args:
+        y: observed score
+        lambdas: binned mutation rates
+        weights: binned weights
+        shift: largest shift of any site's weight (see bin_weights())
+        tail: largest Poisson probability of the omitted counts, relative to
+            the Poisson probability of the smallest count that can reach y.
+    
+    Returns:
+        largest shift in the score of any de novo count summed
+    '''
+    if shift == 0 or len(weights) == 0 or max(weights) <= 0:
+        return 0.0
+    
+    start = ceil(y / float(max(weights)))
+    if start <= 0:
+        return 0.0
+    
+    end, _ = count_range(start, float(numpy.sum(lambdas)), tail)
+    return end * shift
+
+def compress_sites(probs, weights, binning=None):
+    ''' collapse the per site rates and weights before the saddlepoint
+    
+    Args:
+        probs: array of per site mutation rates
+        weights: array of per site weights
+        binning: None to leave the sites as they are, 'exact' to merge sites
+            with identical weights, or a bin width (see bin_weights()).
+    
+    Returns:
+        tuple of (rates, weights, largest shift of any site's weight)
+    '''
+    if binning is None:
+        return probs, weights, 0.0
+    if binning == 'exact':
+        weights, probs = collapse_weights(weights, probs)
+        return probs, weights, 0.0
+    
+    weights, probs, shift = bin_weights(weights, probs, float(binning))
+    return probs, weights, shift
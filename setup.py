@@ -29,7 +29,7 @@ setup(
     description = ("Enrichment of de novo mutations within genes."),
     license = "MIT",
     packages=["fitDNM"],
-    install_requires=['pandas >= 0.15.0',
+    install_requires=['pandas >= 0.25.0',
                       'scipy >= 0.15.0',
                       'numpy >= 1.9.0',
                       'denovonear >= 0.9.9',
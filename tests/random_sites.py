@@ -0,0 +1,48 @@
+
+import pandas
+from numpy.random import uniform, normal, choice
+
+from fitDNM.gene_enrichment import harmonise_data
+
+def random_tables(symbol, length, chrom='1', missense=False):
+    ''' define random severity and rates tables for a gene
+    
+    Every position has all four alt alleles, with random severity scores and
+    mutation rates. Draws from numpy's global random state, so seed it first.
+    
+    Args:
+        symbol: HGNC symbol for the gene
+        length: number of positions in the gene
+        chrom: chromosome for the gene
+        missense: whether every site is missense, rather than having random
+            consequences
+    
+    Returns:
+        tuple of (severity table, rates table)
+    '''
+    bases = ['A', 'C', 'G', 'T']
+    consequences = ['missense', 'nonsense', 'splice_lof', 'synonymous']
+    
+    pos = list(range(1, length + 1)) * 4
+    ref = [ choice(bases) for x in range(length) ] * 4
+    alts = [ y for x in bases for y in [x] * length ]
+    cq = 'missense'
+    if not missense:
+        cq = [ choice(consequences, p=(0.7, 0.05, 0.01, 0.24)) for x in range(length * 4) ]
+    
+    severity = pandas.DataFrame({'gene': symbol, 'chrom': chrom, 'pos': pos,
+        'ref': ref, 'alt': alts, 'score': uniform(low=0, high=30, size=length * 4)})
+    rates = pandas.DataFrame({'gene': symbol, 'chrom': chrom, 'pos': pos,
+        'ref': ref, 'alt': alts, 'consequence': cq,
+        'prob': 10**(normal(size=length * 4, loc=-8, scale=0.5))})
+    
+    return severity, rates
+
+def random_sites(symbol, length, chrom='1', missense=False):
+    ''' define random harmonised sites for a gene (see random_tables())
+    
+    Returns:
+        GeneSites for the gene
+    '''
+    severity, rates = random_tables(symbol, length, chrom, missense)
+    return harmonise_data(rates, severity, symbol)
@@ -2,11 +2,13 @@
 
 import unittest
 
-from math import isnan
+from math import isnan, log
 
 from numpy.random import beta, uniform, normal, seed
 
-from fitDNM.approximate import approximate
+from fitDNM.approximate import (approximate, approximate_batch,
+    avoid_zero_w_part, mean_limit_p)
+from fitDNM.cumulant_generating_functions import CGFKernel
 
 class TestConditionalApproximationPy(unittest.TestCase):
     ''' unit test the conditional approximation function
@@ -25,7 +27,10 @@ class TestConditionalApproximationPy(unittest.TestCase):
         y = 1
         lambdas = normal(loc=1e-4, scale=1e-5, size=1000)
         weights = beta(a=0.5, b=0.5, size=1000)
-        self.assertEqual(approximate(x, y, lambdas, weights), 0.011558509232964621)
+        self.assertAlmostEqual(approximate(x, y, lambdas, weights, method='legacy'),
+            0.011558509232964621, delta=1e-11)
+        self.assertAlmostEqual(approximate(x, y, lambdas, weights),
+            0.011514254640338867, delta=1e-11)
     
     def test_approximate_low_w_part(self):
         ''' check approximate for low w_part values
@@ -37,4 +42,68 @@ class TestConditionalApproximationPy(unittest.TestCase):
         y = 1
         lambdas = normal(loc=1e-4, scale=1e-5, size=1000)
         weights = uniform(size=1000)
-        self.assertAlmostEqual(approximate(x, y, lambdas, weights), 0.4979291242903694, places=10)
+        self.assertAlmostEqual(approximate(x, y, lambdas, weights, method='legacy'),
+            0.4979291242903694, places=9)
+        self.assertAlmostEqual(approximate(x, y, lambdas, weights),
+            0.5002924291871617, places=10)
+    
+    def test_mean_limit_p(self):
+        ''' check the analytic p-value near w = 0 matches stepping around it
+        '''
+        
+        seed(13)
+        
+        x = 2
+        lambdas = normal(loc=1e-4, scale=1e-5, size=1000)
+        weights = uniform(size=1000) ** 2
+        kernel = CGFKernel(lambdas, weights)
+        mean = x * (lambdas * weights).sum() / lambdas.sum()
+        
+        # the weights are skewed, so the limit is away from one half
+        p_value = mean_limit_p(x, mean, kernel)
+        self.assertLess(p_value, 0.48)
+        self.assertAlmostEqual(approximate(x, mean, lambdas, weights), p_value)
+        
+        # the legacy method averages p-values from steps of 0.01 either side,
+        # so only roughly matches
+        y = mean + 1e-3
+        self.assertAlmostEqual(approximate(x, y, lambdas, weights),
+            mean_limit_p(x, y, kernel))
+        self.assertAlmostEqual(approximate(x, y, lambdas, weights,
+            method='legacy'), mean_limit_p(x, y, kernel), delta=0.02)
+        
+        # equal weights give a fixed score
+        kernel = CGFKernel(lambdas, weights * 0 + 1)
+        self.assertEqual(mean_limit_p(x, 2, kernel), 1.0)
+        self.assertEqual(mean_limit_p(x, 2.5, kernel), 0.0)
+    
+    def test_avoid_zero_w_part_bounded(self):
+        ''' check the search away from w_part = 0 stops after max_iter steps
+        '''
+        
+        x = 2
+        lambdas = normal(loc=1e-4, scale=1e-5, size=1000)
+        weights = uniform(size=1000)
+        kernel = CGFKernel(lambdas, weights)
+        s0 = log(x / kernel.total)
+        mean = x * (lambdas * weights).sum() / lambdas.sum()
+        
+        self.assertIsNone(avoid_zero_w_part(x, mean, lambdas, weights, s0,
+            increment=1e-9, kernel=kernel, max_iter=3))
+        values = avoid_zero_w_part(x, mean, lambdas, weights, s0, kernel=kernel)
+        self.assertGreater(abs(values['w_part']), 1e-4)
+    
+    def test_approximate_batch(self):
+        ''' check approximate_batch matches approximate for each x value
+        '''
+        
+        y = 3
+        lambdas = normal(loc=1e-4, scale=1e-5, size=1000)
+        weights = beta(a=0.5, b=0.5, size=1000)
+        x = [3, 4, 5, 6, 7, 8]
+        
+        for method in ['legacy', 'newton']:
+            values = approximate_batch(x, y, lambdas, weights, method=method)
+            for i, x_val in enumerate(x):
+                self.assertAlmostEqual(values[i], approximate(x_val, y, lambdas,
+                    weights, method=method), delta=1e-10)
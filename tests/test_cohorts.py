@@ -0,0 +1,88 @@
+# unit testing for the fitDNM functions
+
+import os
+import unittest
+import tempfile
+import shutil
+
+from numpy.random import seed
+
+from fitDNM.cohorts import read_cohorts, GeneStats
+from fitDNM.gene_enrichment import enrichment
+from fitDNM.scheduler import score_cohorts
+from fitDNM.site_store import SiteStore
+from tests.random_sites import random_sites
+
+class TestCohortsPy(unittest.TestCase):
+    ''' check scoring genes in many cohorts
+    '''
+    
+    def setUp(self):
+        seed(1)
+        self.folder = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+    
+    def get_de_novos(self, sites, rows):
+        ''' make a table of de novos at some of a gene's sites
+        '''
+        frame = sites.to_frame().iloc[rows]
+        return frame[['gene', 'chrom', 'pos', 'ref', 'alt']].reset_index(drop=True)
+    
+    def test_read_cohorts(self):
+        ''' check loading the cohort table, with and without de novo paths
+        '''
+        path = os.path.join(self.folder, 'cohorts.tsv')
+        with open(path, 'w') as handle:
+            handle.write('name\tmales\tfemales\nA\t10\t20\nB\t5\t0\n')
+        self.assertEqual(read_cohorts(path), [
+            {'name': 'A', 'males': 10, 'females': 20, 'de_novos': None},
+            {'name': 'B', 'males': 5, 'females': 0, 'de_novos': None}])
+        
+        with open(path, 'w') as handle:
+            handle.write('name\tmales\tfemales\tde_novos\nA\t10\t20\ta.txt\nB\t5\t0\t\n')
+        self.assertEqual([x['de_novos'] for x in read_cohorts(path)], ['a.txt', None])
+    
+    def test_gene_stats(self):
+        ''' check scoring from collapsed terms matches scoring the sites
+        '''
+        for chrom in ['1', 'X']:
+            sites = random_sites('GENE1', 100, chrom)
+            # repeat the sites at some positions, so their weights are collapsed
+            sites.score[40:48] = sites.score[:8]
+            sites.prob[40:48] = sites.prob[:8]
+            de_novos = self.get_de_novos(sites, [16, 25])
+            stats = GeneStats(sites)
+            self.assertLess(len(stats.weights), len(sites))
+            
+            for males, females in [(100, 100), (1000, 50)]:
+                expected = enrichment(de_novos, males, females, 'GENE1', sites=sites)
+                result = stats.enrichment(de_novos, males, females)
+                for key in ['symbol', 'gene_scores', 'sites', 'de_novos', 'de_novos_score']:
+                    self.assertEqual(result[key], expected[key])
+                for key in ['p_value', 'p_unweighted']:
+                    self.assertAlmostEqual(result[key] / expected[key], 1, places=7)
+    
+    def test_score_cohorts(self):
+        ''' check scoring genes from a store in several cohorts
+        '''
+        store = SiteStore(self.folder, create=True)
+        sites = random_sites('GENE1', 100, '1')
+        store.add('GENE1', sites)
+        store.write_index()
+        
+        cohorts = [{'name': 'A', 'males': 100, 'females': 100, 'de_novos': None},
+            {'name': 'B', 'males': 50, 'females': 10, 'de_novos': None}]
+        de_novos = {'A': {'GENE1': self.get_de_novos(sites, [16, 25])},
+            'B': {'GENE1': self.get_de_novos(sites, [3])}}
+        
+        results = dict(score_cohorts(['GENE1', 'GENE2'], cohorts, de_novos,
+            None, store=self.folder))
+        self.assertEqual(list(results), ['GENE1'])
+        
+        results = results['GENE1']
+        self.assertEqual([x['cohort'] for x in results], ['A', 'B'])
+        self.assertEqual([x['de_novos'] for x in results], [2, 1])
+        expected = GeneStats(store['GENE1']).enrichment(de_novos['B']['GENE1'], 50, 10)
+        self.assertEqual(results[1], {'cohort': 'B', **expected})
@@ -2,9 +2,9 @@
 
 import unittest
 
-from numpy import array
+from numpy import array, exp, log
 
-from fitDNM.cumulant_generating_functions import cgf_0, cgf_2
+from fitDNM.cumulant_generating_functions import cgf_0, cgf_2, CGFKernel
 
 class TestConditionalApproximationPy(unittest.TestCase):
     ''' Cumulant generating function checks
@@ -67,3 +67,82 @@ class TestConditionalApproximationPy(unittest.TestCase):
         lambdas = array([1e-4] * 100)
         weights = array([0.2] * 100)
         self.assertAlmostEqual(cgf_2(mu, s, lambdas, weights), 6.776264e-21, delta=1e-18)
+    
+    def test_kernel_evaluate(self):
+        ''' the CGF kernel matches the CGFs evaluated one mu and s pair at a time
+        '''
+        
+        mu = array([1, 5, -2])
+        s = array([1, 1, 0.5])
+        lambdas = array([1e-8, 2e-8, 3e-8, 1e-7])
+        weights = array([0.05, 0.5, 1.0, 0.2])
+        
+        kernel = CGFKernel(lambdas, weights)
+        values = kernel.evaluate(mu, s)
+        for i in range(len(mu)):
+            self.assertAlmostEqual(values['value'][i], cgf_0(mu[i], s[i], lambdas, weights), delta=1e-20)
+            self.assertAlmostEqual(values['hessian'][i], cgf_2(mu[i], s[i], lambdas, weights), delta=1e-30)
+            
+            # the gradient is the sum of the rates, weighted by the CGF terms
+            terms = lambdas * exp(weights * mu[i] + s[i])
+            self.assertAlmostEqual(values['gradient_s'][i], sum(terms), delta=1e-20)
+            self.assertAlmostEqual(values['gradient_mu'][i], sum(weights * terms), delta=1e-20)
+        
+        # scalar inputs give length one vectors
+        values = kernel.evaluate(1, 1)
+        self.assertAlmostEqual(values['value'][0], cgf_0(1, 1, lambdas, weights), delta=1e-20)
+        
+        # expect an error if the vector lengths don't match
+        with self.assertRaises(AssertionError):
+            CGFKernel(array([1e-8] * 5), array([0.05] * 6))
+    
+    def test_kernel_tilted(self):
+        ''' the tilted moments are correct, without overflowing
+        '''
+        
+        lambdas = array([1e-8, 2e-8, 3e-8, 1e-7])
+        weights = array([0.05, 0.5, 1.0, 0.2])
+        kernel = CGFKernel(lambdas, weights)
+        
+        values = kernel.tilted(array([0.0, 2.0, 5000.0]))
+        
+        # the ratio is the mean of the weights under the tilted rates
+        tilted = lambdas * exp(weights * 2.0)
+        mean = sum(weights * tilted) / sum(tilted)
+        self.assertAlmostEqual(values['ratio'][1], mean, delta=1e-14)
+        self.assertAlmostEqual(values['ratio'][1], kernel.ratio(2.0)[0], delta=1e-14)
+        self.assertAlmostEqual(values['slope'][1],
+            sum((weights - mean)**2 * tilted) / sum(tilted), delta=1e-14)
+        self.assertAlmostEqual(values['log_total'][1], log(sum(tilted)), delta=1e-12)
+        
+        # large mu values tilt entirely towards the largest weight
+        self.assertAlmostEqual(values['ratio'][2], 1.0, delta=1e-14)
+        self.assertAlmostEqual(values['log_total'][2], 5000 + log(3e-8), delta=1e-9)
+    
+    def test_cgf_exact(self):
+        ''' the float64 CGFs match the arbitrary precision CGFs
+        '''
+        
+        lambdas = array([1e-8, 2e-8, 3e-8, 1e-7])
+        weights = array([0.05, 0.5, 1.0, 0.2])
+        for mu, s in [(1, 1), (5, 1), (-2, 0.5), (40, -30)]:
+            value = cgf_0(mu, s, lambdas, weights)
+            self.assertAlmostEqual(value, cgf_0(mu, s, lambdas, weights, exact=True),
+                delta=abs(value) * 1e-12)
+            value = cgf_2(mu, s, lambdas, weights)
+            self.assertAlmostEqual(value, cgf_2(mu, s, lambdas, weights, exact=True),
+                delta=abs(value) * 1e-5)
+    
+    def test_kernel_large_exponents(self):
+        ''' the kernel stays finite when e^{weights * mu} alone would overflow
+        '''
+        
+        lambdas = array([1e-8] * 10)
+        weights = array([50.0] * 5 + [40.0] * 5)
+        kernel = CGFKernel(lambdas, weights)
+        
+        # e^{50 * 20} overflows, but e^{50 * 20 - 995} does not
+        values = kernel.evaluate(20, -995)
+        expected = cgf_0(20, -995, lambdas, weights, exact=True)
+        self.assertAlmostEqual(values['value'][0], expected, delta=abs(expected) * 1e-12)
+        self.assertAlmostEqual(values['log_gradient_s'][0], 5 + log(5e-8), delta=1e-9)
@@ -0,0 +1,147 @@
+# unit testing for the fitDNM functions
+
+import unittest
+import json
+import random
+import shutil
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from fitDNM.ensembl_genes import EnsemblGenes, ResponseCache
+from fitDNM.mutation_rates import get_gene_rates
+
+def make_responses():
+    ''' make Ensembl REST responses for one gene, with one transcript
+    '''
+    random.seed(1)
+    start, end, expand = 101, 700, 10
+    genomic = ''.join(random.choice('ACGT') for _ in range(end - start + 1 + 2 * expand))
+    exons = [(101, 250), (401, 700)]
+    cds = [(151, 250), (401, 600)]
+    cds_seq = ''.join(genomic[a - start + expand:b - start + expand + 1] for a, b in cds)
+    
+    ranges = lambda regions: json.dumps([{'Parent': 'ENST1', 'start': a,
+        'end': b} for a, b in regions])
+    return {
+        '/xrefs/symbol/homo_sapiens/GENE1': json.dumps([{'id': 'ENSG1', 'type': 'gene'}]),
+        '/overlap/id/ENSG1?feature=transcript': json.dumps([{'id': 'ENST1',
+            'Parent': 'ENSG1', 'biotype': 'protein_coding',
+            'seq_region_name': '1', 'external_name': 'GENE1-201'}]),
+        '/sequence/id/ENST1?type=genomic;expand_3prime=10;expand_5prime=10': json.dumps({
+            'id': 'ENST1', 'seq': genomic,
+            'desc': f'chromosome:GRCh37:1:{start - expand}:{end + expand}:1'}),
+        '/sequence/id/ENST1?type=cds': cds_seq,
+        '/overlap/id/ENST1?feature=exon': ranges(exons),
+        '/overlap/id/ENST1?feature=cds': ranges(cds),
+        }
+
+class StandIn(BaseHTTPRequestHandler):
+    ''' local stand-in for the Ensembl REST servers
+    '''
+    responses = make_responses()
+    requests = []
+    
+    # paths to turn away once each, as if over the rate limit
+    limited = set()
+    
+    def do_GET(self):
+        self.requests.append(self.path)
+        if self.path in self.limited:
+            self.limited.discard(self.path)
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.end_headers()
+            return
+        if self.path.startswith('/fetch/symbol/'):
+            # no previous symbols from genenames.org
+            body = json.dumps({'response': {'docs': []}})
+        elif self.path.startswith('/xrefs/symbol/'):
+            body = self.responses.get(self.path, '[]')
+        elif self.path in self.responses:
+            body = self.responses[self.path]
+        else:
+            self.send_error(404)
+            return
+        
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(body.encode('utf8'))
+    
+    def log_message(self, *args):
+        pass
+
+class TestEnsemblGenesPy(unittest.TestCase):
+    ''' checks for loading genes from Ensembl, with an on-disk cache
+    '''
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+        cls.url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+    
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        StandIn.requests.clear()
+    
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+    
+    def test_load(self):
+        ''' check that genes load from the server, and are cached on disk
+        '''
+        genes = EnsemblGenes(self.folder, server=self.url)
+        loaded = genes.load(['GENE1', 'GENE2'])
+        
+        # unknown genes have no transcripts
+        self.assertEqual(len(loaded['GENE2'].transcripts), 0)
+        gene = loaded['GENE1']
+        self.assertEqual(len(gene.transcripts), 1)
+        tx = gene.transcripts[0]
+        self.assertEqual((tx.name, tx.chrom, tx.start, tx.end), ('ENST1', '1', 101, 700))
+        self.assertEqual(len(tx.cds_sequence), 300)
+        
+        # responses are cached under the Ensembl URLs, not the stand-in URLs
+        cache = ResponseCache(self.folder)
+        url = 'https://grch37.rest.ensembl.org/sequence/id/ENST1?type=cds'
+        self.assertEqual(cache.get(url), StandIn.responses['/sequence/id/ENST1?type=cds'].encode('utf8'))
+        cache.close()
+    
+    def test_retry(self):
+        ''' check that rate limited requests are retried, then cached
+        '''
+        path = '/sequence/id/ENST1?type=cds'
+        StandIn.limited.add(path)
+        genes = EnsemblGenes(self.folder, server=self.url)
+        gene = genes.load(['GENE1'])['GENE1']
+        
+        self.assertEqual(StandIn.requests.count(path), 2)
+        self.assertEqual(len(gene.transcripts[0].cds_sequence), 300)
+        
+        cache = ResponseCache(self.folder)
+        url = 'https://grch37.rest.ensembl.org' + path
+        self.assertEqual(cache.get(url), StandIn.responses[path].encode('utf8'))
+        cache.close()
+    
+    def test_offline(self):
+        ''' check that offline runs only use the cache
+        '''
+        offline = EnsemblGenes(self.folder, offline=True)
+        with self.assertLogs(level='ERROR'):
+            self.assertNotIn('GENE1', offline)
+        
+        EnsemblGenes(self.folder, server=self.url).prefetch(['GENE1'])
+        count = len(StandIn.requests)
+        
+        # after the prefetch, genes load without any requests
+        rates = get_gene_rates('GENE1', None, offline)
+        online = get_gene_rates('GENE1', None, EnsemblGenes(self.folder, server=self.url))
+        self.assertEqual(len(StandIn.requests), count)
+        self.assertTrue(rates.equals(online))
+        self.assertEqual(set(rates['gene']), {'GENE1'})
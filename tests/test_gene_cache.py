@@ -0,0 +1,94 @@
+# unit testing for the fitDNM functions
+
+import unittest
+import os
+import pickle
+import random
+import shutil
+import tempfile
+
+from gencodegenes import Gencode
+
+from fitDNM.gene_cache import GeneCache, cache_key
+from fitDNM.mutation_rates import get_gene_rates
+
+class TestGeneCachePy(unittest.TestCase):
+    ''' checks for the persistent gene cache
+    '''
+    
+    def setUp(self):
+        ''' write a small genome and annotations file, with one gene
+        '''
+        self.folder = tempfile.mkdtemp()
+        self.fasta = os.path.join(self.folder, 'genome.fa')
+        self.gtf = os.path.join(self.folder, 'genes.gtf')
+        self.cache = os.path.join(self.folder, 'cache')
+        
+        random.seed(1)
+        seq = ''.join(random.choice('ACGT') for _ in range(3000))
+        with open(self.fasta, 'w') as handle:
+            handle.write('>1\n' + '\n'.join(seq[i:i + 60] for i in range(0, 3000, 60)) + '\n')
+        
+        # the canonical transcript is tagged, and has the shorter CDS
+        ids = 'gene_id "ENSG1"; gene_type "protein_coding"; gene_name "GENE1";'
+        tx1 = f'{ids} transcript_id "ENST1"; transcript_type "protein_coding"; tag "Ensembl_canonical";'
+        tx2 = f'{ids} transcript_id "ENST2"; transcript_type "protein_coding";'
+        lines = [('gene', 100, 2000, ids),
+            ('transcript', 100, 2000, tx1), ('exon', 100, 400, tx1),
+            ('CDS', 200, 400, tx1), ('exon', 1000, 2000, tx1), ('CDS', 1000, 1500, tx1),
+            ('transcript', 100, 1800, tx2), ('exon', 100, 400, tx2),
+            ('CDS', 150, 400, tx2), ('exon', 1000, 1800, tx2), ('CDS', 1000, 1700, tx2)]
+        with open(self.gtf, 'w') as handle:
+            for feature, start, end, attributes in lines:
+                handle.write(f'1\tHAVANA\t{feature}\t{start}\t{end}\t.\t+\t.\t{attributes}\n')
+    
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+    
+    def test_cached_gene(self):
+        ''' check that genes from the cache match the gencode genes
+        '''
+        gencode = Gencode(self.gtf, self.fasta)
+        cache = GeneCache(self.cache, self.gtf, self.fasta)
+        
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(list(cache), ['GENE1'])
+        self.assertIn('GENE1', cache)
+        self.assertNotIn('GENE2', cache)
+        with self.assertRaises(KeyError):
+            cache['GENE2']
+        
+        gene, cached = gencode['GENE1'], cache['GENE1']
+        self.assertEqual(cached.chrom, gene.chrom)
+        self.assertEqual(cached.transcripts, gene.transcripts)
+        self.assertEqual(cached.canonical.name, 'ENST1')
+        for tx, other in zip(cached.transcripts, gene.transcripts):
+            self.assertEqual(tx.cds_sequence, other.cds_sequence)
+            self.assertEqual(tx.genomic_sequence, other.genomic_sequence)
+        
+        # mutation rates match when the gene comes from the cache
+        expected = get_gene_rates('GENE1', None, gencode)
+        rates = get_gene_rates('GENE1', None, cache)
+        self.assertTrue(rates.equals(expected))
+    
+    def test_cache_reused(self):
+        ''' check that the cache is reused, unless the inputs change
+        '''
+        cache = GeneCache(self.cache, self.gtf, self.fasta)
+        self.assertEqual(GeneCache(self.cache, self.gtf, self.fasta).path, cache.path)
+        self.assertEqual(os.listdir(self.cache), [os.path.basename(cache.path)])
+        
+        # a different build or modified annotations give a different key
+        key = cache_key(self.gtf, self.fasta, 'grch37')
+        self.assertNotEqual(cache_key(self.gtf, self.fasta, 'grch38'), key)
+        os.utime(self.gtf, ns=(0, 0))
+        self.assertNotEqual(cache_key(self.gtf, self.fasta, 'grch37'), key)
+    
+    def test_pickle(self):
+        ''' check that a cache with an open connection can be pickled
+        '''
+        cache = GeneCache(self.cache, self.gtf, self.fasta)
+        self.assertIn('GENE1', cache)
+        
+        cache = pickle.loads(pickle.dumps(cache))
+        self.assertEqual(cache['GENE1'].canonical.name, 'ENST1')
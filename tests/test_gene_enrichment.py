@@ -71,7 +71,8 @@ class TestDoubleSaddlePointPy(unittest.TestCase):
         
         symbol, severity, rates = self.get_gene_data(length=100)
         
-        values = enrichment(de_novos, n_male, n_female, symbol, severity, rates)
+        values = enrichment(de_novos, n_male, n_female, symbol, severity,
+            rates, method='legacy')
         p_value = values['p_value']
         del values['p_value']
         
@@ -80,6 +81,69 @@ class TestDoubleSaddlePointPy(unittest.TestCase):
             'p_unweighted': 4.526029176220055e-06}
         self.assertEqual(values, expected)
         self.assertAlmostEqual(p_value, 0.000044730946048192, delta=1e-14)
+        
+        # the newton solver gives a slightly different p-value
+        values = enrichment(de_novos, n_male, n_female, symbol, severity, rates)
+        self.assertAlmostEqual(values['p_value'], 4.472170763665492e-05, delta=1e-14)
+    
+    def test_enrichment_binning(self):
+        ''' enrichment with binned weights is close to the per site p-value
+        '''
+        
+        de_novos = pandas.read_table(self.get_de_novo_table(), sep='\s+',
+            skipinitialspace=True)
+        symbol, severity, rates = self.get_gene_data(length=100)
+        
+        values = enrichment(de_novos, 100, 100, symbol, severity, rates,
+            binning='exact')
+        self.assertEqual(values['weight_shift'], 0.0)
+        self.assertAlmostEqual(values['p_value'], 4.472170763665492e-05, delta=1e-14)
+        
+        values = enrichment(de_novos, 100, 100, symbol, severity, rates,
+            binning=0.1)
+        self.assertLessEqual(values['weight_shift'], 0.1)
+        self.assertAlmostEqual(values['p_value'], 4.472170763665492e-05, delta=1e-7)
+    
+    def test_enrichment_tail(self):
+        ''' enrichment with a Poisson tail reports the bound on omitted terms
+        '''
+        
+        de_novos = pandas.read_table(self.get_de_novo_table(), sep='\s+',
+            skipinitialspace=True)
+        symbol, severity, rates = self.get_gene_data(length=100)
+        
+        values = enrichment(de_novos, 100, 100, symbol, severity, rates)
+        self.assertNotIn('tail_bound', values)
+        
+        bounded = enrichment(de_novos, 100, 100, symbol, severity, rates,
+            tail=1e-12)
+        self.assertLess(bounded['tail_bound'], bounded['p_value'] * 1e-6)
+        self.assertAlmostEqual(bounded['p_value'] / values['p_value'], 1, places=5)
+    
+    def test_enrichment_screen(self):
+        ''' enrichment skips the saddlepoint for genes above the screen
+        '''
+        
+        de_novos = pandas.read_table(self.get_de_novo_table(), sep='\s+',
+            skipinitialspace=True)
+        symbol, severity, rates = self.get_gene_data(length=100)
+        
+        values = enrichment(de_novos, 100, 100, symbol, severity, rates)
+        self.assertNotIn('screened', values)
+        
+        # the gene is significant, so passes the screen
+        screened = enrichment(de_novos, 100, 100, symbol, severity, rates,
+            screen=0.01)
+        self.assertFalse(screened['screened'])
+        self.assertEqual(screened['p_value'], values['p_value'])
+        
+        # a lower screen skips the saddlepoint. The bound is on the exact
+        # p-value, so can sit just above the saddlepoint approximation.
+        screened = enrichment(de_novos, 100, 100, symbol, severity, rates,
+            screen=1e-6)
+        self.assertTrue(screened['screened'])
+        self.assertGreater(screened['p_value'], 1e-6)
+        self.assertAlmostEqual(screened['p_value'] / values['p_value'], 1, delta=0.02)
     
     def test_enrichment_zero_de_novos(self):
         ''' enrichment output is correct when the do novos are not in the
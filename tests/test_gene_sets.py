@@ -0,0 +1,113 @@
+# unit testing for the fitDNM functions
+
+import os
+import unittest
+import tempfile
+import shutil
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import pandas
+from numpy.random import seed
+
+from fitDNM.gene_enrichment import enrichment
+from fitDNM.gene_sets import read_gene_sets, score_gene_sets, GeneTerms
+from fitDNM.load_de_novos import split_by_gene
+from fitDNM.open_severity import decode_alleles
+from fitDNM.site_store import SiteStore
+from tests.random_sites import random_sites
+
+class TestGeneSetsPy(unittest.TestCase):
+    ''' check scoring gene sets from a site store
+    '''
+    
+    def setUp(self):
+        seed(1)
+        self.folder = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+    
+    def test_read_gene_sets(self):
+        ''' check loading GMT files, and lists of genes
+        '''
+        path = os.path.join(self.folder, 'sets.gmt')
+        with open(path, 'w') as handle:
+            handle.write('SET1\tfirst set\tGENE1\tGENE2\n'
+                'SET2\thttp://example.org\tGENE3\t\n')
+        self.assertEqual(read_gene_sets(path),
+            {'SET1': ['GENE1', 'GENE2'], 'SET2': ['GENE3']})
+        
+        path = os.path.join(self.folder, 'genes.txt')
+        with open(path, 'w') as handle:
+            handle.write('GENE1\nGENE2\n\n')
+        self.assertEqual(read_gene_sets(path), {'genes': ['GENE1', 'GENE2']})
+    
+    def test_score_gene_sets(self):
+        ''' check gene set scores, against single genes and pooled genes
+        '''
+        store = SiteStore(self.folder, create=True)
+        store.add('GENE1', random_sites('GENE1', 100, '1'))
+        store.add('GENE2', random_sites('GENE2', 80, 'X'))
+        store.write_index()
+        
+        de_novos = pandas.read_table(StringIO('gene chrom pos alt ref\n'
+            'GENE1 1 1 G C\nGENE1 1 2 A T\nGENE2 X 5 A C\n'), sep=r'\s+',
+            dtype={'chrom': str})
+        de_novos = split_by_gene(de_novos)
+        
+        sets = {'ONE': ['GENE1'], 'BOTH': ['GENE1', 'GENE2', 'GENE1', 'MISSING'],
+            'NONE': ['MISSING']}
+        results = dict(score_gene_sets(sets, de_novos, 100, 100, self.folder))
+        
+        # sets without any stored genes are skipped
+        self.assertEqual(set(results), {'ONE', 'BOTH'})
+        
+        # a set of one gene matches scoring the gene by itself
+        single = enrichment(de_novos['GENE1'], 100, 100, 'GENE1',
+            sites=store['GENE1'], tail=1e-12)
+        one = results['ONE']
+        for key in ['sites', 'de_novos', 'de_novos_score', 'p_value',
+                'p_unweighted', 'tail_bound']:
+            self.assertEqual(one[key], single[key])
+        
+        # repeated genes are only counted once
+        both = results['BOTH']
+        other = enrichment(de_novos['GENE2'], 100, 100, 'GENE2',
+            sites=store['GENE2'])
+        self.assertEqual(both['genes'], 2)
+        self.assertEqual(both['sites'], single['sites'] + other['sites'])
+        self.assertEqual(both['de_novos'], single['de_novos'] + other['de_novos'])
+        self.assertAlmostEqual(both['de_novos_score'],
+            single['de_novos_score'] + other['de_novos_score'], places=2)
+        self.assertTrue(0 <= both['p_value'] <= 1)
+    
+    def test_score_large_gene_set(self):
+        ''' check sets expecting over 100 de novos sum the counts past 100
+        '''
+        store = SiteStore(self.folder, create=True)
+        for i in range(5):
+            store.add(f'GENE{i}', random_sites(f'GENE{i}', 100, '1'))
+        store.write_index()
+        
+        sites = store['GENE1']
+        de_novos = split_by_gene(pandas.DataFrame({'gene': ['GENE1'],
+            'chrom': ['1'], 'pos': [sites.pos[0]],
+            'ref': decode_alleles(sites.ref[:1]), 'alt': decode_alleles(sites.alt[:1])}))
+        
+        # a huge cohort expects hundreds of de novos in the set, so a single
+        # observed de novo is not enriched at all
+        sets = {'ALL': [f'GENE{i}' for i in range(5)]}
+        males = females = 10**7
+        results = dict(score_gene_sets(sets, de_novos, males, females, self.folder))
+        result = results['ALL']
+        
+        total = sum(GeneTerms(store[x], None, males, females).total_prob
+            for x in sets['ALL'])
+        self.assertGreater(total, 100)
+        self.assertEqual(result['de_novos'], 1)
+        self.assertAlmostEqual(result['p_value'], 1, places=6)
+        self.assertLess(result['tail_bound'], 1e-12)
@@ -0,0 +1,130 @@
+# unit testing for the fitDNM functions
+
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import numpy
+import pandas
+from numpy.random import uniform, normal, seed, choice
+
+from fitDNM.gene_sites import GeneSites, downweight_scores
+from fitDNM.open_severity import encode_alleles
+
+class TestGeneSitesPy(unittest.TestCase):
+    ''' check the array-backed harmonised sites
+    '''
+    
+    def setUp(self):
+        seed(1)
+    
+    def get_tables(self, symbol, length):
+        ''' define severity and mutation rate tables for a gene
+        '''
+        bases = ['A', 'C', 'G', 'T']
+        consequences = ['missense', 'nonsense', 'splice_lof', 'synonymous']
+        
+        pos = list(range(1, length + 1)) * 4
+        ref = [ choice(bases) for x in range(length) ] * 4
+        alts = [ y for x in bases for y in [x] * length ]
+        cq = [ choice(consequences, p=(0.7, 0.05, 0.01, 0.24)) for x in range(length * 4) ]
+        
+        severity = pandas.DataFrame({'gene': symbol, 'chrom': '1', 'pos': pos,
+            'ref': ref, 'alt': alts, 'score': uniform(low=0, high=30, size=length * 4)})
+        rates = pandas.DataFrame({'gene': symbol, 'chrom': '1', 'pos': pos,
+            'ref': ref, 'alt': alts, 'consequence': cq,
+            'prob': 10**(normal(size=length * 4, loc=-8, scale=0.5))})
+        
+        return severity, rates
+    
+    def test_from_tables(self):
+        ''' check that joining the tables matches a pandas merge
+        '''
+        severity, rates = self.get_tables('GENE1', 50)
+        # duplicate some rates, as from overlapping transcripts
+        rates = pandas.concat([rates, rates.iloc[:20]], ignore_index=True)
+        sites = GeneSites.from_tables(rates, severity, 'GENE1')
+        
+        expected = rates.merge(severity, on=['gene', 'chrom', 'pos', 'ref', 'alt'])
+        expected = expected[~expected[['pos', 'alt']].duplicated()]
+        expected = expected.sort_values(['pos', 'alt']).reset_index(drop=True)
+        
+        self.assertEqual(len(sites), 200)
+        self.assertEqual(sites.pos.dtype, numpy.int32)
+        self.assertEqual(sites.ref.dtype, numpy.uint8)
+        pandas.testing.assert_frame_equal(sites.to_frame(), expected[sites.to_frame().columns])
+    
+    def test_from_cadd_arrays(self):
+        ''' check that joining with float32 CADD arrays recovers the scores
+        '''
+        severity, rates = self.get_tables('GENE1', 20)
+        severity['score'] = severity['score'].round(3)
+        arrays = {'pos': severity['pos'].to_numpy(numpy.int32),
+            'ref': encode_alleles(severity['ref']),
+            'alt': encode_alleles(severity['alt']),
+            'score': severity['score'].to_numpy(numpy.float32)}
+        
+        from_table = GeneSites.from_tables(rates, severity, 'GENE1')
+        from_arrays = GeneSites.from_tables(rates, arrays, 'GENE1')
+        
+        self.assertTrue((from_table.score == from_arrays.score).all())
+    
+    def test_from_tables_errors(self):
+        ''' check that tables without shared sites raise errors
+        '''
+        severity, rates = self.get_tables('GENE1', 20)
+        
+        with self.assertRaises(ValueError):
+            GeneSites.from_tables(rates, severity.iloc[:0], 'GENE1')
+        
+        severity['pos'] += 100
+        with self.assertRaises(ValueError):
+            GeneSites.from_tables(rates, severity, 'GENE1')
+    
+    def test_downweighted(self):
+        ''' check that downweighting matches summing each site in a python loop
+        '''
+        severity, rates = self.get_tables('GENE1', 50)
+        sites = GeneSites.from_tables(rates, severity, 'GENE1')
+        
+        data = sites.to_frame()
+        data['value'] = data['prob'] * data['score']
+        recode = dict([ (pos, sum(x['value'])) for pos, x in data.groupby('pos') ])
+        expected = (data['score'] - data['pos'].map(recode)).to_numpy()
+        
+        self.assertTrue((sites.downweighted() == expected).all())
+    
+    def test_downweight_scores_unsorted(self):
+        ''' check downweighting unsorted keys, with many alleles per key
+        '''
+        pos = choice(20, size=1000)
+        prob = 10**(normal(size=1000, loc=-8, scale=0.5))
+        score = uniform(low=0, high=30, size=1000)
+        
+        recode = {}
+        for key, value in zip(pos, prob * score):
+            recode[key] = recode.get(key, 0) + value
+        expected = score - numpy.array([recode[x] for x in pos])
+        
+        self.assertTrue((downweight_scores(pos, prob, score) == expected).all())
+        self.assertEqual(len(downweight_scores([], [], [])), 0)
+    
+    def test_matches(self):
+        ''' check that de novos are matched to their sites
+        '''
+        severity, rates = self.get_tables('GENE1', 50)
+        sites = GeneSites.from_tables(rates, severity, 'GENE1')
+        
+        # de novos in another gene, off the sites or not SNVs are dropped
+        frame = sites.to_frame()
+        de_novos = pandas.read_table(StringIO('gene chrom pos ref alt\n'
+            f'GENE1 1 3 {frame.ref[10]} G\n'
+            f'GENE1 1 1 {frame.ref[0]} C\n'
+            f'GENE2 1 1 {frame.ref[0]} C\n'
+            f'GENE1 1 100 {frame.ref[0]} C\n'
+            f'GENE1 1 1 {frame.ref[0]} CA\n'), sep=r'\s+', dtype={'chrom': str})
+        
+        self.assertEqual(list(sites.matches(de_novos)), [10, 1])
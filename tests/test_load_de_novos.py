@@ -0,0 +1,92 @@
+# unit testing for the fitDNM functions
+
+import unittest
+import gzip
+import os
+import tempfile
+import shutil
+
+from fitDNM.load_de_novos import group_de_novos, read_de_novos, split_by_gene
+
+TABLE = '''gene\tchrom\tpos\tref\talt\tperson_id
+GENE1\t1\t100\tA\tG\tP1
+GENE2\t2\t200\tC\tT\tP2
+GENE1\t1\t150\tG\tA\tP3
+GENE3\tX\t300\tT\tTA\tP4
+'''
+
+VCF = '''##fileformat=VCFv4.2
+##INFO=<ID=GENE,Number=1,Type=String,Description="HGNC symbol">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO
+1\t100\t.\tA\tG\t.\tPASS\tDP=10;GENE=GENE1
+2\t200\t.\tC\tT,G\t.\tPASS\tGENE=GENE2;DP=20
+1\t150\t.\tG\tA\t.\tPASS\tSYMBOL_GENE=OTHER;GENE=GENE1
+1\t175\t.\tG\tA\t.\tPASS\tDP=5
+'''
+
+class TestLoadDeNovosPy(unittest.TestCase):
+    ''' check loading de novos, grouped by gene
+    '''
+    
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+    
+    def write(self, name, text, compress=False):
+        path = os.path.join(self.folder, name)
+        opener = gzip.open if compress else open
+        with opener(path, 'wt') as handle:
+            handle.write(text)
+        return path
+    
+    def test_group_table(self):
+        ''' check grouping de novos from a table, with or without gzip
+        '''
+        for compress in [False, True]:
+            path = self.write('de_novos.txt', TABLE, compress)
+            
+            # use a tiny chunk size, so genes are split across chunks
+            grouped = group_de_novos(path, chunksize=2)
+            self.assertEqual(set(grouped), {'GENE1', 'GENE2', 'GENE3'})
+            
+            gene1 = grouped['GENE1']
+            self.assertEqual(list(gene1.columns), ['gene', 'chrom', 'pos', 'ref', 'alt'])
+            self.assertEqual(list(gene1['pos']), [100, 150])
+            self.assertEqual(list(gene1.index), [0, 1])
+            self.assertEqual(list(grouped['GENE3']['chrom']), ['X'])
+            self.assertEqual(list(grouped['GENE3']['alt']), ['TA'])
+    
+    def test_group_vcf(self):
+        ''' check grouping de novos from a VCF, with the gene in an INFO field
+        '''
+        for compress in [False, True]:
+            path = self.write('de_novos.vcf', VCF, compress)
+            
+            with self.assertLogs(level='INFO'):
+                grouped = group_de_novos(path)
+            
+            self.assertEqual(set(grouped), {'GENE1', 'GENE2'})
+            self.assertEqual(list(grouped['GENE1']['pos']), [100, 150])
+            self.assertEqual(list(grouped['GENE1']['chrom']), ['1', '1'])
+            
+            # multi-allelic sites are split into one row per alt allele
+            self.assertEqual(list(grouped['GENE2']['alt']), ['T', 'G'])
+            self.assertEqual(list(grouped['GENE2']['pos']), [200, 200])
+    
+    def test_vcf_gene_key(self):
+        ''' check that the gene can come from a different INFO field
+        '''
+        path = self.write('de_novos.vcf', VCF)
+        chunks = list(read_de_novos(path, gene_key='SYMBOL_GENE'))
+        self.assertEqual(list(chunks[0]['gene']), ['OTHER'])
+    
+    def test_split_by_gene(self):
+        ''' check splitting a loaded table
+        '''
+        path = self.write('de_novos.txt', TABLE)
+        table = next(read_de_novos(path))
+        grouped = split_by_gene(table)
+        self.assertEqual(list(grouped['GENE1']['pos']), [100, 150])
+        self.assertEqual(list(grouped['GENE1'].index), [0, 1])
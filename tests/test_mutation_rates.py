@@ -13,7 +13,7 @@ try:
 except ImportError:
     from io import StringIO
 
-from fitDNM.mutation_rates import get_gene_rates
+from fitDNM.mutation_rates import get_gene_rates, get_mutation_rates
 from tests.compare_dataframes import CompareTables
 
 class TestMutationRatesPy(CompareTables):
@@ -74,3 +74,23 @@ class TestMutationRatesPy(CompareTables):
         data['chrom'] = data['chrom'].astype(str)
         
         self.compare_tables(mu_rates.head(10), data)
+    
+    def test_get_mutation_rates(self):
+        ''' check that mutation rate tables are only loaded once per path
+        '''
+        
+        rates = get_mutation_rates()
+        self.assertIs(get_mutation_rates(), rates)
+        self.assertEqual(rates[0], [b'AAA', b'ACA', b'1.66811198898708e-09'])
+        
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'rates.txt')
+            with open(path, 'w') as handle:
+                handle.write('from\tto\tmu_snp\nAAA\tACA\t1e-8\n')
+            
+            custom = get_mutation_rates(path)
+            self.assertEqual(custom, [[b'AAA', b'ACA', b'1e-8']])
+            
+            # relative paths share the entry for the absolute path
+            relative = os.path.relpath(path)
+            self.assertIs(get_mutation_rates(relative), custom)
@@ -0,0 +1,118 @@
+# unit testing for the fitDNM functions
+
+import unittest
+import tempfile
+import shutil
+
+import numpy
+import pandas
+from numpy.random import seed
+
+from fitDNM.gene_enrichment import get_expected_rates
+from fitDNM.null_curves import null_curve, NullCurves
+from fitDNM.saddlepoint import saddlepoint
+from fitDNM.scheduler import build_null_curves, score_gene
+from fitDNM.site_store import SiteStore
+from tests.random_sites import random_sites
+
+class TestNullCurvesPy(unittest.TestCase):
+    ''' check the precomputed null p-value curves
+    '''
+    
+    def setUp(self):
+        seed(1)
+        self.folder = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+    
+    def test_null_curve(self):
+        ''' check the curve is monotone, and lookups match the raw saddlepoint
+        '''
+        sites = random_sites('GENE1', 50)
+        probs = get_expected_rates(sites, 1000, 1000)
+        weights = sites.downweighted()
+        
+        y, log_p, error = null_curve(probs, weights)
+        self.assertTrue((numpy.diff(log_p) <= 0).all())
+        self.assertEqual(len(error), len(y) - 1)
+        self.assertLessEqual(len(y), 1025)
+        
+        curves = NullCurves(self.folder, 1000, 1000)
+        curves.add('GENE1', (y, log_p, error))
+        scores = numpy.linspace(y[0], y[-1], 500)
+        found = [(x, curves.p_value('GENE1', x)) for x in scores]
+        found = [(x, p) for x, p in found if p is not None]
+        
+        # intervals where the raw p-values jump, or rise above the running
+        # minimum, fall back to the saddlepoint
+        self.assertTrue((error > 1e-3).any())
+        self.assertLess(len(found), len(scores))
+        for score, estimate in found:
+            expected = saddlepoint(score, probs, weights)
+            self.assertLess(abs(estimate / expected - 1), 2e-3)
+        
+        # the curve can't be made without a positive weight
+        self.assertIsNone(null_curve(probs, -abs(weights)))
+    
+    def test_null_curves_store(self):
+        ''' check curves round trip through the store, and are used in scoring
+        '''
+        store = SiteStore(self.folder, create=True)
+        store.add('GENE1', random_sites('GENE1', 50))
+        store.add('GENE2', random_sites('GENE2', 30))
+        store.write_index()
+        
+        built = build_null_curves(self.folder, 1000, 1000)
+        curves = NullCurves(self.folder, 1000, 1000)
+        self.assertEqual(len(curves), 2)
+        self.assertNotIn('GENE3', curves)
+        for symbol in ['GENE1', 'GENE2']:
+            y, log_p, error = built.curves[symbol]
+            self.assertTrue((curves.curves[symbol][0] == y).all())
+            self.assertTrue((curves.curves[symbol][2] == error).all())
+            self.assertEqual(curves.error(symbol), error.max())
+        
+        # other cohorts have their own curves
+        self.assertEqual(len(NullCurves(self.folder, 1000, 999)), 0)
+        
+        grid = curves.curves['GENE1'][0]
+        self.assertEqual(curves.p_value('GENE1', 0), 1.0)
+        self.assertIsNone(curves.p_value('GENE1', grid[-1] + 1))
+        self.assertIsNone(curves.p_value('GENE3', 10))
+        
+        de_novos = pandas.DataFrame({'gene': ['GENE1'], 'chrom': ['1'],
+            'pos': [5], 'ref': [store['GENE1'].to_frame().ref[16]], 'alt': ['G']})
+        solved = score_gene('GENE1', de_novos, 1000, 1000, store=self.folder)
+        looked_up = score_gene('GENE1', de_novos, 1000, 1000, store=self.folder,
+            null_curves=True)
+        
+        self.assertEqual(looked_up['de_novos'], 1)
+        self.assertNotEqual(looked_up['p_value'], solved['p_value'])
+        self.assertLess(abs(looked_up['p_value'] / solved['p_value'] - 1), 0.01)
+    
+    def test_null_curves_tolerance(self):
+        ''' check intervals which miss the tolerance are never used
+        '''
+        store = SiteStore(self.folder, create=True)
+        store.add('GENE1', random_sites('GENE1', 5))
+        store.write_index()
+        
+        # a tolerance the grid can't reach leaves the gene without a curve
+        curves = build_null_curves(self.folder, 1000, 1000, rtol=1e-14)
+        self.assertNotIn('GENE1', curves)
+        
+        # curves in the file above its tolerance fall back to the saddlepoint
+        sites = store['GENE1']
+        curve = null_curve(get_expected_rates(sites, 1000, 1000),
+            sites.downweighted(), points=5, max_points=5)
+        self.assertTrue((curve[2] > 1e-3).all())
+        curves.add('GENE1', curve)
+        curves.write()
+        
+        loaded = NullCurves(self.folder, 1000, 1000)
+        self.assertEqual(loaded.rtol, 1e-14)
+        self.assertIsNone(loaded.p_value('GENE1', curve[0][2]))
+        
+        loose = NullCurves(self.folder, 1000, 1000, rtol=curve[2].max())
+        self.assertIsNotNone(loose.p_value('GENE1', curve[0][2]))
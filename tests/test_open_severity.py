@@ -3,6 +3,7 @@
 import unittest
 import os
 
+import numpy
 import pandas
 
 try:
@@ -10,7 +11,8 @@ try:
 except ImportError:
     from io import StringIO
 
-from fitDNM.open_severity import get_cadd_severity
+from fitDNM.open_severity import (get_cadd_severity, get_cadd_severities,
+    merge_regions, CaddReader, decode_alleles)
 from tests.compare_dataframes import CompareTables
 
 class TestOpenSeverityPy(CompareTables):
@@ -40,3 +42,47 @@ class TestOpenSeverityPy(CompareTables):
         data['chrom'] = data['chrom'].astype(str)
         
         self.compare_tables(severity.head(), data)
+    
+    def test_merge_regions(self):
+        ''' check that overlapping regions are merged per chromosome
+        '''
+        
+        regions = [('2', 50, 60), ('1', 10, 20), ('1', 15, 30), ('1', 30, 40),
+            ('1', 45, 50)]
+        merged = merge_regions(regions)
+        
+        self.assertEqual(dict(merged), {'1': [[10, 40], [45, 50]], '2': [[50, 60]]})
+    
+    def test_get_cadd_severities(self):
+        ''' check that bulk extraction matches extracting genes one at a time
+        '''
+        
+        cadd_path = os.path.join(os.path.dirname(__file__), 'data', 'cadd.txt.gz')
+        regions = [('GENE1', '11', 59210641, 59210900),
+            ('GENE2', '11', 59210800, 59211589),
+            ('GENE3', 'chr11', 59211000, 59211100)]
+        
+        bulk = get_cadd_severities(regions, cadd_path)
+        for symbol, chrom, start, end in regions:
+            single = get_cadd_severity(symbol, chrom, start, end, cadd_path)
+            self.assertGreater(len(bulk[symbol]), 0)
+            self.compare_tables(bulk[symbol], single)
+            self.assertTrue((bulk[symbol]['pos'] > start).all())
+            self.assertTrue((bulk[symbol]['pos'] <= end).all())
+        
+        self.assertEqual(set(bulk['GENE3']['chrom']), {'chr11'})
+    
+    def test_cadd_reader_arrays(self):
+        ''' check the typed arrays from the CADD reader
+        '''
+        
+        cadd_path = os.path.join(os.path.dirname(__file__), 'data', 'cadd.txt.gz')
+        with CaddReader(cadd_path) as reader:
+            arrays = reader.extract([('OR5A1', '11', 59210641, 59210643)])['OR5A1']
+        
+        self.assertEqual(arrays['pos'].dtype, numpy.int32)
+        self.assertEqual(arrays['alt'].dtype, numpy.uint8)
+        self.assertEqual(arrays['score'].dtype, numpy.float32)
+        self.assertEqual(list(arrays['pos']), [59210642] * 3 + [59210643] * 3)
+        self.assertEqual(list(decode_alleles(arrays['alt'])), ['C', 'G', 'T', 'A', 'C', 'G'])
+        self.assertEqual(list(decode_alleles(arrays['ref'])), ['A'] * 3 + ['T'] * 3)
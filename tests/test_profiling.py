@@ -0,0 +1,100 @@
+# unit testing for the fitDNM functions
+
+import os
+import unittest
+import tempfile
+import shutil
+
+from numpy.random import uniform, normal, seed
+
+from fitDNM import profiling
+from fitDNM.profiling import (profile_gene, stage, count, profile_table,
+    write_profiles, read_profiles)
+from fitDNM.saddlepoint import saddlepoint
+from fitDNM.scheduler import score_genes
+from fitDNM.site_store import SiteStore
+from tests.random_sites import random_sites
+
+class TestProfilingPy(unittest.TestCase):
+    ''' check collecting per gene stage times and counts
+    '''
+    
+    def setUp(self):
+        seed(1)
+        self.folder = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+    
+    def test_inactive(self):
+        ''' check that stages and counts outside a gene profile do nothing
+        '''
+        with stage('tabix'):
+            count('solver_iterations')
+        self.assertIsNone(profiling._ACTIVE)
+    
+    def test_profile_gene(self):
+        ''' check that a gene profile collects stage times and solver counts
+        '''
+        lambdas = 10**normal(size=500, loc=-8, scale=0.5) * 4000
+        weights = uniform(low=0, high=30, size=500)
+        
+        with profile_gene('GENE1') as profile:
+            with stage('saddlepoint'):
+                saddlepoint(50, lambdas, weights)
+            with stage('saddlepoint'):
+                count('extra', 3)
+        
+        self.assertIsNone(profiling._ACTIVE)
+        self.assertEqual(set(profile.times), {'saddlepoint', 'total'})
+        self.assertLessEqual(profile.times['saddlepoint'], profile.times['total'])
+        self.assertGreater(profile.counts['solver_iterations'], 0)
+        self.assertGreater(profile.counts['batch_x_values'], 0)
+        self.assertEqual(profile.counts['extra'], 3)
+        
+        record = profile.to_dict()
+        self.assertEqual(record['symbol'], 'GENE1')
+        self.assertEqual(record['time_saddlepoint'], profile.times['saddlepoint'])
+        self.assertEqual(record['extra'], 3)
+    
+    def test_write_profiles(self):
+        ''' check that profiles load back into one table, from JSON or tsv
+        '''
+        records = [{'symbol': 'A', 'host': 'h', 'pid': 1, 'time_total': 0.5,
+            'approximate_calls': 2}, {'symbol': 'B', 'host': 'h', 'pid': 2,
+            'time_total': 0.25, 'time_tabix': 0.1}]
+        
+        paths = [os.path.join(self.folder, 'a.json'), os.path.join(self.folder, 'b.tsv')]
+        write_profiles(records[:1], paths[0])
+        write_profiles(records[1:], paths[1])
+        
+        table = read_profiles(paths)
+        self.assertTrue(table.equals(profile_table(records)))
+        self.assertEqual(list(table.columns), ['symbol', 'host', 'pid',
+            'approximate_calls', 'time_tabix', 'time_total'])
+        self.assertEqual(list(table['approximate_calls']), [2, 0])
+    
+    def test_score_genes_profiles(self):
+        ''' check that scoring genes gives a profile for every gene
+        '''
+        store = SiteStore(self.folder, create=True)
+        for symbol in ['GENE1', 'GENE2']:
+            store.add(symbol, random_sites(symbol, 100, missense=True))
+        store.write_index()
+        
+        de_novos = {x: store[x].to_frame().iloc[[5, 9]] for x in store}
+        profiles = []
+        results = dict(score_genes(['GENE1', 'GENE2'], de_novos, 100, 100,
+            None, store=self.folder, profiles=profiles))
+        
+        self.assertEqual(list(results), ['GENE1', 'GENE2'])
+        self.assertEqual([x['symbol'] for x in profiles], ['GENE1', 'GENE2'])
+        for profile in profiles:
+            self.assertGreater(profile['time_total'], 0)
+            self.assertIn('time_store_read', profile)
+            self.assertIn('time_saddlepoint', profile)
+            self.assertGreater(profile['solver_iterations'], 0)
+        
+        # profiling is off unless asked for
+        list(score_genes(['GENE1'], de_novos, 100, 100, None, store=self.folder))
+        self.assertIsNone(profiling._ACTIVE)
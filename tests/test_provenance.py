@@ -0,0 +1,84 @@
+# unit testing for the fitDNM functions
+
+import unittest
+import tempfile
+import shutil
+
+import pandas
+from numpy.random import seed
+
+from fitDNM.provenance import (de_novo_keys, gene_provenance,
+    store_provenance, reuse_previous)
+from fitDNM.site_store import SiteStore
+from tests.random_sites import random_sites
+
+class TestProvenancePy(unittest.TestCase):
+    ''' check hashing gene inputs, to find genes which need scoring again
+    '''
+    
+    def setUp(self):
+        seed(1)
+        self.folder = tempfile.mkdtemp()
+        self.de_novos = pandas.DataFrame({'gene': ['GENE1', 'GENE1'],
+            'chrom': ['1', '1'], 'pos': [20, 10], 'ref': ['A', 'C'],
+            'alt': ['G', 'T']})
+    
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+    
+    def test_de_novo_keys(self):
+        ''' check de novo keys do not depend on the row order
+        '''
+        self.assertEqual(de_novo_keys(self.de_novos), ['1:10:C:T', '1:20:A:G'])
+        self.assertEqual(de_novo_keys(self.de_novos[::-1]), de_novo_keys(self.de_novos))
+        self.assertEqual(de_novo_keys(None), [])
+    
+    def test_gene_provenance(self):
+        ''' check the hash changes with each input
+        '''
+        options = {'method': 'newton'}
+        base = gene_provenance(self.de_novos, 10, 20, 'abc', options)
+        self.assertEqual(base, gene_provenance(self.de_novos[::-1], 10, 20,
+            'abc', options))
+        
+        changed = [gene_provenance(self.de_novos[:1], 10, 20, 'abc', options),
+            gene_provenance(self.de_novos, 11, 20, 'abc', options),
+            gene_provenance(self.de_novos, 10, 21, 'abc', options),
+            gene_provenance(self.de_novos, 10, 20, 'abd', options),
+            gene_provenance(self.de_novos, 10, 20, 'abc', {'method': 'legacy'})]
+        self.assertEqual(len(set([base] + changed)), 6)
+    
+    def test_store_provenance(self):
+        ''' check hashes follow changes to the sites in a store
+        '''
+        store = SiteStore(self.folder, create=True)
+        store.add('GENE1', random_sites('GENE1', 50, missense=True))
+        store.write_index()
+        
+        de_novos = {'GENE1': self.de_novos}
+        first = store_provenance(['GENE1', 'GENE2'], de_novos, 10, 20,
+            self.folder, {})
+        self.assertEqual(first, store_provenance(['GENE1', 'GENE2'], de_novos,
+            10, 20, self.folder, {}))
+        
+        store.add('GENE1', random_sites('GENE1', 50, missense=True))
+        store.write_index()
+        second = store_provenance(['GENE1', 'GENE2'], de_novos, 10, 20,
+            self.folder, {})
+        self.assertNotEqual(first['GENE1'], second['GENE1'])
+        self.assertEqual(first['GENE2'], second['GENE2'])
+    
+    def test_reuse_previous(self):
+        ''' check which genes from a previous run are kept
+        '''
+        previous = pandas.DataFrame({'symbol': ['A', 'B', 'C'],
+            'p_value': [0.1, 0.2, 0.3], 'provenance': ['a', 'b', 'c']})
+        
+        # B changed, C lost its de novos, and D is new
+        kept, rescore = reuse_previous(previous, {'A': 'a', 'B': 'x', 'D': 'd'})
+        self.assertEqual(list(kept['symbol']), ['A'])
+        self.assertEqual(list(kept['p_value']), [0.1])
+        self.assertEqual(rescore, ['B', 'D'])
+        
+        with self.assertRaises(ValueError):
+            reuse_previous(previous.drop(columns='provenance'), {'A': 'a'})
@@ -0,0 +1,121 @@
+# unit testing for the fitDNM functions
+
+import io
+import os
+import sys
+import unittest
+from contextlib import redirect_stdout
+import tempfile
+import shutil
+
+import pandas
+
+from fitDNM.results import ResultWriter, format_value
+
+class TestResultsPy(unittest.TestCase):
+    ''' check writing results as they are computed, and resuming
+    '''
+    
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'output.txt')
+        self.columns = ['symbol', 'de_novos', 'p_value']
+    
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+    
+    def test_format_value(self):
+        ''' check missing values are written as NA
+        '''
+        self.assertEqual(format_value(None), 'NA')
+        self.assertEqual(format_value(float('nan')), 'NA')
+        self.assertEqual(format_value(0.1), '0.1')
+        self.assertEqual(format_value(True), 'True')
+    
+    def test_write(self):
+        ''' check rows are in the file as soon as they are written
+        '''
+        with ResultWriter(self.path, self.columns) as writer:
+            writer.write({'symbol': 'A', 'de_novos': 1, 'p_value': 0.5})
+            with open(self.path) as handle:
+                self.assertEqual(handle.read(), 'symbol\tde_novos\tp_value\nA\t1\t0.5\n')
+            writer.write([{'symbol': 'B', 'de_novos': 2, 'p_value': None},
+                {'symbol': 'C', 'de_novos': 3}])
+            self.assertEqual(writer.done, {'A', 'B', 'C'})
+        
+        table = pandas.read_table(self.path)
+        self.assertEqual(list(table['symbol']), ['A', 'B', 'C'])
+        self.assertEqual(table['p_value'].isnull().sum(), 2)
+        
+        # without resume, the table is replaced
+        with ResultWriter(self.path, self.columns) as writer:
+            self.assertEqual(writer.done, set())
+        self.assertEqual(len(pandas.read_table(self.path)), 0)
+    
+    def test_resume(self):
+        ''' check resuming keeps finished rows, and drops a partial last line
+        '''
+        with open(self.path, 'w') as handle:
+            handle.write('symbol\tde_novos\tp_value\nA\t1\t0.5\nB\t2\t0.')
+        
+        with ResultWriter(self.path, self.columns, resume=True) as writer:
+            self.assertEqual(writer.done, {'A'})
+            writer.write({'symbol': 'B', 'de_novos': 2, 'p_value': 0.25})
+        
+        with open(self.path) as handle:
+            self.assertEqual(handle.read(),
+                'symbol\tde_novos\tp_value\nA\t1\t0.5\nB\t2\t0.25\n')
+        
+        # resuming from a missing, or partly written header, starts afresh
+        os.remove(self.path)
+        with ResultWriter(self.path, self.columns, resume=True) as writer:
+            self.assertEqual(writer.done, set())
+        with open(self.path, 'w') as handle:
+            handle.write('symbol\tde_')
+        with ResultWriter(self.path, self.columns, resume=True) as writer:
+            self.assertEqual(writer.done, set())
+        self.assertEqual(list(pandas.read_table(self.path).columns), self.columns)
+        
+        # tables with other columns cannot be resumed
+        with self.assertRaises(ValueError):
+            ResultWriter(self.path, ['symbol', 'p_value'], resume=True)
+    
+    def test_resume_grouped(self):
+        ''' check resuming drops every row of the last gene, when a gene's rows
+        are written together
+        '''
+        columns = ['cohort', 'symbol', 'p_value']
+        rows = [{'cohort': x, 'symbol': y, 'p_value': 0.5} for y in 'AB'
+            for x in ['one', 'two']]
+        with ResultWriter(self.path, columns) as writer:
+            writer.write(rows[:2])
+            writer.write(rows[2:])
+        
+        # a run killed while writing the rows for B leaves some of them
+        with open(self.path) as handle:
+            complete = handle.read()
+        with open(self.path, 'w') as handle:
+            handle.write(complete[:-2])
+        
+        with ResultWriter(self.path, columns, resume=True, grouped=True) as writer:
+            self.assertEqual(writer.done, {'A'})
+            writer.write(rows[2:])
+        with open(self.path) as handle:
+            self.assertEqual(handle.read(), complete)
+        
+        # without a partial line, the last gene is still redone
+        with ResultWriter(self.path, columns, resume=True, grouped=True) as writer:
+            self.assertEqual(writer.done, {'A'})
+    
+    def test_stream(self):
+        ''' check rows can be written to standard output, which is left open
+        '''
+        with redirect_stdout(io.StringIO()) as output:
+            with ResultWriter(sys.stdout, self.columns) as writer:
+                writer.write({'symbol': 'A', 'de_novos': 1, 'p_value': 0.5})
+            self.assertFalse(output.closed)
+            self.assertEqual(writer.done, {'A'})
+        self.assertEqual(output.getvalue(), 'symbol\tde_novos\tp_value\nA\t1\t0.5\n')
+        
+        with self.assertRaises(ValueError):
+            ResultWriter(sys.stdout, self.columns, resume=True)
@@ -7,7 +7,9 @@ from math import isnan
 from numpy import array
 from numpy.random import beta, uniform, normal, seed
 
-from fitDNM.saddlepoint import saddlepoint
+from scipy.stats import poisson
+
+from fitDNM.saddlepoint import saddlepoint, saddlepoint_with_bound, poisson_tail_end
 
 class TestDoubleSaddlePointPy(unittest.TestCase):
     ''' double saddle point approximation checks
@@ -24,8 +26,10 @@ class TestDoubleSaddlePointPy(unittest.TestCase):
         y = 1
         lambdas = normal(size=1000, loc=1e-4, scale=1e-5)
         weights = beta(size=1000, a=0.5, b=0.5)
-        self.assertAlmostEqual(saddlepoint(
-            y, lambdas, weights), 0.0022951333364715112, delta=1e-12)
+        self.assertAlmostEqual(saddlepoint(y, lambdas, weights, method='legacy'),
+            0.0022951333364715112, delta=1e-12)
+        self.assertAlmostEqual(saddlepoint(y, lambdas, weights),
+            0.0023259272009774016, delta=1e-12)
     
     def test_saddlepoint_zero_values(self):
         '''saddlepoint output is correct when the start value equals 0
@@ -48,4 +52,74 @@ class TestDoubleSaddlePointPy(unittest.TestCase):
         y = 1
         lambdas = normal(size=1000, loc=1e-5, scale=1e-5)
         weights = uniform(size=1000)
-        self.assertEqual(saddlepoint(y, lambdas, weights), 2.7451994001564722e-05)
+        self.assertAlmostEqual(saddlepoint(y, lambdas, weights, method='legacy'),
+            2.7451994001564722e-05, delta=1e-14)
+        self.assertAlmostEqual(saddlepoint(y, lambdas, weights),
+            2.757161202630446e-05, delta=1e-14)
+    
+    def test_saddlepoint_block_size(self):
+        '''saddlepoint output does not depend on how x values are batched
+        '''
+        
+        y = 1
+        lambdas = normal(size=1000, loc=1e-4, scale=1e-5)
+        weights = beta(size=1000, a=0.5, b=0.5)
+        
+        expected = saddlepoint(y, lambdas, weights, block_size=1)
+        for block_size in [2, 3, 8, 100]:
+            self.assertAlmostEqual(saddlepoint(y, lambdas, weights,
+                block_size=block_size), expected, delta=1e-14)
+    
+    def test_saddlepoint_with_bound(self):
+        ''' check the p-value from a Poisson-chosen range of x values
+        '''
+        
+        lambdas = normal(size=1000, loc=1e-4, scale=1e-5)
+        weights = beta(size=1000, a=0.5, b=0.5)
+        
+        for y in [1, 3, 10]:
+            expected = saddlepoint(y, lambdas, weights)
+            p_value, bound = saddlepoint_with_bound(y, lambdas, weights)
+            self.assertAlmostEqual(p_value / expected, 1, places=6)
+            self.assertLess(bound, p_value * 1e-6)
+        
+        # a looser tail gives a larger bound, from fewer x values
+        p_value, bound = saddlepoint_with_bound(1, lambdas, weights, tail=1e-3)
+        self.assertGreater(bound, 1e-12)
+        self.assertLess(abs(p_value - saddlepoint(1, lambdas, weights)), bound)
+        
+        # genes with high rates need x values past 100. Every de novo has a
+        # positive score, so p is close to one.
+        p_value, bound = saddlepoint_with_bound(1, lambdas * 1000, weights)
+        self.assertAlmostEqual(p_value, 1, places=6)
+        
+        self.assertEqual(saddlepoint_with_bound(0, lambdas, weights), (1.0, 0.0))
+        self.assertTrue(isnan(saddlepoint_with_bound(1, lambdas, weights * 0)[0]))
+    
+    def test_saddlepoint_high_rate(self):
+        ''' check genes with total rates over 100 sum the x values past 100
+        '''
+        lambdas = normal(size=1000, loc=1e-4, scale=1e-5)
+        weights = beta(size=1000, a=0.5, b=0.5)
+        
+        for total in [120, 300]:
+            scaled = lambdas * total / lambdas.sum()
+            y = 1.05 * (scaled * weights).sum()
+            expected, _ = saddlepoint_with_bound(y, scaled, weights)
+            self.assertGreater(expected, 0.1)
+            self.assertAlmostEqual(saddlepoint(y, scaled, weights) / expected, 1, places=3)
+    
+    def test_poisson_tail_end(self):
+        ''' check the bound on the Poisson tail above the end
+        '''
+        
+        for mu in [1e-3, 0.5, 5, 50]:
+            for start in [1, 3, 10]:
+                end, bound = poisson_tail_end(start, mu, -30)
+                self.assertGreaterEqual(end, start)
+                self.assertLessEqual(bound, 1e-13)
+                self.assertLessEqual(poisson.sf(end, mu), bound * (1 + 1e-9))
+        
+        # tails far below what poisson.isf() resolves
+        end, bound = poisson_tail_end(1, 1e-3, -1000)
+        self.assertLess(bound, 1e-300)
@@ -0,0 +1,71 @@
+# unit testing for the fitDNM functions
+
+import unittest
+import tempfile
+import shutil
+
+import pandas
+from numpy.random import seed
+
+from fitDNM.scheduler import score_genes, _drop_failures
+from fitDNM.site_store import SiteStore
+from tests.random_sites import random_sites
+
+class TestSchedulerPy(unittest.TestCase):
+    ''' checks for scoring many genes
+    '''
+    
+    def setUp(self):
+        seed(1)
+        self.folder = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+    
+    def test_drop_failures(self):
+        ''' check that failed and unscorable genes are dropped, in order
+        '''
+        
+        results = [('A', {'symbol': 'A'}, None), ('B', None, 'Traceback'),
+            ('C', None, None), ('D', {'symbol': 'D'}, None)]
+        
+        with self.assertLogs(level='ERROR'):
+            kept = list(_drop_failures(results))
+        
+        self.assertEqual(kept, [('A', {'symbol': 'A'}), ('D', {'symbol': 'D'})])
+    
+    def test_score_genes_failures(self):
+        ''' check that genes which cannot be scored do not stop the run
+        '''
+        
+        de_novos = pandas.DataFrame({'gene': ['NOT_A_GENE1', 'NOT_A_GENE2'],
+            'chrom': ['1', '1'], 'pos': [1, 2], 'ref': ['A', 'C'], 'alt': ['G', 'T']})
+        
+        for jobs in [1, 2]:
+            scored = list(score_genes(set(de_novos['gene']), de_novos, 10, 10,
+                'missing.txt.gz', rates_path=None, jobs=jobs))
+            self.assertEqual(scored, [])
+    
+    def test_score_genes_parallel(self):
+        ''' check that scoring genes in parallel matches scoring them serially
+        '''
+        store = SiteStore(self.folder, create=True)
+        de_novos = []
+        for i, length in enumerate([40, 25, 60, 30]):
+            symbol = f'GENE{i}'
+            sites = random_sites(symbol, length)
+            store.add(symbol, sites)
+            de_novos.append(sites.to_frame().iloc[[i, 2 * length + 3]])
+        store.write_index()
+        de_novos = pandas.concat(de_novos)[['gene', 'chrom', 'pos', 'ref', 'alt']]
+        
+        symbols = set(de_novos['gene'])
+        serial = list(score_genes(symbols, de_novos, 1000, 1000, None,
+            store=self.folder, jobs=1))
+        parallel = list(score_genes(symbols, de_novos, 1000, 1000, None,
+            store=self.folder, jobs=2))
+        
+        self.assertEqual([x for x, _ in serial], ['GENE0', 'GENE1', 'GENE2', 'GENE3'])
+        self.assertEqual(parallel, serial)
+        self.assertTrue(all(x['de_novos'] == 2 for _, x in serial))
+        self.assertTrue(all(0 < x['p_value'] <= 1 for _, x in serial))
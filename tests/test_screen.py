@@ -0,0 +1,54 @@
+# unit testing for the fitDNM functions
+
+import unittest
+
+from numpy import array
+from numpy.random import uniform, normal, seed
+from scipy.stats import poisson
+
+from fitDNM.screen import lower_bound_p
+
+class TestScreenPy(unittest.TestCase):
+    ''' check the lower bound used to screen genes
+    '''
+    
+    def setUp(self):
+        seed(1)
+    
+    def test_lower_bound_p(self):
+        ''' check the lower bound against the exact p-value of a small gene
+        '''
+        
+        lambdas = array([0.01, 0.02, 0.05])
+        weights = array([5.0, 3.0, 1.0])
+        
+        # a single de novo at the top site is the only quick way past 4
+        self.assertAlmostEqual(lower_bound_p(4, lambdas, weights),
+            poisson.sf(0, 0.01))
+        
+        # no single site reaches 6, but two de novos at sites with weights of
+        # at least 3 do
+        self.assertAlmostEqual(lower_bound_p(6, lambdas, weights),
+            poisson.sf(1, 0.03))
+        
+        # scores of zero or below are always reached
+        self.assertEqual(lower_bound_p(0, lambdas, weights), 1.0)
+        
+        # sites with negative weights could pull the score back down
+        weights = array([5.0, 3.0, -1.0])
+        self.assertAlmostEqual(lower_bound_p(4, lambdas, weights),
+            poisson.sf(0, 0.01) * poisson.pmf(0, 0.05))
+    
+    def test_lower_bound_simulated(self):
+        ''' check the bound is below the p-value from simulated scores
+        '''
+        
+        lambdas = 10**normal(size=200, loc=-2, scale=0.5)
+        weights = uniform(low=0, high=30, size=200)
+        
+        draws = poisson.rvs(lambdas, size=(20000, 200))
+        scores = (draws * weights).sum(axis=1)
+        
+        for y in [5, 20, 40, 60]:
+            simulated = (scores >= y).mean()
+            self.assertLessEqual(lower_bound_p(y, lambdas, weights), simulated + 0.01)
@@ -0,0 +1,131 @@
+# unit testing for the fitDNM functions
+
+import os
+import json
+import unittest
+import tempfile
+import shutil
+
+import pandas
+from numpy.random import randint, seed
+
+from fitDNM.shards import (coding_sites, gene_weights, assign_shards,
+    write_manifest, merge_shards, MANIFEST_SUFFIX)
+
+class Transcript:
+    def __init__(self, cds):
+        self.cds = [{'start': x, 'end': y} for x, y in cds]
+
+class Gene:
+    def __init__(self, transcripts, canonical=None):
+        self.transcripts = transcripts
+        self._canonical = canonical
+    
+    @property
+    def canonical(self):
+        if self._canonical is None:
+            raise ValueError('no canonical transcript')
+        return self._canonical
+
+class TestShardsPy(unittest.TestCase):
+    ''' check splitting genes over shards, and merging the shard outputs
+    '''
+    
+    def setUp(self):
+        seed(1)
+        self.folder = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+    
+    def test_coding_sites(self):
+        ''' check sites are counted from the canonical, or longest, transcript
+        '''
+        short = Transcript([(1, 10), (21, 30)])
+        long = Transcript([(1, 100)])
+        self.assertEqual(coding_sites(Gene([short, long], short)), 60)
+        self.assertEqual(coding_sites(Gene([short, long])), 300)
+        self.assertEqual(coding_sites(Gene([])), 0)
+    
+    def test_gene_weights(self):
+        ''' check genes missing from the annotations, or without any coding
+        sites, still weigh 1
+        '''
+        genes = {'A': Gene([Transcript([(1, 10)])]), 'B': Gene([])}
+        self.assertEqual(gene_weights(['A', 'B', 'C'], genes=genes),
+            {'A': 30, 'B': 1, 'C': 1})
+        self.assertEqual(gene_weights(['A', 'B']), {'A': 1, 'B': 1})
+    
+    def test_assign_shards(self):
+        ''' check shards split the genes, with balanced weights
+        '''
+        weights = {f'GENE{i}': int(x) for i, x in enumerate(randint(1, 1000, size=200))}
+        shards = assign_shards(weights, 7)
+        
+        self.assertEqual(len(shards), 7)
+        self.assertEqual(sorted(x for shard in shards for x in shard), sorted(weights))
+        totals = [sum(weights[x] for x in shard) for shard in shards]
+        self.assertLess(max(totals) - min(totals), max(weights.values()))
+        
+        # the split only depends on the weights, not the order of the genes
+        reordered = dict(sorted(weights.items(), reverse=True))
+        self.assertEqual(assign_shards(reordered, 7), shards)
+        
+        # a single heavy gene gets a shard to itself
+        shards = assign_shards({'A': 10, 'B': 3, 'C': 3, 'D': 3}, 2)
+        self.assertEqual(shards, [['A'], ['B', 'C', 'D']])
+    
+    def write_shard(self, shard, symbols, assigned, scored):
+        ''' write a shard's output table and manifest
+        '''
+        path = os.path.join(self.folder, f'shard{shard}.txt')
+        table = pandas.DataFrame({'symbol': scored,
+            'p_value': [0.1 * (i + 1) for i in range(len(scored))]})
+        table.to_csv(path, sep='\t', index=False)
+        write_manifest(path, shard, 2, symbols, assigned, scored)
+        return path
+    
+    def test_merge_shards(self):
+        ''' check shard outputs are merged, and incomplete sets are rejected
+        '''
+        symbols = ['A', 'B', 'C', 'D']
+        first = self.write_shard(1, symbols, ['A', 'C'], ['C', 'A'])
+        second = self.write_shard(2, symbols, ['B', 'D'], ['B'])
+        output = os.path.join(self.folder, 'merged.txt')
+        
+        merged = merge_shards([second, first], output)
+        self.assertEqual(list(merged['symbol']), ['A', 'B', 'C'])
+        with open(output) as handle:
+            self.assertEqual(handle.read(),
+                'symbol\tp_value\nA\t0.2\nB\t0.1\nC\t0.1\n')
+        
+        # shards must all be present, and only once
+        with self.assertRaises(ValueError):
+            merge_shards([first], output)
+        with self.assertRaises(ValueError):
+            merge_shards([first, first], output)
+        
+        # a shard which did not finish has no manifest
+        os.remove(second + MANIFEST_SUFFIX)
+        with self.assertRaises(ValueError):
+            merge_shards([first, second], output)
+        
+        # a gene in two shards is caught
+        second = self.write_shard(2, symbols, ['B', 'D'], ['B', 'C'])
+        with self.assertRaises(ValueError):
+            merge_shards([first, second], output)
+        
+        # as are outputs which lost rows after the shard finished
+        second = self.write_shard(2, symbols, ['B', 'D'], ['B', 'D'])
+        with open(second + MANIFEST_SUFFIX) as handle:
+            manifest = json.load(handle)
+        manifest['scored'].append('E')
+        with open(second + MANIFEST_SUFFIX, 'w') as handle:
+            json.dump(manifest, handle)
+        with self.assertRaises(ValueError):
+            merge_shards([first, second], output)
+        
+        # and shards from a split of different genes
+        second = self.write_shard(2, symbols + ['E'], ['B', 'D'], ['B', 'D'])
+        with self.assertRaises(ValueError):
+            merge_shards([first, second], output)
@@ -0,0 +1,103 @@
+# unit testing for the fitDNM functions
+
+import os
+import unittest
+import tempfile
+import shutil
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import pandas
+from numpy.random import seed
+
+from fitDNM.gene_enrichment import enrichment, harmonise_data
+from fitDNM.site_store import SiteStore, load_site_store
+from tests.random_sites import random_tables, random_sites
+
+class TestSiteStorePy(unittest.TestCase):
+    ''' check the per-gene site store
+    '''
+    
+    def setUp(self):
+        seed(1)
+        self.folder = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+    
+    def test_round_trip(self):
+        ''' check that stored sites load back unchanged, including the index
+        '''
+        severity, rates = random_tables('GENE1', 50)
+        sites = harmonise_data(rates, severity, 'GENE1')
+        
+        store = SiteStore(self.folder, create=True)
+        store.add('GENE1', sites)
+        store.write_index()
+        
+        # reload the store from disk, to check the index was written
+        store = SiteStore(self.folder)
+        self.assertEqual(list(store), ['GENE1'])
+        self.assertIn('GENE1', store)
+        self.assertNotIn('GENE2', store)
+        self.assertEqual(store.index['GENE1']['sites'], len(sites))
+        self.assertEqual(store.index['GENE1']['start'], 1)
+        self.assertEqual(store.index['GENE1']['end'], 50)
+        self.assertEqual(store.digest('GENE1'), store.index['GENE1']['digest'])
+        self.assertEqual(len(store.digest('GENE1')), 40)
+        
+        loaded = store['GENE1']
+        pandas.testing.assert_frame_equal(loaded.to_frame(), sites.to_frame())
+        
+        with self.assertRaises(KeyError):
+            store['GENE2']
+    
+    def test_missing_store(self):
+        ''' check reading a missing store fails, rather than making an empty one
+        '''
+        missing = os.path.join(self.folder, 'missing')
+        with self.assertRaises(FileNotFoundError):
+            SiteStore(missing)
+        self.assertFalse(os.path.exists(missing))
+        
+        # a folder without an index is not a store either
+        with self.assertRaises(FileNotFoundError):
+            SiteStore(self.folder)
+        
+        # but a new store can be started there
+        store = SiteStore(missing, create=True)
+        self.assertEqual(len(store), 0)
+        self.assertTrue(os.path.exists(missing))
+    
+    def test_load_site_store(self):
+        ''' check the store is opened once per process, until its index changes
+        '''
+        store = SiteStore(self.folder, create=True)
+        store.add('GENE1', random_sites('GENE1', 10))
+        store.write_index()
+        
+        opened = load_site_store(self.folder)
+        self.assertIs(load_site_store(self.folder), opened)
+        self.assertEqual(list(opened), ['GENE1'])
+        
+        store.add('GENE2', random_sites('GENE2', 10))
+        store.write_index()
+        self.assertEqual(list(load_site_store(self.folder)), ['GENE1', 'GENE2'])
+    
+    def test_enrichment_from_store(self):
+        ''' check that enrichment from stored sites matches the original tables
+        '''
+        de_novos = pandas.read_table(StringIO('gene chrom pos alt ref\n'
+            'GENE1 1 1 G C\nGENE1 1 2 A T\n'), sep=r'\s+', dtype={'chrom': str})
+        severity, rates = random_tables('GENE1', 100)
+        
+        store = SiteStore(self.folder, create=True)
+        store.add('GENE1', harmonise_data(rates, severity, 'GENE1'))
+        
+        expected = enrichment(de_novos, 100, 100, 'GENE1', severity, rates)
+        stored = enrichment(de_novos, 100, 100, 'GENE1', sites=store['GENE1'])
+        
+        self.assertEqual(stored, expected)
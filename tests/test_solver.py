@@ -6,7 +6,7 @@ import random
 from numpy import array
 from numpy.random import beta, uniform, normal
 
-from fitDNM.solver import solve_s_u
+from fitDNM.solver import solve_s_u, solve_s_u_batch
 
 class TestSolverPy(unittest.TestCase):
     '''solver checks
@@ -20,7 +20,7 @@ class TestSolverPy(unittest.TestCase):
         y = 1
         lambdas = array([1e-8] * 6)
         weights = array([0.05] * 6)
-        values = solve_s_u(x, y, lambdas, weights)
+        values = solve_s_u(x, y, lambdas, weights, method='legacy')
         
         self.assertAlmostEqual(values['mu'], 14195, delta=1e-14)
         self.assertAlmostEqual(values['s'], -693.12107872527565178, delta=1e-12)
@@ -30,7 +30,7 @@ class TestSolverPy(unittest.TestCase):
         y = 1
         lambdas = array([1e-8] * 10)
         weights = array([0.1] * 10)
-        values = solve_s_u(x, y, lambdas, weights)
+        values = solve_s_u(x, y, lambdas, weights, method='legacy')
         
         self.assertAlmostEqual(values['mu'], 7095, delta=1e-14)
         self.assertAlmostEqual(values['s'], -692.68875716848174307, delta=1e-12)
@@ -43,7 +43,7 @@ class TestSolverPy(unittest.TestCase):
         y = 1
         lambdas = array([1e-8] * 6)
         weights = array([0.05] * 6)
-        values = solve_s_u(x, y, lambdas, weights, delta=200)
+        values = solve_s_u(x, y, lambdas, weights, delta=200, method='legacy')
         
         self.assertAlmostEqual(values['mu'], 14100, delta=1e-14)
         self.assertAlmostEqual(values['s'], -688.37107872527565178, delta=1e-12)
@@ -57,7 +57,57 @@ class TestSolverPy(unittest.TestCase):
         lambdas = array([1e-6] * 100)
         weights = array([ (i + 1)/100.0 for i in range(100) ])
         start = 10
-        values = solve_s_u(x, y, lambdas, weights, start=start)
+        values = solve_s_u(x, y, lambdas, weights, start=start, method='legacy')
         
         self.assertAlmostEqual(values['mu'], 69.31475000000003206, delta=1e-13)
         self.assertAlmostEqual(values['s'], -56.192386303155750227, delta=1e-13)
+    
+    def test_solve_s_u_newton(self):
+        '''solve_s_u output is correct with the newton solver
+        '''
+        
+        x = 1
+        y = 0.99
+        lambdas = array([1e-6] * 100)
+        weights = array([ (i + 1)/100.0 for i in range(100) ])
+        values = solve_s_u(x, y, lambdas, weights, start=10)
+        
+        # the root is where the mean of the tilted weights equals y / x
+        self.assertAlmostEqual(values['mu'], 69.314718055994530942, delta=1e-8)
+        self.assertAlmostEqual(values['s'], -56.192354678590323, delta=1e-8)
+        
+        # and the newton solver lands within the legacy search precision
+        legacy = solve_s_u(x, y, lambdas, weights, start=10, method='legacy')
+        self.assertAlmostEqual(values['mu'], legacy['mu'], delta=1e-4)
+        
+        # when there is no root, both solvers stop at the overflow bound
+        lambdas = array([1e-8] * 6)
+        weights = array([0.05] * 6)
+        values = solve_s_u(1, 1, lambdas, weights)
+        self.assertAlmostEqual(values['mu'], 14195.6, delta=1e-6)
+        
+        with self.assertRaises(ValueError):
+            solve_s_u(1, 1, lambdas, weights, method='unknown')
+    
+    def test_solve_s_u_batch(self):
+        '''solve_s_u_batch matches solve_s_u for each x value
+        '''
+        
+        y = 0.99
+        lambdas = array([1e-6] * 100)
+        weights = array([ (i + 1)/100.0 for i in range(100) ])
+        x = [1, 2, 3, 5, 8]
+        
+        for method in ['legacy', 'newton']:
+            values = solve_s_u_batch(x, y, lambdas, weights, start=10, method=method)
+            
+            for i, x_val in enumerate(x):
+                expected = solve_s_u(x_val, y, lambdas, weights, start=10, method=method)
+                self.assertAlmostEqual(values['mu'][i], expected['mu'], delta=1e-13)
+                self.assertAlmostEqual(values['s'][i], expected['s'], delta=1e-12)
+        
+        # check an x value which overflows before the sign changes
+        values = solve_s_u_batch([1], 1, array([1e-8] * 6), array([0.05] * 6),
+            method='legacy')
+        self.assertAlmostEqual(values['mu'][0], 14195, delta=1e-14)
+        self.assertAlmostEqual(values['s'][0], -693.12107872527565178, delta=1e-12)
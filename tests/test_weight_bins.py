@@ -0,0 +1,82 @@
+# unit testing for the fitDNM functions
+
+import unittest
+
+import numpy
+from numpy.random import uniform, normal, seed
+
+from fitDNM.gene_sites import downweight_scores
+from fitDNM.saddlepoint import saddlepoint, saddlepoint_with_bound
+from fitDNM.weight_bins import (collapse_weights, bin_weights, compress_sites,
+    score_shift)
+
+class TestWeightBinsPy(unittest.TestCase):
+    ''' check collapsing sites by their weights
+    '''
+    
+    def setUp(self):
+        seed(1)
+        
+        # CADD-like scores, given to one decimal place
+        pos = numpy.repeat(numpy.arange(500), 3)
+        self.probs = 10**(normal(size=1500, loc=-8, scale=0.5)) * 4000
+        scores = numpy.round(uniform(low=0, high=30, size=1500), 1)
+        self.weights = downweight_scores(pos, self.probs / 4000, scores)
+    
+    def test_collapse_weights(self):
+        ''' check sites with equal weights are merged
+        '''
+        weights, probs = collapse_weights(numpy.array([2.0, 1.0, 2.0, 3.0]),
+            numpy.array([0.1, 0.2, 0.3, 0.4]))
+        self.assertEqual(list(weights), [1.0, 2.0, 3.0])
+        self.assertTrue(numpy.allclose(probs, [0.2, 0.4, 0.4]))
+    
+    def test_bin_weights(self):
+        ''' check binned weights stay within the shift, and keep the mean
+        '''
+        for resolution in [0.01, 0.1, 1.0]:
+            weights, probs, shift = bin_weights(self.weights, self.probs, resolution)
+            self.assertLess(len(weights), len(self.weights))
+            self.assertLessEqual(shift, resolution)
+            self.assertTrue((numpy.diff(weights) > 0).all())
+            self.assertAlmostEqual(probs.sum(), self.probs.sum())
+            self.assertAlmostEqual((weights * probs).sum(),
+                (self.weights * self.probs).sum())
+        
+        weights, probs, shift = bin_weights([], [], 0.1)
+        self.assertEqual((len(weights), len(probs), shift), (0, 0, 0.0))
+    
+    def test_compress_sites(self):
+        ''' check p-values from collapsed sites match the per site p-values
+        '''
+        lambdas, weights, shift = compress_sites(self.probs, self.weights)
+        self.assertIs(lambdas, self.probs)
+        self.assertEqual(shift, 0.0)
+        
+        expected = saddlepoint(30, self.probs, self.weights)
+        
+        lambdas, weights, shift = compress_sites(self.probs, self.weights, 'exact')
+        self.assertEqual(shift, 0.0)
+        self.assertAlmostEqual(saddlepoint(30, lambdas, weights) / expected, 1, places=10)
+        
+        lambdas, weights, shift = compress_sites(self.probs, self.weights, 0.01)
+        self.assertLess(len(weights), len(self.weights) / 2)
+        self.assertAlmostEqual(saddlepoint(30, lambdas, weights) / expected, 1, places=4)
+    
+    def test_score_shift(self):
+        ''' check the unbinned p-value lies within the binned p-values at the
+        observed score, plus and minus the score shift
+        '''
+        for y in [10, 30, 60]:
+            expected, tail = saddlepoint_with_bound(y, self.probs, self.weights)
+            lambdas, weights, shift = compress_sites(self.probs, self.weights, 0.5)
+            moved = score_shift(y, lambdas, weights, shift)
+            self.assertGreater(moved, shift)
+            
+            upper, upper_tail = saddlepoint_with_bound(y - moved, lambdas, weights)
+            lower, _ = saddlepoint_with_bound(y + moved, lambdas, weights)
+            self.assertLessEqual(lower, expected + tail)
+            self.assertLessEqual(expected, upper + upper_tail)
+        
+        self.assertEqual(score_shift(30, lambdas, weights, 0.0), 0.0)
+        self.assertEqual(score_shift(0, lambdas, weights, shift), 0.0)